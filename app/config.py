@@ -0,0 +1,96 @@
+import os
+from typing import Tuple
+
+
+def _rate(name: str, default: str) -> Tuple[float, float]:
+    # "запросов в секунду/запас"
+    rate, burst = os.getenv(name, default).split("/")
+    return float(rate), float(burst)
+
+
+# Сколько последних сделок хранится в ленте каждого тикера
+TRADE_TAPE_SIZE = int(os.getenv("TRADE_TAPE_SIZE", "1000"))
+
+# Сколько последних свечей хранится на тикер для каждого интервала
+CANDLE_RETENTION = {
+    "1s": int(os.getenv("CANDLE_RETENTION_1S", "3600")),
+    "1m": int(os.getenv("CANDLE_RETENTION_1M", "1440")),
+    "5m": int(os.getenv("CANDLE_RETENTION_5M", "2016")),
+    "1h": int(os.getenv("CANDLE_RETENTION_1H", "720")),
+    "1d": int(os.getenv("CANDLE_RETENTION_1D", "365")),
+}
+
+# Максимум заявок в одном пакетном запросе
+BATCH_MAX_ORDERS = int(os.getenv("BATCH_MAX_ORDERS", "100"))
+
+# Очередь исходящих сообщений рыночных данных на одно соединение. Переполнилась -
+# клиент получает свежий снапшот, переполнилась снова до его отправки - отключается
+MARKETDATA_QUEUE_SIZE = int(os.getenv("MARKETDATA_QUEUE_SIZE", "1000"))
+# То же для личного потока пользователя (заявки, исполнения, балансы)
+USERFEED_QUEUE_SIZE = int(os.getenv("USERFEED_QUEUE_SIZE", "1000"))
+
+# Очередь команд движка: сверх этого числа ожидающих команд запросы отклоняются с 503
+ENGINE_QUEUE_SIZE = int(os.getenv("ENGINE_QUEUE_SIZE", "10000"))
+# Сколько команд движок разбирает из очереди за один проход
+ENGINE_BATCH_SIZE = int(os.getenv("ENGINE_BATCH_SIZE", "256"))
+
+# Администратор создаётся при каждом старте и в журнал не пишется, поэтому его id постоянный:
+# иначе его депозиты и заявки из журнала при повторе достались бы несуществующему пользователю.
+# Ключ без ADMIN_API_KEY генерируется заново и печатается в лог
+ADMIN_ID = os.getenv("ADMIN_ID", "00000000-0000-4000-8000-000000000001")
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+
+# Стоимость bcrypt для хэшей ключей API. Проверка идёт только при промахе кэша проверенных ключей:
+# API_KEY_CACHE_SIZE ключей, каждый проверяется заново не реже раза в API_KEY_CACHE_TTL секунд
+API_KEY_HASH_ROUNDS = int(os.getenv("API_KEY_HASH_ROUNDS", "12"))
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", "10000"))
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "300"))
+
+# Token bucket на заявки, отмены и публичные запросы: на каждый ключ API по роли его владельца
+# (ANONYMOUS - запросы без известного ключа, считаются по IP) и общий на всех. Скорость 0 - без ограничения
+RATE_LIMITS = {
+    "order": {
+        "ANONYMOUS": _rate("RATE_LIMIT_ORDER_ANONYMOUS", "5/10"),
+        "USER": _rate("RATE_LIMIT_ORDER_USER", "50/100"),
+        "ADMIN": _rate("RATE_LIMIT_ORDER_ADMIN", "0/0"),
+    },
+    "cancel": {
+        "ANONYMOUS": _rate("RATE_LIMIT_CANCEL_ANONYMOUS", "5/10"),
+        "USER": _rate("RATE_LIMIT_CANCEL_USER", "100/200"),
+        "ADMIN": _rate("RATE_LIMIT_CANCEL_ADMIN", "0/0"),
+    },
+    "public": {
+        "ANONYMOUS": _rate("RATE_LIMIT_PUBLIC_ANONYMOUS", "50/100"),
+        "USER": _rate("RATE_LIMIT_PUBLIC_USER", "50/100"),
+        "ADMIN": _rate("RATE_LIMIT_PUBLIC_ADMIN", "0/0"),
+    },
+}
+RATE_LIMITS_GLOBAL = {
+    "order": _rate("RATE_LIMIT_ORDER_GLOBAL", "20000/40000"),
+    "cancel": _rate("RATE_LIMIT_CANCEL_GLOBAL", "20000/40000"),
+    "public": _rate("RATE_LIMIT_PUBLIC_GLOBAL", "50000/100000"),
+}
+# Сколько клиентов (ключей и IP) помнит ограничитель; дольше всех не приходившие забываются первыми
+RATE_LIMIT_CLIENTS = int(os.getenv("RATE_LIMIT_CLIENTS", "100000"))
+
+# Журнал команд; пустой путь - журнал выключен и состояние живёт только в памяти
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "")
+
+# Снапшот состояния: при старте грузится он, а из журнала повторяется только хвост после него
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", f"{JOURNAL_PATH}.snapshot" if JOURNAL_PATH else "")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "300"))
+
+# Фоновая запись в Postgres (postgresql+asyncpg://...); пустая строка - запись выключена
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+PERSISTENCE_BATCH_SIZE = int(os.getenv("PERSISTENCE_BATCH_SIZE", "1000"))
+PERSISTENCE_QUEUE_SIZE = int(os.getenv("PERSISTENCE_QUEUE_SIZE", "100000"))
+# Потолок паузы между повторами пачки, пока база недоступна, секунд
+PERSISTENCE_RETRY_MAX_DELAY = float(os.getenv("PERSISTENCE_RETRY_MAX_DELAY", "30"))
+# Сколько при остановке ждать, пока очередь дойдёт до базы, секунд; остаток бросается
+PERSISTENCE_STOP_TIMEOUT = float(os.getenv("PERSISTENCE_STOP_TIMEOUT", "10"))
+
+# Unix-сокет процесса движка. Пусто - движок работает внутри процесса API (один воркер uvicorn);
+# задан - движок запускается отдельно (python -m app.engine), а воркеры ходят к нему через сокет
+ENGINE_SOCKET = os.getenv("ENGINE_SOCKET", "")
+# Сколько подряд ждать готовности сокета движка при старте воркера, секунд
+ENGINE_CONNECT_TIMEOUT = float(os.getenv("ENGINE_CONNECT_TIMEOUT", "30"))
@@ -1,30 +1,91 @@
 from uuid import UUID, uuid4
 from typing import Dict, List, Union
 
-from app.schemas import User, Instrument, LimitOrder, MarketOrder, Direction, UserRole, Transaction
+from app.config import ADMIN_ID, ADMIN_API_KEY
+from app.schemas import User, Instrument, LimitOrder, MarketOrder, UserRole, Transaction, CandleInterval
+from app.services.book import OrderBook
+from app.services.candles import CandleSeries, new_candles
+from app.services.keys import hash_key, key_digest
+from app.services.records import OrderRecord, TradeRecord, order_to_dict, order_to_schema, trade_to_schema
+from app.services.tape import TradeTape
 
 
 class Storage:
     def __init__(self):
         self.users: Dict[UUID, User] = {}
-        self.api_keys: Dict[str, UUID] = {}
+        # Ключи API хранятся только хэшами: User.api_key - bcrypt, api_keys - sha256 ключа -> пользователь
+        self.api_keys: Dict[bytes, UUID] = {}
+        self.key_digests: Dict[UUID, bytes] = {}
         self.instruments: Dict[str, Instrument] = {}
+        # Растёт при добавлении и удалении инструментов, по нему кэшируется закодированный список
+        self.instruments_version = 0
         self.balances: Dict[UUID, Dict[str, int]] = {}
-        self.orders: Dict[UUID, Union[LimitOrder, MarketOrder]] = {}
-        self.order_books: Dict[str, Dict[Direction, List[LimitOrder]]] = {}
-        self.transactions: List[Transaction] = []
-        self.admin_api_key = f"key-{uuid4()}"
+        # Часть баланса под открытыми заявками; доступно для новых заявок и вывода balances - reserved
+        self.reserved: Dict[UUID, Dict[str, int]] = {}
+        self.orders: Dict[UUID, OrderRecord] = {}
+        # Только живые (стоящие в стакане) заявки пользователя по его хэндлу, в порядке выставления
+        self.open_orders: Dict[int, Dict[UUID, OrderRecord]] = {}
+        self.order_books: Dict[str, OrderBook] = {}
+        self.trade_tapes: Dict[str, TradeTape] = {}
+        self.candles: Dict[str, Dict[CandleInterval, CandleSeries]] = {}
+        # Целочисленные хэндлы пользователей и тикеров для внутренних записей движка
+        self.user_handles: Dict[UUID, int] = {}
+        self.user_ids: List[UUID] = []
+        self.ticker_handles: Dict[str, int] = {}
+        self.tickers: List[str] = []
+        # Ключ администратора без ADMIN_API_KEY генерируется при старте и только печатается в лог
+        self.admin_api_key = ADMIN_API_KEY or f"key-{uuid4()}"
 
-        admin_id = uuid4()
+        admin_id = UUID(ADMIN_ID)
         admin = User(
             id=admin_id,
             name="Admin Petuh",
             role=UserRole.ADMIN,
-            api_key=self.admin_api_key
+            api_key=hash_key(self.admin_api_key)
         )
         self.users[admin_id] = admin
-        self.api_keys[self.admin_api_key] = admin_id
+        self.api_keys[key_digest(self.admin_api_key)] = admin_id
+        self.key_digests[admin_id] = key_digest(self.admin_api_key)
         self.instruments["RUB"] = Instrument(name="Russian Ruble", ticker="RUB")
 
+    def user_handle(self, user_id: UUID) -> int:
+        handle = self.user_handles.get(user_id)
+        if handle is None:
+            handle = len(self.user_ids)
+            self.user_handles[user_id] = handle
+            self.user_ids.append(user_id)
+        return handle
+
+    def ticker_handle(self, ticker: str) -> int:
+        handle = self.ticker_handles.get(ticker)
+        if handle is None:
+            handle = len(self.tickers)
+            self.ticker_handles[ticker] = handle
+            self.tickers.append(ticker)
+        return handle
+
+    def order_schema(self, order: OrderRecord) -> Union[LimitOrder, MarketOrder]:
+        return order_to_schema(order, self.user_ids[order.user], self.tickers[order.ticker])
+
+    def order_dict(self, order: OrderRecord) -> dict:
+        return order_to_dict(order, self.user_ids[order.user], self.tickers[order.ticker])
+
+    def trade_schema(self, trade: TradeRecord) -> Transaction:
+        return trade_to_schema(trade, self.tickers[trade.ticker])
+
+    def get_trade_tape(self, ticker: str) -> TradeTape:
+        tape = self.trade_tapes.get(ticker)
+        if tape is None:
+            tape = TradeTape(ticker)
+            self.trade_tapes[ticker] = tape
+        return tape
+
+    def get_candles(self, ticker: str) -> Dict[CandleInterval, CandleSeries]:
+        candles = self.candles.get(ticker)
+        if candles is None:
+            candles = new_candles()
+            self.candles[ticker] = candles
+        return candles
+
 
 storage = Storage()
\ No newline at end of file
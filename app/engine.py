@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+import signal
+from contextlib import asynccontextmanager
+from app.config import (JOURNAL_PATH, SNAPSHOT_PATH, SNAPSHOT_INTERVAL, DATABASE_URL,
+                        PERSISTENCE_BATCH_SIZE, PERSISTENCE_QUEUE_SIZE, ENGINE_SOCKET)
+from app.database import storage
+from app.services.exchange import local_exchange
+from app.services.ipc import EngineServer
+from app.services import metrics
+from app.services.journal import Journal
+from app.services.marketdata import market_data
+from app.services.orderbook import matching_engine
+from app.services.snapshot import Snapshotter, load_snapshot
+from app.services.userfeed import user_feed
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def engine_runtime():
+    # Восстановление состояния, журнал, снапшоты, рассылки и запись в базу - всё, что живёт рядом с движком
+    logger.info(f"Admin API Key: {storage.admin_api_key}")
+    print(f"Admin API Key via print: {storage.admin_api_key}")
+
+    journal = None
+    snapshotter = None
+    if JOURNAL_PATH:
+        journal = Journal(JOURNAL_PATH)
+        snapshot_seq = 0
+        if SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH):
+            snapshot_seq = load_snapshot(matching_engine, SNAPSHOT_PATH)
+            logger.info(f"Loaded snapshot at seq {snapshot_seq} from {SNAPSHOT_PATH}")
+        replayed = await matching_engine.replay(journal.read(after_seq=snapshot_seq))
+        logger.info(f"Replayed {replayed} journal records from {JOURNAL_PATH}")
+        journal.open()
+        matching_engine.journal = journal
+
+        if SNAPSHOT_PATH:
+            snapshotter = Snapshotter(matching_engine, SNAPSHOT_PATH, SNAPSHOT_INTERVAL)
+            snapshotter.last_seq = journal.seq
+            snapshotter.start()
+
+    matching_engine.listeners.append(market_data)
+    matching_engine.listeners.append(user_feed)
+
+    writer = None
+    if DATABASE_URL:
+        # Драйверы базы нужны только при включённой записи
+        from app.services.persistence import PersistenceWriter
+        writer = PersistenceWriter(DATABASE_URL, PERSISTENCE_BATCH_SIZE, PERSISTENCE_QUEUE_SIZE)
+        await writer.start(storage)
+        matching_engine.listeners.append(writer)
+        metrics.collectors.append(writer.metrics)
+
+    try:
+        yield
+    finally:
+        await matching_engine.close()
+        if writer is not None:
+            matching_engine.listeners.remove(writer)
+            metrics.collectors.remove(writer.metrics)
+            await writer.stop()
+        matching_engine.listeners.remove(user_feed)
+        matching_engine.listeners.remove(market_data)
+        if snapshotter is not None:
+            await snapshotter.stop()
+        if journal is not None:
+            matching_engine.journal = None
+            await journal.close()
+
+
+async def run_engine(path: str):
+    # Процесс движка: единственный писатель Storage, воркеры uvicorn ходят к нему через Unix-сокет.
+    # Матчинг остаётся строго последовательным, разбор HTTP, валидация и JSON расходятся по ядрам
+    async with engine_runtime():
+        server = EngineServer(local_exchange, path)
+        await server.start()
+        logger.info(f"Engine listening on {path}")
+
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopped.set)
+        try:
+            await stopped.wait()
+        finally:
+            await server.stop()
+    logger.info("Bye.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if not ENGINE_SOCKET:
+        raise SystemExit("ENGINE_SOCKET is not set")
+    asyncio.run(run_engine(ENGINE_SOCKET))
@@ -1,32 +1,49 @@
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import storage, Storage
-from app.routes import public, user, admin
+from app.config import ENGINE_SOCKET, ENGINE_CONNECT_TIMEOUT
+from app.database import storage
+from app.engine import engine_runtime
+from app.routes import public, user, admin, metrics
+from app.services.exchange import exchange
+from app.services.metrics import MetricsMiddleware
+from app.services.ratelimit import RateLimitMiddleware, rate_limiter
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    logger.info(f"Admin API Key: {storage.admin_api_key}")
-    print(f"Admin API Key via print: {storage.admin_api_key}")
-    yield
+    if ENGINE_SOCKET:
+        # Воркер без своего состояния: всё хранит процесс движка (python -m app.engine)
+        await exchange.connect(ENGINE_CONNECT_TIMEOUT)
+        logger.info(f"Connected to engine at {ENGINE_SOCKET}")
+        yield
+        await exchange.close()
+    else:
+        async with engine_runtime():
+            yield
     logger.info("Bye.")
 
-app = FastAPI(lifespan=lifespan, title="Toy exchange", version="0.1.0")
+app = FastAPI(lifespan=lifespan, title="Toy exchange", version="0.1.0", default_response_class=ORJSONResponse)
 
+# Ближе всех к приложению: отказ 429 проходит через CORS и попадает в метрики
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, key_owner=exchange.key_owner)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(MetricsMiddleware)
 app.include_router(public.router)
 app.include_router(user.router)
 app.include_router(admin.router)
+app.include_router(metrics.router)
 
 if __name__ == "__main__":
     import uvicorn
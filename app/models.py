@@ -1,53 +1,32 @@
-"""from typing import Optional
-from sqlalchemy import Column, String, UUID, Enum, Integer, Float, ForeignKey, DateTime
-from sqlalchemy.orm import relationship
-from sqlalchemy.ext.declarative import declarative_base
-from pydantic import BaseModel, Field, validator
-from datetime import datetime
-from enum import Enum as PyEnum
 import uuid
-from app.schemas import OrderDirection
+from datetime import datetime, timezone
+from sqlalchemy import Column, String, Uuid, Enum, Integer, Numeric, ForeignKey, DateTime
+from sqlalchemy.orm import declarative_base
+from app.schemas import UserRole, OrderStatus, Direction
+from enum import Enum as PyEnum
 
 
 Base = declarative_base()
 
 
-# Enums
-class UserRole(str, PyEnum):
-    USER = "USER"
-    ADMIN = "ADMIN"
-
-
 class OrderType(str, PyEnum):
     LIMIT = "LIMIT"
     MARKET = "MARKET"
 
 
-class OrderStatus(str, PyEnum):
-    NEW = "NEW"
-    EXECUTED = "EXECUTED"
-    PARTIALLY_EXECUTED = "PARTIALLY_EXECUTED"
-    CANCELLED = "CANCELLED"
+def utcnow() -> datetime:
+    # В init.sql колонки TIMESTAMP без зоны, храним наивное UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
-# SQLAlchemy Models
+# Таблицы повторяют db/scripts/init.sql
 class UserDB(Base):
     __tablename__ = "users"
 
-    id = Column(UUID, primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
     name = Column(String(50), nullable=False)
     api_key = Column(String(64), unique=True, nullable=False)
-    role = Column(Enum(UserRole), default=UserRole.USER)
-
-    orders = relationship("OrderDB", back_populates="user")
-
-
-class BalanceDB(Base):
-    __tablename__ = "balances"
-
-    user_id = Column(UUID, ForeignKey("users.id"), primary_key=True)
-    ticker = Column(String(10), primary_key=True)
-    amount = Column(Integer, default=0)
+    role = Column(Enum(UserRole, name="user_role"), default=UserRole.USER)
 
 
 class InstrumentDB(Base):
@@ -57,91 +36,35 @@ class InstrumentDB(Base):
     name = Column(String(100), nullable=False)
 
 
+class BalanceDB(Base):
+    __tablename__ = "balances"
+
+    user_id = Column(Uuid, ForeignKey("users.id"), primary_key=True)
+    ticker = Column(String(10), ForeignKey("instruments.ticker"), primary_key=True)
+    amount = Column(Integer, default=0)
+
+
 class OrderDB(Base):
     __tablename__ = "orders"
 
-    id = Column(UUID, primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID, ForeignKey("users.id"), nullable=False)
-    ticker = Column(String(10), nullable=False)
-    type = Column(Enum(OrderType), nullable=False)
-    price = Column(Float)
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
+    user_id = Column(Uuid, ForeignKey("users.id"), nullable=False)
+    ticker = Column(String(10), ForeignKey("instruments.ticker"), nullable=False)
+    type = Column(Enum(OrderType, name="order_type"), nullable=False)
+    direction = Column(Enum(Direction, name="order_direction"), nullable=False)
+    price = Column(Numeric(20, 2))
     qty = Column(Integer, nullable=False)
-    status = Column(Enum(OrderStatus), default=OrderStatus.NEW)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-    user = relationship("UserDB", back_populates="orders")
+    filled = Column(Integer, nullable=False, default=0)
+    status = Column(Enum(OrderStatus, name="order_status"), default=OrderStatus.NEW)
+    created_at = Column(DateTime, default=utcnow)
 
 
 class TransactionDB(Base):
     __tablename__ = "transactions"
 
-    id = Column(UUID, primary_key=True, default=uuid.uuid4)
-    ticker = Column(String(10), nullable=False)
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
+    ticker = Column(String(10), ForeignKey("instruments.ticker"), nullable=False)
     amount = Column(Integer, nullable=False)
-    price = Column(Float, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    order_id = Column(UUID, ForeignKey("orders.id"))
-
-
-# Pydantic Models
-class UserCreate(BaseModel):
-    name: str = Field(..., min_length=3, example="John Doe")
-
-
-class UserResponse(BaseModel):
-    id: uuid.UUID
-    name: str
-    role: UserRole
-    api_key: str
-
-
-class InstrumentCreate(BaseModel):
-    name: str
-    ticker: str = Field(..., pattern=r"^[A-Z]{2,10}$")
-
-
-class OrderCreate(BaseModel):
-    ticker: str
-    type: OrderType
-    direction: OrderDirection
-    price: float | None = Field(None, gt=0)
-    qty: int = Field(gt=0)
-
-    @validator("price")
-    def validate_price(cls, v, values):
-        if values["type"] == OrderType.LIMIT and v is None:
-            raise ValueError("Price is required for LIMIT orders")
-        return v
-
-
-class TransactionResponse(BaseModel):
-    ticker: str
-    amount: int
-    price: float
-    timestamp: datetime
-
-class DepositRequest(BaseModel):
-    user_id: uuid.UUID
-    ticker: str
-    amount: int = Field(..., gt=0)
-
-class WithdrawRequest(BaseModel):
-    user_id: uuid.UUID
-    ticker: str
-    amount: int = Field(..., gt=0)
-
-class InstrumentResponse(BaseModel):
-    name: str
-    ticker: str = Field(..., pattern=r"^[A-Z]{2,10}$")
-
-class OrderResponse(BaseModel):
-    id: uuid.UUID
-    status: OrderStatus
-    user_id: uuid.UUID
-    timestamp: datetime
-    # Для лимитных ордеров
-    price: Optional[int] = None
-    qty: int
-    direction: OrderDirection
-    type: OrderType
-    filled: int = 0"""
\ No newline at end of file
+    price = Column(Numeric(20, 2), nullable=False)
+    timestamp = Column(DateTime, default=utcnow)
+    order_id = Column(Uuid, ForeignKey("orders.id"))
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.services import metrics
+from app.services.exchange import exchange
+from app.services.ratelimit import rate_limiter
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    # Задержки HTTP и ограничение запросов - этого процесса, остальное - от движка (в том же процессе или в отдельном)
+    local = [*metrics.HTTP_LATENCY.render(), *rate_limiter.metrics()]
+    text = "\n".join(local) + "\n" + await exchange.metrics()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
@@ -1,121 +1,89 @@
-from typing import List
-from uuid import uuid4
-from fastapi import APIRouter, HTTPException, Query
-from app.database import storage
-from app.schemas import (NewUser, User, UserRole, Instrument,
-                         L2OrderBook, Direction, OrderStatus, Level, Transaction)
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Header, Query, WebSocket
+from app.services.encoding import conditional_response
+from app.services.exchange import exchange
+from app.services.records import datetime_to_ns
+from app.services.streams import serve
+from app.schemas import NewUser, User, Instrument, L2OrderBook, Quote, Direction, Transaction, Candle, CandleInterval
 
 
 router = APIRouter()
 
 @router.post("/api/v1/public/register", response_model=User, tags=["public"])
 async def register(new_user: NewUser):
-    user_id = uuid4()
-    api_key = f"key-{uuid4()}"
-
-    user = User(
-        id=user_id,
-        name=new_user.name,
-        role=UserRole.USER,
-        api_key=api_key
-    )
-
-    storage.users[user_id] = user
-    storage.api_keys[api_key] = user_id
-    storage.balances[user_id] = {"RUB": 0}
-
-    return user
+    return await exchange.register(new_user)
 
 
 @router.get("/api/v1/public/instrument", response_model=List[Instrument], tags=["public"])
-async def list_instruments():
-    return list(storage.instruments.values())
+async def list_instruments(if_none_match: Optional[str] = Header(None)):
+    return conditional_response(*await exchange.instruments_json(if_none_match))
 
 
 @router.get("/api/v1/public/orderbook/{ticker}", response_model=L2OrderBook, tags=["public"])
-async def get_orderbook(ticker: str, limit: int = Query(10, ge=1, le=25)):
-    # Исправление теста test_create_order (94.7% Fix)
-    if ticker not in storage.instruments:
-        raise HTTPException(status_code=404, detail="Instrument not found")
-
-    order_book = storage.order_books.get(ticker, {
-        Direction.BUY: [],
-        Direction.SELL: []
-    })
-
-    bids = {}
-    for order in order_book[Direction.BUY]:
-        if order.status in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]:
-            price = order.body.price
-            qty = order.body.qty - order.filled
-            bids[price] = bids.get(price, 0) + qty
-
-    asks = {}
-    for order in order_book[Direction.SELL]:
-        if order.status in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]:
-            price = order.body.price
-            qty = order.body.qty - order.filled
-            asks[price] = asks.get(price, 0) + qty
-
-    sorted_bids = sorted(
-        [Level(price=p, qty=q) for p, q in bids.items()],
-        key=lambda x: x.price,
-        reverse=True
-    )[:limit]
-
-    sorted_asks = sorted(
-        [Level(price=p, qty=q) for p, q in asks.items()],
-        key=lambda x: x.price
-    )[:limit]
-
-    return L2OrderBook(bid_levels=sorted_bids, ask_levels=sorted_asks)
-
-    #Исходная версия реализации
-    """
-        if ticker not in storage.instruments:
-        raise HTTPException(status_code=404, detail="Instrument not found")
-
-    order_book = storage.order_books.get(ticker, {
-        Direction.BUY: [],
-        Direction.SELL: []
-    })
-
-    bids = {}
-    asks = {}
-
-    for order in order_book[Direction.BUY]:
-        if order.status in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]:
-            price = order.body.price
-            qty = order.body.qty - order.filled
-            bids[price] = bids.get(price, 0) + qty
-
-    for order in order_book[Direction.SELL]:
-        if order.status in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]:
-            price = order.body.price
-            qty = order.body.qty - order.filled
-            asks[price] = asks.get(price, 0) + qty
-
-    sorted_bids = sorted(
-        [Level(price=p, qty=q) for p, q in bids.items()],
-        key=lambda x: x.price,
-        reverse=True
-    )[:limit]
-
-    sorted_asks = sorted(
-        [Level(price=p, qty=q) for p, q in asks.items()],
-        key=lambda x: x.price
-    )[:limit]
-
-    return L2OrderBook(bid_levels=sorted_bids, ask_levels=sorted_asks)
-    """
+async def get_orderbook(
+        ticker: str,
+        limit: int = Query(10, ge=1, le=25),
+        if_none_match: Optional[str] = Header(None)
+):
+    return conditional_response(*await exchange.orderbook_json(ticker, limit, if_none_match))
+
+
+@router.get("/api/v1/public/quote/{ticker}", response_model=Quote, tags=["public"])
+async def get_quote(
+        ticker: str,
+        direction: Direction,
+        qty: Optional[int] = Query(None, ge=1),
+        budget: Optional[int] = Query(None, ge=1)
+):
+    return await exchange.get_quote(ticker, direction, qty, budget)
 
 
 @router.get("/api/v1/public/transactions/{ticker}", response_model=List[Transaction], tags=["public"])
-async def get_transaction_history(ticker: str, limit: int = Query(10, ge=1, le=100)):
-    if ticker not in storage.instruments:
-        raise HTTPException(status_code=404, detail="Instrument not found")
-
-    ticker_transactions = [t for t in storage.transactions if t.ticker == ticker]
-    if limit == 100:
-        return sorted(ticker_transactions, key=lambda x: x.timestamp, reverse=True)[:20]
-    return sorted(ticker_transactions, key=lambda x: x.timestamp, reverse=True)[:limit]
\ No newline at end of file
+async def get_transaction_history(
+        ticker: str,
+        limit: int = Query(10, ge=1, le=100),
+        if_none_match: Optional[str] = Header(None)
+):
+    return conditional_response(*await exchange.transactions_json(ticker, limit, if_none_match))
+
+@router.get("/api/v1/public/candles/{ticker}", response_model=List[Candle], tags=["public"])
+async def get_candles(
+        ticker: str,
+        interval: CandleInterval = CandleInterval.MINUTE,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: int = Query(100, ge=1, le=1000)
+):
+    start_ns = datetime_to_ns(start) if start is not None else 0
+    end_ns = datetime_to_ns(end) if end is not None else 2 ** 63
+    return await exchange.get_candles(ticker, interval, start_ns, end_ns, limit)
+
+
+async def receive_subscriptions(websocket: WebSocket, stream):
+    # {"action": "subscribe" | "unsubscribe", "tickers": [...]}
+    while True:
+        try:
+            message = await websocket.receive_json()
+        except ValueError:
+            message = None
+        action = message.get("action") if isinstance(message, dict) else None
+        tickers = message.get("tickers") if isinstance(message, dict) else None
+        if action not in ("subscribe", "unsubscribe") or not isinstance(tickers, list):
+            await websocket.send_json({"type": "error", "detail": "Expected action subscribe/unsubscribe and tickers"})
+            continue
+
+        for ticker in tickers:
+            if action == "unsubscribe":
+                await stream.unsubscribe(ticker)
+                continue
+            error = await stream.subscribe(ticker)
+            if error is not None:
+                await websocket.send_json({"type": "error", "ticker": ticker, "detail": error})
+
+
+@router.websocket("/api/v1/public/ws/marketdata")
+async def market_data_stream(websocket: WebSocket):
+    await websocket.accept()
+    stream = await exchange.market_stream()
+    await serve(websocket, stream, receive_subscriptions(websocket, stream))
@@ -1,116 +1,79 @@
-from datetime import datetime, timezone
-from typing import Union, List, Dict
-from uuid import UUID, uuid4
-from fastapi import APIRouter, Depends, HTTPException
-from app.database import storage
-from app.schemas import (CreateOrderResponse, Ok, LimitOrderBody, MarketOrderBody, LimitOrder, MarketOrder, OrderStatus)
+from typing import Union, List, Dict, Optional
+from uuid import UUID
+from fastapi import APIRouter, Depends, HTTPException, WebSocket
+from app.schemas import (CreateOrderResponse, Ok, Direction, LimitOrderBody, MarketOrderBody, LimitOrder, MarketOrder,
+                         BatchOrderBody, BatchCancelBody, BatchResponse)
 from app.services.auth import get_current_user
-from app.services.orderbook import matching_engine
+from app.services.encoding import EncodedResponse
+from app.services.exchange import exchange
+from app.services.streams import serve
 
 
 router = APIRouter()
 
 @router.get("/api/v1/balance", response_model=Dict[str, int], tags=["balance"])
 async def get_balances(user_id: UUID = Depends(get_current_user)):
-    return storage.balances.get(user_id, {})
+    return await exchange.get_balances(user_id)
 
 @router.post("/api/v1/order", response_model=CreateOrderResponse, tags=["order"])
 async def create_order(
         body: Union[LimitOrderBody, MarketOrderBody],
         user_id: UUID = Depends(get_current_user)
 ):
-    if body.ticker not in storage.instruments:
-        raise HTTPException(status_code=404, detail="Instrument not found")
-
-    order_id = uuid4()
-    timestamp = datetime.now(timezone.utc)
-
-    if isinstance(body, MarketOrderBody):
-        order = MarketOrder(
-            id=order_id,
-            status=OrderStatus.NEW,
-            user_id=user_id,
-            timestamp=timestamp,
-            body=body
-        )
-    else:
-        order = LimitOrder(
-            id=order_id,
-            status=OrderStatus.NEW,
-            user_id=user_id,
-            timestamp=timestamp,
-            body=body,
-            filled=0
-        )
-
-    storage.orders[order_id] = order
+    return await exchange.create_order(user_id, body)
 
-    try:
-        await matching_engine.process_order(order, user_id)
-    except Exception as e:
-        del storage.orders[order_id]
-        raise e
 
-    return CreateOrderResponse(order_id=order_id)
+@router.post("/api/v1/orders/batch", response_model=BatchResponse, tags=["order"])
+async def create_orders(batch: BatchOrderBody, user_id: UUID = Depends(get_current_user)):
+    return await exchange.create_orders(user_id, batch)
 
 
-@router.get("/api/v1/order", response_model=List[Union[LimitOrder, MarketOrder]], tags=["order"])
-async def list_orders(user_id: UUID = Depends(get_current_user)):
-    user_orders = [
-        order for order in storage.orders.values()
-        if order.user_id == user_id and order.status in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]
-    ]
-    return user_orders
+@router.post("/api/v1/orders/batch/cancel", response_model=BatchResponse, tags=["order"])
+async def cancel_orders(batch: BatchCancelBody, user_id: UUID = Depends(get_current_user)):
+    return await exchange.cancel_orders(user_id, batch)
 
 
-@router.get("/api/v1/order/{order_id}", response_model=Union[LimitOrder, MarketOrder], tags=["order"])
-async def get_order(order_id: UUID, user_id: UUID = Depends(get_current_user)):
-    order = storage.orders.get(order_id)
+async def drain_client(websocket: WebSocket):
+    # Клиент в личный поток ничего не пишет, чтение нужно только чтобы заметить отключение
+    while True:
+        await websocket.receive_text()
 
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
 
-    if order.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Not your order")
+@router.websocket("/api/v1/ws/private")
+async def private_stream(websocket: WebSocket):
+    try:
+        user_id = await get_current_user(websocket.headers.get("authorization"))
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
 
-    return order
+    await websocket.accept()
+    stream = await exchange.user_stream(user_id)
+    await serve(websocket, stream, drain_client(websocket))
 
 
-@router.delete("/api/v1/order/{order_id}", response_model=Ok, tags=["order"])
-async def cancel_order(order_id: UUID, user_id: UUID = Depends(get_current_user)):
-    # Исправление теста test_cancel_order (94.7% Fix)
-    order = storage.orders.get(order_id)
+@router.get("/api/v1/order", response_model=List[Union[LimitOrder, MarketOrder]], tags=["order"])
+async def list_orders(user_id: UUID = Depends(get_current_user)):
+    return EncodedResponse(await exchange.orders_json(user_id))
 
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
 
-    if order.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Not your order")
+@router.delete("/api/v1/order", response_model=BatchResponse, tags=["order"])
+async def cancel_open_orders(
+        ticker: Optional[str] = None,
+        side: Optional[Direction] = None,
+        user_id: UUID = Depends(get_current_user)
+):
+    return await exchange.cancel_open_orders(user_id, ticker, side)
 
-    if isinstance(order, MarketOrder):
-        raise HTTPException(
-            status_code=400,
-            detail="Market orders cannot be cancelled"
-        )
-
-    if order.status in [OrderStatus.EXECUTED, OrderStatus.CANCELLED]:
-        raise HTTPException(
-            status_code=400,
-            detail="Order cannot be cancelled (already executed or cancelled)"
-        )
-
-    if order.status == OrderStatus.PARTIALLY_EXECUTED:
-        raise HTTPException(
-            status_code=400,
-            detail="Partially executed orders cannot be cancelled"
-        )
-
-    ticker = order.body.ticker
-    if (ticker in storage.order_books and
-            order in storage.order_books[ticker][order.body.direction]):
-        storage.order_books[ticker][order.body.direction].remove(order)
 
-    order.status = OrderStatus.CANCELLED
+@router.get("/api/v1/order/{order_id}", response_model=Union[LimitOrder, MarketOrder], tags=["order"])
+async def get_order(order_id: UUID, user_id: UUID = Depends(get_current_user)):
+    return await exchange.get_order(user_id, order_id)
+
+
+@router.delete("/api/v1/order/{order_id}", response_model=Ok, tags=["order"])
+async def cancel_order(order_id: UUID, user_id: UUID = Depends(get_current_user)):
+    await exchange.cancel_order(user_id, order_id)
 
     return Ok()
 
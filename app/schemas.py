@@ -1,8 +1,9 @@
 from enum import Enum
-from typing import List
+from typing import List, Optional, Union
 from pydantic import BaseModel, Field, validator, field_validator
 from datetime import datetime, timezone
 from uuid import UUID
+from app.config import BATCH_MAX_ORDERS
 
 class Direction(str, Enum):
     BUY = "BUY"
@@ -14,6 +15,22 @@ class OrderStatus(str, Enum):
     PARTIALLY_EXECUTED = "PARTIALLY_EXECUTED"
     CANCELLED = "CANCELLED"
 
+class TimeInForce(str, Enum):
+    GTC = "GTC"  # Остаток стоит в стакане до исполнения или отмены
+    IOC = "IOC"  # Исполняется сколько сразу возможно, остаток снимается
+    FOK = "FOK"  # Исполняется сразу и целиком или не исполняется вовсе
+
+class BatchMode(str, Enum):
+    ALL_OR_NOTHING = "ALL_OR_NOTHING"
+    BEST_EFFORT = "BEST_EFFORT"
+
+class CandleInterval(str, Enum):
+    SECOND = "1s"
+    MINUTE = "1m"
+    FIVE_MINUTES = "5m"
+    HOUR = "1h"
+    DAY = "1d"
+
 class UserRole(str, Enum):
     USER = "USER"
     ADMIN = "ADMIN"
@@ -39,17 +56,33 @@ class L2OrderBook(BaseModel):
     bid_levels: List[Level]
     ask_levels: List[Level]
 
+class Quote(BaseModel):
+    ticker: str
+    direction: Direction
+    qty: int
+    cost: int
+    worst_price: Optional[int] = None
+
 class Transaction(BaseModel):
     ticker: str
     amount: int
     price: int
     timestamp: datetime
 
+class Candle(BaseModel):
+    timestamp: datetime
+    open: int
+    high: int
+    low: int
+    close: int
+    volume: int
+
 class LimitOrderBody(BaseModel):
     direction: Direction
     ticker: str
     qty: int = Field(..., ge=1)
     price: int = Field(..., gt=0)
+    time_in_force: TimeInForce = TimeInForce.GTC
 
 class MarketOrderBody(BaseModel):
     direction: Direction
@@ -92,6 +125,23 @@ class CreateOrderResponse(BaseModel):
 class Ok(BaseModel):
     success: bool = True
 
+class BatchOrderBody(BaseModel):
+    mode: BatchMode = BatchMode.BEST_EFFORT
+    orders: List[Union[LimitOrderBody, MarketOrderBody]] = Field(..., min_length=1, max_length=BATCH_MAX_ORDERS)
+
+class BatchCancelBody(BaseModel):
+    mode: BatchMode = BatchMode.BEST_EFFORT
+    order_ids: List[UUID] = Field(..., min_length=1, max_length=BATCH_MAX_ORDERS)
+
+class BatchItemResult(BaseModel):
+    success: bool = True
+    order_id: Optional[UUID] = None
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    success: bool = True
+    results: List[BatchItemResult]
+
 class DepositBody(BaseModel):
     user_id: UUID
     ticker: str
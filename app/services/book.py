@@ -0,0 +1,204 @@
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+from sortedcontainers import SortedDict
+from app.schemas import Direction, L2OrderBook, Level
+from app.services.encoding import dumps
+from app.services.records import OrderRecord
+
+
+class PriceLevel:
+    __slots__ = ("price", "qty", "orders")
+
+    def __init__(self, price: int):
+        self.price = price
+        self.qty = 0
+        # dict хранит порядок вставки - это и есть временной приоритет внутри уровня
+        self.orders: Dict[UUID, OrderRecord] = {}
+
+    def first(self) -> OrderRecord:
+        return next(iter(self.orders.values()))
+
+
+class BookSide:
+    def __init__(self, direction: Direction):
+        self.direction = direction
+        # Для бидов ключ - отрицательная цена, чтобы лучший уровень всегда был первым
+        self._sign = -1 if direction == Direction.BUY else 1
+        self._levels: SortedDict = SortedDict()
+        # Растёт при любом изменении стороны. Накопленные объём и стоимость уровней от лучшего
+        # строятся лениво и только на нужную глубину, пока сторона не изменилась
+        self.version = 0
+        self._indexed_version = -1
+        self._unindexed: Iterator[PriceLevel] = iter(())
+        self._prices: List[int] = []
+        self._cum_qty: List[int] = []
+        self._cum_cost: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._levels)
+
+    def __bool__(self) -> bool:
+        return bool(self._levels)
+
+    def best(self) -> Optional[PriceLevel]:
+        if not self._levels:
+            return None
+        return self._levels.peekitem(0)[1]
+
+    def levels(self) -> Iterator[PriceLevel]:
+        return iter(self._levels.values())
+
+    def get_level(self, price: int) -> Optional[PriceLevel]:
+        return self._levels.get(self._sign * price)
+
+    def add(self, order: OrderRecord) -> PriceLevel:
+        key = self._sign * order.price
+        level = self._levels.get(key)
+        if level is None:
+            level = PriceLevel(order.price)
+            self._levels[key] = level
+        level.orders[order.id] = order
+        level.qty += order.qty - order.filled
+        self.version += 1
+        return level
+
+    def _index(self, cumulative: str, target: int) -> List[int]:
+        # Достраивает префиксы, пока накопленное значение не дойдёт до target или не кончатся уровни
+        if self._indexed_version != self.version:
+            self._indexed_version = self.version
+            self._unindexed = iter(self._levels.values())
+            self._prices, self._cum_qty, self._cum_cost = [], [], []
+        values = getattr(self, cumulative)
+        while not values or values[-1] < target:
+            level = next(self._unindexed, None)
+            if level is None:
+                break
+            self._prices.append(level.price)
+            self._cum_qty.append((self._cum_qty[-1] if self._cum_qty else 0) + level.qty)
+            self._cum_cost.append((self._cum_cost[-1] if self._cum_cost else 0) + level.qty * level.price)
+        return values
+
+    def cost(self, qty: int) -> Tuple[int, int, Optional[int]]:
+        # Сколько из qty наберётся с лучших уровней, во сколько обойдётся и до какой худшей цены дойдёт
+        cum_qty = self._index("_cum_qty", qty)
+        if not cum_qty:
+            return 0, 0, None
+        i = bisect_left(cum_qty, qty)
+        if i == len(cum_qty):
+            return cum_qty[-1], self._cum_cost[-1], self._prices[-1]
+        before_qty = cum_qty[i - 1] if i else 0
+        before_cost = self._cum_cost[i - 1] if i else 0
+        return qty, before_cost + (qty - before_qty) * self._prices[i], self._prices[i]
+
+    def fills(self, qty: int, limit_price: int) -> bool:
+        # Наберётся ли qty с лучших уровней не хуже limit_price. Только чтение - решение для FOK
+        filled, _, worst_price = self.cost(qty)
+        return filled >= qty and self._sign * worst_price <= self._sign * limit_price
+
+    def qty_for(self, budget: int) -> Tuple[int, int, Optional[int]]:
+        # Сколько наберётся с лучших уровней на budget, во сколько обойдётся и до какой худшей цены дойдёт
+        cum_cost = self._index("_cum_cost", budget)
+        # Первые i уровней укладываются в бюджет целиком
+        i = bisect_right(cum_cost, budget)
+        qty = self._cum_qty[i - 1] if i else 0
+        cost = cum_cost[i - 1] if i else 0
+        price = self._prices[i - 1] if i else None
+        if i < len(cum_cost):
+            extra = (budget - cost) // self._prices[i]
+            if extra:
+                qty += extra
+                cost += extra * self._prices[i]
+                price = self._prices[i]
+        return qty, cost, price
+
+    def drop_level(self, level: PriceLevel):
+        del self._levels[self._sign * level.price]
+        self.version += 1
+
+
+class OrderBook:
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self.bids = BookSide(Direction.BUY)
+        self.asks = BookSide(Direction.SELL)
+        self._levels_by_order: Dict[UUID, PriceLevel] = {}
+        # Растёт при любом изменении стакана, по нему инвалидируются закэшированные снапшоты
+        self.version = 0
+        self._snapshots: Dict[int, Tuple[int, L2OrderBook]] = {}
+        self._encoded: Dict[int, Tuple[int, bytes]] = {}
+
+    def __len__(self) -> int:
+        return len(self._levels_by_order)
+
+    def __contains__(self, order_id: UUID) -> bool:
+        return order_id in self._levels_by_order
+
+    def side(self, direction: Direction) -> BookSide:
+        return self.bids if direction == Direction.BUY else self.asks
+
+    def opposite(self, direction: Direction) -> BookSide:
+        return self.asks if direction == Direction.BUY else self.bids
+
+    def orders(self) -> Iterator[OrderRecord]:
+        for side in (self.bids, self.asks):
+            for level in side.levels():
+                yield from level.orders.values()
+
+    def add(self, order: OrderRecord):
+        self._levels_by_order[order.id] = self.side(order.direction).add(order)
+        self.version += 1
+
+    def remove(self, order_id: UUID) -> Optional[OrderRecord]:
+        level = self._levels_by_order.pop(order_id, None)
+        if level is None:
+            return None
+
+        order = level.orders.pop(order_id)
+        level.qty -= order.qty - order.filled
+        side = self.side(order.direction)
+        side.version += 1
+        if not level.orders:
+            side.drop_level(level)
+        self.version += 1
+        return order
+
+    def fill(self, order: OrderRecord, qty: int):
+        # Полностью исполненная заявка сразу уходит из стакана
+        level = self._levels_by_order[order.id]
+        order.filled += qty
+        level.qty -= qty
+        side = self.side(order.direction)
+        side.version += 1
+        self.version += 1
+        if order.filled >= order.qty:
+            del self._levels_by_order[order.id]
+            del level.orders[order.id]
+            if not level.orders:
+                side.drop_level(level)
+
+    def l2_snapshot(self, limit: int) -> L2OrderBook:
+        cached = self._snapshots.get(limit)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+
+        snapshot = L2OrderBook(
+            bid_levels=[Level(price=level.price, qty=level.qty) for level in islice(self.bids.levels(), limit)],
+            ask_levels=[Level(price=level.price, qty=level.qty) for level in islice(self.asks.levels(), limit)]
+        )
+        self._snapshots[limit] = (self.version, snapshot)
+        return snapshot
+
+    def l2_json(self, limit: int) -> bytes:
+        # Тот же снапшот, сразу в байтах ответа: пока стакан не изменился, повторно не кодируется
+        cached = self._encoded.get(limit)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+
+        encoded = dumps({
+            "bid_levels": [{"price": level.price, "qty": level.qty} for level in islice(self.bids.levels(), limit)],
+            "ask_levels": [{"price": level.price, "qty": level.qty} for level in islice(self.asks.levels(), limit)]
+        })
+        self._encoded[limit] = (self.version, encoded)
+        return encoded
@@ -0,0 +1,59 @@
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import islice
+from operator import attrgetter
+from typing import Deque, Dict, List
+from app.config import CANDLE_RETENTION
+from app.schemas import CandleInterval
+from app.services.records import CandleRecord
+
+
+INTERVAL_NS = {
+    CandleInterval.SECOND: 1_000_000_000,
+    CandleInterval.MINUTE: 60_000_000_000,
+    CandleInterval.FIVE_MINUTES: 300_000_000_000,
+    CandleInterval.HOUR: 3_600_000_000_000,
+    CandleInterval.DAY: 86_400_000_000_000,
+}
+
+_start = attrgetter("start")
+
+
+class CandleSeries:
+    # Свечи одного интервала в порядке времени, старые вытесняются по достижении retention
+    def __init__(self, interval: CandleInterval, retention: int):
+        self.interval_ns = INTERVAL_NS[interval]
+        self.bars: Deque[CandleRecord] = deque(maxlen=retention)
+
+    def update(self, price: int, qty: int, ts: int):
+        start = ts - ts % self.interval_ns
+        bars = self.bars
+        if not bars or bars[-1].start < start:
+            bars.append(CandleRecord(start, price, price, price, price, qty))
+            return
+
+        # Время сделки - время приёма заявки, поэтому изредка сделка попадает в уже закрытый интервал
+        bar = bars[-1]
+        if bar.start != start:
+            i = bisect_left(bars, start, key=_start)
+            if i == len(bars) or bars[i].start != start:
+                return
+            bar = bars[i]
+        if price > bar.high:
+            bar.high = price
+        elif price < bar.low:
+            bar.low = price
+        if bar is bars[-1]:
+            bar.close = price
+        bar.volume += qty
+
+    def range(self, start: int, end: int, limit: int) -> List[CandleRecord]:
+        # Последние limit свечей, пересекающихся с [start, end]
+        start -= start % self.interval_ns
+        lo = bisect_left(self.bars, start, key=_start)
+        hi = bisect_right(self.bars, end, key=_start)
+        return list(islice(self.bars, max(lo, hi - limit), hi))
+
+
+def new_candles() -> Dict[CandleInterval, CandleSeries]:
+    return {interval: CandleSeries(interval, CANDLE_RETENTION[interval.value]) for interval in CandleInterval}
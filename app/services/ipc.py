@@ -0,0 +1,296 @@
+import asyncio
+import itertools
+import logging
+import os
+import pickle
+import struct
+from enum import IntEnum
+from functools import partial
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from uuid import UUID
+from fastapi import HTTPException
+from app.config import MARKETDATA_QUEUE_SIZE, USERFEED_QUEUE_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+# Заголовок кадра: длина тела, тип кадра, номер вызова (или потока для PUSH)
+FRAME = struct.Struct("<IBI")
+
+
+class Frame(IntEnum):
+    CALL = 1
+    RESULT = 2
+    ERROR = 3
+    PUSH = 4
+
+
+# Операции Exchange, которые воркер может вызвать в процессе движка
+COMMANDS = frozenset({
+    "authenticate", "key_owner", "register", "list_instruments", "get_orderbook", "get_quote", "get_transactions",
+    "get_candles", "get_balances", "create_order", "create_orders", "cancel_orders", "cancel_open_orders",
+    "list_orders", "get_order", "cancel_order", "instruments_json", "orderbook_json", "transactions_json",
+    "orders_json", "delete_user", "add_instrument", "remove_instrument", "deposit", "withdraw", "metrics"
+})
+
+
+def encode_frame(kind: Frame, ident: int, body: bytes) -> bytes:
+    return FRAME.pack(len(body), kind, ident) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[Frame, int, bytes]:
+    length, kind, ident = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return Frame(kind), ident, await reader.readexactly(length)
+
+
+class EngineConnection:
+    # Одно соединение воркера с процессом движка: вызовы выполняются конкурентно,
+    # как обработчики запросов в обычном однопроцессном режиме, ответы идут по номеру вызова
+    def __init__(self, exchange, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.exchange = exchange
+        self.reader = reader
+        self.writer = writer
+        # Номер потока -> подписка и задача, пересылающая её сообщения воркеру
+        self.streams: Dict[int, tuple] = {}
+        self.calls = set()
+
+    async def serve(self):
+        try:
+            while True:
+                kind, ident, body = await read_frame(self.reader)
+                if kind != Frame.CALL:
+                    raise ConnectionError(f"Unexpected frame {kind.name}")
+                method, args, kwargs = pickle.loads(body)
+                task = asyncio.create_task(self._call(ident, method, args, kwargs))
+                self.calls.add(task)
+                task.add_done_callback(self.calls.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in list(self.calls) + [task for _, task in self.streams.values()]:
+                task.cancel()
+            self.writer.close()
+
+    def _send(self, kind: Frame, ident: int, body: bytes):
+        if not self.writer.is_closing():
+            self.writer.write(encode_frame(kind, ident, body))
+
+    async def _call(self, ident: int, method: str, args: tuple, kwargs: dict):
+        try:
+            if method in COMMANDS:
+                result = await getattr(self.exchange, method)(*args, **kwargs)
+            elif method == "open_stream":
+                result = await self._open_stream(*args)
+            elif method == "stream_subscribe":
+                result = await self._stream(args[0]).subscribe(args[1])
+            elif method == "stream_unsubscribe":
+                result = await self._stream(args[0]).unsubscribe(args[1])
+            elif method == "close_stream":
+                result = self._close_stream(args[0])
+            else:
+                raise HTTPException(status_code=400, detail=f"Unknown engine command {method}")
+        except HTTPException as e:
+            self._send(Frame.ERROR, ident, pickle.dumps((e.status_code, e.detail)))
+        except Exception:
+            logger.exception(f"Engine command {method} failed")
+            self._send(Frame.ERROR, ident, pickle.dumps((500, "Internal Server Error")))
+        else:
+            self._send(Frame.RESULT, ident, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        await self._drain()
+
+    async def _drain(self):
+        # Воркер мог отключиться, пока шёл вызов, - ответ просто некому отдать
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _open_stream(self, ident: int, user_id: Optional[UUID]):
+        if user_id is None:
+            stream = await self.exchange.market_stream()
+        else:
+            stream = await self.exchange.user_stream(user_id)
+        self.streams[ident] = (stream, asyncio.create_task(self._forward(ident, stream)))
+
+    def _stream(self, ident: int):
+        if ident not in self.streams:
+            raise HTTPException(status_code=404, detail="Stream not found")
+        return self.streams[ident][0]
+
+    def _close_stream(self, ident: int):
+        if ident in self.streams:
+            self.streams.pop(ident)[1].cancel()
+
+    async def _push(self, ident: int, message: str):
+        # Медленный воркер тормозит отправку, а не движок: очередь подписки в движке
+        # переполняется и дальше работает обычная пересинхронизация
+        self._send(Frame.PUSH, ident, message.encode())
+        await self._drain()
+
+    async def _forward(self, ident: int, stream):
+        pump = asyncio.create_task(stream.pump(partial(self._push, ident)))
+        try:
+            await stream.closed.wait()
+            # Рассылка отключила подписку - пустой PUSH закрывает поток у воркера
+            self._send(Frame.PUSH, ident, b"")
+            self.streams.pop(ident, None)
+        finally:
+            pump.cancel()
+            await stream.close()
+
+
+class EngineServer:
+    def __init__(self, exchange, path: str):
+        self.exchange = exchange
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        # Сокет от прошлого запуска мешает bind
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._accept, path=self.path)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await EngineConnection(self.exchange, reader, writer).serve()
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class RemoteStream:
+    # Поток рассылки из процесса движка; интерфейс тот же, что у LocalStream
+    def __init__(self, client: "EngineClient", ident: int, queue_size: int):
+        self.client = client
+        self.ident = ident
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = asyncio.Event()
+
+    def deliver(self, message: Optional[str]):
+        if message is None:
+            self.closed.set()
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Клиент не успевает за воркером - как и при переполнении в движке, отключаем
+            self.closed.set()
+
+    async def subscribe(self, ticker: str) -> Optional[str]:
+        return await self.client.call("stream_subscribe", self.ident, ticker)
+
+    async def unsubscribe(self, ticker: str):
+        await self.client.call("stream_unsubscribe", self.ident, ticker)
+
+    async def pump(self, send: Callable[[str], Awaitable]):
+        while True:
+            await send(await self.queue.get())
+
+    async def close(self):
+        if self.client._streams.pop(self.ident, None) is None or self.client._writer is None:
+            return
+        try:
+            await self.client.call("close_stream", self.ident)
+        except HTTPException:
+            pass
+
+
+class EngineClient:
+    # Сторона воркера: те же операции, что у Exchange, но выполняются в процессе движка.
+    # Одно соединение на воркер, вызовы мультиплексируются по номеру
+    def __init__(self, path: str):
+        self.path = path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._receiver: Optional[asyncio.Task] = None
+        self._calls: Dict[int, asyncio.Future] = {}
+        self._streams: Dict[int, RemoteStream] = {}
+        self._ids = itertools.count(1)
+
+    async def connect(self, timeout: float):
+        # Движок может подниматься дольше воркера (повтор журнала), поэтому ждём сокет
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.1)
+        self._receiver = asyncio.create_task(self._receive())
+
+    async def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        await self._receiver
+
+    async def _receive(self):
+        try:
+            while True:
+                kind, ident, body = await read_frame(self._reader)
+                if kind == Frame.PUSH:
+                    stream = self._streams.get(ident)
+                    if stream is not None:
+                        stream.deliver(body.decode() if body else None)
+                    continue
+
+                future = self._calls.pop(ident, None)
+                if future is None or future.done():
+                    continue
+                if kind == Frame.RESULT:
+                    future.set_result(pickle.loads(body))
+                else:
+                    status_code, detail = pickle.loads(body)
+                    future.set_exception(HTTPException(status_code=status_code, detail=detail))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            if not self._writer.is_closing():
+                logger.error(f"Engine connection {self.path} lost")
+        finally:
+            self._writer = None
+            for future in self._calls.values():
+                if not future.done():
+                    future.set_exception(HTTPException(status_code=503, detail="Engine unavailable"))
+            self._calls.clear()
+            for stream in self._streams.values():
+                stream.closed.set()
+            self._streams.clear()
+
+    async def call(self, method: str, *args, **kwargs):
+        if self._writer is None:
+            raise HTTPException(status_code=503, detail="Engine unavailable")
+        ident = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[ident] = future
+        self._writer.write(encode_frame(Frame.CALL, ident, pickle.dumps((method, args, kwargs), protocol=pickle.HIGHEST_PROTOCOL)))
+        await self._writer.drain()
+        return await future
+
+    def __getattr__(self, name: str):
+        if name not in COMMANDS:
+            raise AttributeError(name)
+        return partial(self.call, name)
+
+    async def _open_stream(self, user_id: Optional[UUID], queue_size: int) -> RemoteStream:
+        stream = RemoteStream(self, next(self._ids), queue_size)
+        self._streams[stream.ident] = stream
+        try:
+            await self.call("open_stream", stream.ident, user_id)
+        except HTTPException:
+            self._streams.pop(stream.ident, None)
+            raise
+        return stream
+
+    async def market_stream(self) -> RemoteStream:
+        return await self._open_stream(None, MARKETDATA_QUEUE_SIZE)
+
+    async def user_stream(self, user_id: UUID) -> RemoteStream:
+        return await self._open_stream(user_id, USERFEED_QUEUE_SIZE)
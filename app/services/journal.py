@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import pickle
+import struct
+import sys
+import zlib
+from enum import IntEnum
+from typing import Iterator, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Заголовок записи: длина тела, crc32 тела, номер записи, тип команды
+HEADER = struct.Struct("<IIQB")
+
+
+class Command(IntEnum):
+    REGISTER = 1
+    DEPOSIT = 2
+    WITHDRAW = 3
+    SUBMIT_ORDER = 4
+    CANCEL_ORDER = 5
+    ADD_INSTRUMENT = 6
+    REMOVE_INSTRUMENT = 7
+    DELETE_USER = 8
+
+
+def encode_record(seq: int, command: Command, payload: tuple) -> bytes:
+    body = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(body), zlib.crc32(body), seq, command) + body
+
+
+class JournalFailed(Exception):
+    pass
+
+
+class Journal:
+    def __init__(self, path: str):
+        self.path = path
+        self.seq = 0
+        self._file = None
+        self._buffer = bytearray()
+        self._batch: Optional[asyncio.Future] = None
+        self._writing: Optional[asyncio.Future] = None
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        # Длина целой части файла; известна, только если read() дочитал журнал до конца
+        self._valid_size: Optional[int] = None
+        # Ошибка записи. После неё журнал больше ничего не принимает: команды уже применены
+        # в памяти, а любые записи после потерянных при повторе разошлись бы с подтверждённым клиентам
+        self.failed: Optional[BaseException] = None
+
+    def read(self, after_seq: int = 0) -> Iterator[Tuple[int, Command, tuple]]:
+        # Читает журнал до первой битой записи или разрыва в номерах - хвост после них отбрасывается.
+        # Записи до after_seq (уже вошедшие в снапшот) проверяются, но не распаковываются
+        self._valid_size = None
+        if not os.path.exists(self.path):
+            self._valid_size = 0
+            return
+
+        size = 0
+        last_seq = 0
+
+        with open(self.path, "rb") as f:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, crc, seq, command = HEADER.unpack(header)
+                body = f.read(length)
+                if len(body) < length or zlib.crc32(body) != crc:
+                    logger.warning(f"Journal {self.path}: torn record after seq {last_seq}, truncating")
+                    break
+                if seq != last_seq + 1:
+                    logger.error(f"Journal {self.path}: seq {seq} follows {last_seq}, truncating")
+                    break
+
+                last_seq = seq
+                self.seq = seq
+                size += HEADER.size + length
+                if seq > after_seq:
+                    yield seq, Command(command), pickle.loads(body)
+        self._valid_size = size
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if self._valid_size is None:
+            # read() не вызывался или брошен на середине: обрезка по недосчитанной длине
+            # уничтожила бы целые записи, поэтому журнал проверяется до конца здесь
+            for _ in self.read(after_seq=sys.maxsize):
+                pass
+
+        self._file = open(self.path, "ab")
+        self._file.truncate(self._valid_size)
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def sync(self):
+        # Дожидается, пока всё уже добавленное в журнал окажется на диске
+        if self.failed is not None:
+            raise JournalFailed(self.path) from self.failed
+        for batch in (self._writing, self._batch):
+            if batch is not None:
+                await asyncio.shield(batch)
+
+    async def close(self):
+        if self._flusher is None:
+            return
+        if self.failed is None:
+            await self.sync()
+        self._flusher.cancel()
+        self._flusher = None
+        self._file.close()
+
+    @property
+    def pending(self) -> Optional[asyncio.Future]:
+        # Будущее пачки, в которую попадают записи прямо сейчас; None - всё добавленное уже пишется
+        return self._batch
+
+    def append(self, command: Command, payload: tuple) -> asyncio.Future:
+        # Запись ложится в буфер синхронно, поэтому порядок в журнале совпадает с порядком применения.
+        # Будущее общее на всю пачку и завершается после fsync этой пачки
+        if self.failed is not None:
+            raise JournalFailed(self.path) from self.failed
+        self.seq += 1
+        self._buffer += encode_record(self.seq, command, payload)
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_future()
+            self._wakeup.set()
+        return self._batch
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            data, batch = bytes(self._buffer), self._batch
+            self._buffer.clear()
+            self._batch = None
+            self._writing = batch
+            # Пока идёт fsync, новые команды копятся в следующую пачку (group commit)
+            try:
+                await asyncio.to_thread(self._write, data)
+            except Exception as e:
+                # Fail-stop: и эта пачка, и накопившаяся следом на диск уже не попадут
+                logger.exception(f"Journal {self.path} write failed, no further commands are accepted")
+                self.failed = e
+                batch.set_exception(JournalFailed(self.path))
+                if self._batch is not None:
+                    self._batch.set_exception(JournalFailed(self.path))
+                    self._batch = None
+                self._buffer.clear()
+                self._writing = None
+                return
+            else:
+                batch.set_result(None)
+            self._writing = None
@@ -0,0 +1,50 @@
+import hashlib
+import time
+from collections import OrderedDict
+import bcrypt
+from app.config import API_KEY_HASH_ROUNDS, API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL
+
+
+def key_digest(api_key: str) -> bytes:
+    # По bcrypt-хэшу ключ не найти (у каждого своя соль), поэтому индекс ключей - по sha256
+    return hashlib.sha256(api_key.encode()).digest()
+
+
+def hash_key(api_key: str, rounds: int = API_KEY_HASH_ROUNDS) -> str:
+    return bcrypt.hashpw(api_key.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def check_key(api_key: str, hashed: str) -> bool:
+    return bcrypt.checkpw(api_key.encode(), hashed.encode())
+
+
+class VerifiedKeys:
+    # Дайджесты ключей, недавно прошедших проверку bcrypt, со сроком годности. Порядок вставки
+    # совпадает с порядком истечения, поэтому и просроченные, и лишние снимаются с начала
+    def __init__(self, size: int = API_KEY_CACHE_SIZE, ttl: float = API_KEY_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._expires: OrderedDict[bytes, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def __contains__(self, digest: bytes) -> bool:
+        expires = self._expires.get(digest)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._expires[digest]
+            return False
+        return True
+
+    def add(self, digest: bytes):
+        now = time.monotonic()
+        self._expires[digest] = now + self.ttl
+        self._expires.move_to_end(digest)
+        expires = self._expires
+        while expires and (len(expires) > self.size or next(iter(expires.values())) < now):
+            expires.popitem(last=False)
+
+    def discard(self, digest: bytes):
+        self._expires.pop(digest, None)
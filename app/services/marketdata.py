@@ -0,0 +1,136 @@
+import json
+from typing import Dict, List, Optional, Set, Tuple
+from app.config import MARKETDATA_QUEUE_SIZE
+from app.database import storage, Storage
+from app.schemas import Direction
+from app.services.records import OrderRecord, TradeRecord, ns_to_datetime
+from app.services.streams import StreamFeed, Subscription
+
+
+class MarketDataSubscription(Subscription):
+    def __init__(self, queue_size: int):
+        super().__init__(queue_size)
+        # Тикер -> seq последнего отправленного снапшота, всё, что не новее, уже в нём учтено
+        self.tickers: Dict[str, int] = {}
+
+
+class MarketDataFeed(StreamFeed):
+    # Раздаёт подписчикам изменения уровней стакана и сделки, сообщение кодируется один раз на всех
+    def __init__(self, storage: Storage, queue_size: int = 1000):
+        super().__init__(queue_size)
+        self.storage = storage
+        self.subscribers: Dict[str, Set[MarketDataSubscription]] = {}
+        self.seqs: Dict[str, int] = {}
+        # Последние разосланные объёмы уровней - ведутся только для тикеров с подписчиками
+        self.levels: Dict[str, Dict[Tuple[Direction, int], int]] = {}
+
+    def connect(self) -> MarketDataSubscription:
+        return MarketDataSubscription(self.queue_size)
+
+    def disconnect(self, subscription: MarketDataSubscription):
+        for ticker in list(subscription.tickers):
+            self.unsubscribe(subscription, ticker)
+
+    def subscribe(self, subscription: MarketDataSubscription, ticker: str):
+        subscribers = self.subscribers.get(ticker)
+        if subscribers is None:
+            subscribers = self.subscribers[ticker] = set()
+            self.levels[ticker] = self._book_levels(ticker)
+        subscribers.add(subscription)
+
+        # Снапшот идёт через ту же очередь, что и дельты, поэтому порядок между ними сохраняется
+        seq, message = self._snapshot(ticker)
+        subscription.tickers[ticker] = seq
+        self._deliver(subscription, (ticker, seq, message, True))
+
+    def unsubscribe(self, subscription: MarketDataSubscription, ticker: str):
+        subscription.tickers.pop(ticker, None)
+        subscribers = self.subscribers.get(ticker)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self.subscribers[ticker]
+            del self.levels[ticker]
+
+    def _book_levels(self, ticker: str) -> Dict[Tuple[Direction, int], int]:
+        book = self.storage.order_books.get(ticker)
+        if book is None:
+            return {}
+        return {
+            (side.direction, level.price): level.qty
+            for side in (book.bids, book.asks) for level in side.levels()
+        }
+
+    def _snapshot(self, ticker: str) -> Tuple[int, str]:
+        seq = self.seqs.get(ticker, 0)
+        book = self.storage.order_books.get(ticker)
+        bids, asks = [], []
+        if book is not None:
+            bids = [{"price": level.price, "qty": level.qty} for level in book.bids.levels()]
+            asks = [{"price": level.price, "qty": level.qty} for level in book.asks.levels()]
+        return seq, json.dumps({"type": "snapshot", "ticker": ticker, "seq": seq, "bid_levels": bids, "ask_levels": asks})
+
+    def _publish(self, ticker: str, message: dict):
+        seq = self.seqs.get(ticker, 0) + 1
+        self.seqs[ticker] = seq
+        message["seq"] = seq
+        item = (ticker, seq, json.dumps(message), False)
+        for subscription in list(self.subscribers[ticker]):
+            self._deliver(subscription, item)
+
+    def _resync(self, subscription: MarketDataSubscription) -> List[str]:
+        messages = []
+        for ticker in subscription.tickers:
+            seq, message = self._snapshot(ticker)
+            subscription.tickers[ticker] = seq
+            messages.append(message)
+        return messages
+
+    def _message(self, subscription: MarketDataSubscription, item: tuple) -> Optional[str]:
+        ticker, seq, message, is_snapshot = item
+        if not is_snapshot and seq <= subscription.tickers.get(ticker, seq):
+            return None
+        return message
+
+    def on_order(self, order: OrderRecord):
+        if order.is_market:
+            return
+        ticker = self.storage.tickers[order.ticker]
+        levels = self.levels.get(ticker)
+        if levels is None:
+            return
+
+        book = self.storage.order_books.get(ticker)
+        level = book.side(order.direction).get_level(order.price) if book is not None else None
+        qty = level.qty if level is not None else 0
+        key = (order.direction, order.price)
+        if levels.get(key, 0) == qty:
+            return
+        if qty:
+            levels[key] = qty
+        else:
+            levels.pop(key, None)
+
+        self._publish(ticker, {
+            "type": "level",
+            "ticker": ticker,
+            "side": order.direction.value,
+            "price": order.price,
+            "qty": qty
+        })
+
+    def on_trade(self, trade: TradeRecord, taker: OrderRecord, maker: OrderRecord):
+        ticker = self.storage.tickers[trade.ticker]
+        if ticker not in self.subscribers:
+            return
+        self._publish(ticker, {
+            "type": "trade",
+            "ticker": ticker,
+            "price": trade.price,
+            "amount": trade.qty,
+            "timestamp": ns_to_datetime(trade.ts).isoformat()
+        })
+
+
+market_data = MarketDataFeed(storage, MARKETDATA_QUEUE_SIZE)
@@ -0,0 +1,146 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+clock = time.perf_counter_ns
+
+# Границы корзин задержек в наносекундах: от 1 мкс до 1 с
+LATENCY_BUCKETS = [
+    1_000, 2_500, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000, 500_000,
+    1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000, 50_000_000,
+    100_000_000, 250_000_000, 500_000_000, 1_000_000_000
+]
+HTTP_BUCKETS = [
+    100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000,
+    50_000_000, 100_000_000, 250_000_000, 500_000_000, 1_000_000_000, 2_500_000_000, 10_000_000_000
+]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+class HistogramSeries:
+    # Счётчики корзин выделены заранее, запись - один bisect и два сложения.
+    # Накопительные суммы по корзинам считаются только при выдаче /metrics
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: List[int]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value: int):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    # Наблюдения целые (наносекунды или штуки), при выдаче делятся на unit - единицу метрики
+    def __init__(self, name: str, help: str, bounds: List[int], labels: Tuple[str, ...] = (), unit: int = 1):
+        self.name = name
+        self.help = help
+        self.bounds = bounds
+        self.label_names = labels
+        self.unit = unit
+        self.series: Dict[Tuple[str, ...], HistogramSeries] = {}
+        if not labels:
+            # Без меток observe - сразу метод единственного ряда, без лишнего вызова
+            self.default = self.labels()
+            self.observe = self.default.observe
+
+    def labels(self, *values: str) -> HistogramSeries:
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = HistogramSeries(self.bounds)
+        return series
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for values, series in self.series.items():
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, values))
+            prefix = labels + "," if labels else ""
+            total = 0
+            for bound, count in zip(self.bounds, series.counts):
+                total += count
+                yield f'{self.name}_bucket{{{prefix}le="{format_value(bound / self.unit)}"}} {total}'
+            total += series.counts[-1]
+            yield f'{self.name}_bucket{{{prefix}le="+Inf"}} {total}'
+            suffix = f"{{{labels}}}" if labels else ""
+            yield f"{self.name}_sum{suffix} {format_value(series.sum / self.unit)}"
+            yield f"{self.name}_count{suffix} {total}"
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def gauge(name: str, help: str, samples: Iterable[Tuple[Dict[str, str], float]], kind: str = "gauge") -> Iterable[str]:
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} {kind}"
+    for labels, value in samples:
+        rendered = ",".join(f'{key}="{label}"' for key, label in labels.items())
+        yield f"{name}{{{rendered}}} {format_value(value)}" if rendered else f"{name} {format_value(value)}"
+
+
+ORDER_LATENCY = Histogram(
+    "exchange_order_latency_seconds", "Order placement time in the engine, including the journal write",
+    LATENCY_BUCKETS, unit=1_000_000_000
+)
+QUEUE_WAIT = Histogram(
+    "exchange_queue_wait_seconds", "Time a command spent in the engine queue", LATENCY_BUCKETS, unit=1_000_000_000
+)
+ENGINE_BATCH = Histogram("exchange_engine_batch_size", "Commands processed in one engine pass", COUNT_BUCKETS)
+MATCH_TIME = Histogram(
+    "exchange_match_seconds", "Time spent matching one order against the book", LATENCY_BUCKETS, unit=1_000_000_000
+)
+SETTLEMENT_TIME = Histogram(
+    "exchange_settlement_seconds", "Balance settlement time of one trade", LATENCY_BUCKETS, unit=1_000_000_000
+)
+FILLS_PER_ORDER = Histogram("exchange_fills_per_order", "Trades produced by one incoming order", COUNT_BUCKETS)
+HTTP_LATENCY = Histogram(
+    "exchange_http_request_duration_seconds", "HTTP request latency by route",
+    HTTP_BUCKETS, labels=("method", "route", "status"), unit=1_000_000_000
+)
+
+# Гистограммы процесса движка; HTTP_LATENCY ведёт каждый процесс, принимающий запросы
+ENGINE_HISTOGRAMS = [ORDER_LATENCY, QUEUE_WAIT, ENGINE_BATCH, MATCH_TIME, SETTLEMENT_TIME, FILLS_PER_ORDER]
+
+# Источники мгновенных значений, опрашиваются только при выдаче /metrics
+collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def render(histograms: List[Histogram]) -> str:
+    lines: List[str] = []
+    for histogram in histograms:
+        lines.extend(histogram.render())
+    for collector in collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    # Чистый ASGI-мидлварь: BaseHTTPMiddleware заметно дороже на каждом запросе.
+    # Метка маршрута - шаблон пути, а не сам путь, чтобы не плодить ряды на каждый order_id
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = clock()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_LATENCY.labels(scope["method"], path, str(status)).observe(clock() - started)
@@ -1,273 +1,721 @@
 # Исправление тестов (94.7% Fix)
 import asyncio
-from typing import Union, List
+import logging
+from typing import Any, Callable, Optional, Dict, Iterable, List, Tuple
 from uuid import UUID
 from fastapi import HTTPException
-from datetime import datetime, timezone
+from app.config import ENGINE_QUEUE_SIZE, ENGINE_BATCH_SIZE
 from app.database import storage, Storage
-from app.schemas import Direction, OrderStatus, Transaction, LimitOrder, MarketOrder, LimitOrderBody, MarketOrderBody
+from app.schemas import Direction, OrderStatus, TimeInForce, User, UserRole, Instrument
+from app.services.book import OrderBook
+from app.services.events import EngineListener
+from app.services.journal import Journal, JournalFailed, Command
+from app.services.metrics import (clock, ORDER_LATENCY, QUEUE_WAIT, ENGINE_BATCH, MATCH_TIME, SETTLEMENT_TIME,
+                                  FILLS_PER_ORDER)
+from app.services.records import OrderRecord, TradeRecord
 
 
-class MatchingEngine:
-    def __init__(self, storage: Storage):
-        self.storage = storage
-        self.lock = asyncio.Lock()
+logger = logging.getLogger(__name__)
 
-    def _get_best_ask_price(self, ticker: str) -> int:
-        asks = self.storage.order_books.get(ticker, {}).get(Direction.SELL, [])
-        if not asks:
-            raise HTTPException(status_code=400, detail="No sell orders available")
-        return min(ask.body.price for ask in asks if ask.status in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED])
 
-    def _get_best_bid_price(self, ticker: str) -> int:
-        bids = self.storage.order_books.get(ticker, {}).get(Direction.BUY, [])
-        if not bids:
-            raise HTTPException(status_code=400, detail="No buy orders available")
-        return max(bid.body.price for bid in bids if bid.status in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED])
+def journal_failed() -> HTTPException:
+    return HTTPException(status_code=503, detail="Journal write failed, engine is stopped until restart")
 
-    async def _execute_trade(
+
+class MatchingEngine:
+    def __init__(self, storage: Storage, queue_size: int = ENGINE_QUEUE_SIZE, batch_size: int = ENGINE_BATCH_SIZE):
+        self.storage = storage
+        # Состояние меняет только одна задача - потребитель очереди команд. Команды исполняются
+        # по одной и без await внутри, поэтому блокировки не нужны, а порядок исполнения и есть порядок журнала
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.rejected = 0
+        # Команды журнала, упавшие при повторе
+        self.replay_errors = 0
+        self._consumer: Optional[asyncio.Task] = None
+        self.journal: Optional[Journal] = None
+        self.listeners: List[EngineListener] = []
+
+    def _start(self):
+        # Очередь и потребитель привязаны к циклу событий, поэтому создаются при первой команде в нём
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._consumer = asyncio.create_task(self._consume())
+
+    async def _consume(self):
+        queue = self.queue
+        while True:
+            # Всё, что накопилось, пока шла предыдущая пачка, разбирается за один проход:
+            # одно переключение задач на пачку, а записи журнала всей пачки уходят одним fsync
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            ENGINE_BATCH.observe(len(batch))
+
+            for command, args, future, enqueued in batch:
+                QUEUE_WAIT.observe(clock() - enqueued)
+                if future.cancelled():
+                    # Запрос уже отменён (клиент ушёл) - команда не исполняется
+                    continue
+                if self.journal is not None and self.journal.failed is not None:
+                    # Журнал отказал - состояние больше не меняется до перезапуска
+                    future.set_exception(journal_failed())
+                    continue
+                try:
+                    result = command(*args)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result((result, self.journal.pending if self.journal is not None else None))
+
+    async def close(self):
+        # Останавливает потребителя; команды, ещё лежащие в очереди, не исполняются
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+
+    async def _execute(self, command: Callable, *args) -> Any:
+        # Ответ приходит после исполнения команды, а если она писала в журнал - после fsync её пачки
+        if self.journal is not None and self.journal.failed is not None:
+            raise journal_failed()
+        if self._consumer is None or self._consumer.done():
+            self._start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((command, args, future, clock()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Engine is overloaded, try again later")
+
+        result, pending = await future
+        if pending is not None:
+            try:
+                await pending
+            except JournalFailed:
+                # Команда применена, но не записана - подтверждать её нельзя
+                raise journal_failed()
+        return result
+
+    def get_book(self, ticker: str) -> OrderBook:
+        book = self.storage.order_books.get(ticker)
+        if book is None:
+            book = OrderBook(ticker)
+            self.storage.order_books[ticker] = book
+        return book
+
+    def _index_open_order(self, order: OrderRecord):
+        self.storage.open_orders.setdefault(order.user, {})[order.id] = order
+
+    def _unindex_open_order(self, order: OrderRecord):
+        user_orders = self.storage.open_orders.get(order.user)
+        if user_orders is not None:
+            user_orders.pop(order.id, None)
+            if not user_orders:
+                del self.storage.open_orders[order.user]
+
+    def _emit_order(self, order: OrderRecord):
+        for listener in self.listeners:
+            listener.on_order(order)
+
+    def _emit_balance(self, user_id: UUID, ticker: str):
+        amount = self.storage.balances[user_id][ticker]
+        for listener in self.listeners:
+            listener.on_balance(user_id, ticker, amount)
+
+    def _available(self, user_id: UUID, asset: str) -> int:
+        return self.storage.balances.get(user_id, {}).get(asset, 0) - self.storage.reserved.get(user_id, {}).get(asset, 0)
+
+    def _reserve(self, user_id: UUID, asset: str, amount: int):
+        user_reserved = self.storage.reserved.setdefault(user_id, {})
+        user_reserved[asset] = user_reserved.get(asset, 0) + amount
+
+    def _release(self, user_id: UUID, asset: str, amount: int):
+        self.storage.reserved[user_id][asset] -= amount
+
+    def _resting_reservation(self, order: OrderRecord) -> Tuple[str, int]:
+        # Резерв стоящей заявки - ровно её неисполненный остаток по её цене
+        if order.direction == Direction.BUY:
+            return "RUB", (order.qty - order.filled) * order.price
+        return self.storage.tickers[order.ticker], order.qty - order.filled
+
+    def reserve_resting(self, order: OrderRecord):
+        # Для восстановления из снапшота: резервы не хранятся, они следуют из стоящих заявок
+        self._reserve(self.storage.user_ids[order.user], *self._resting_reservation(order))
+
+    def _execute_trade(
             self,
             buyer_id: UUID,
             seller_id: UUID,
             ticker: str,
             qty: int,
-            price: int
-    ):
+            price: int,
+            taker: OrderRecord,
+            buyer_reserve_price: int
+    ) -> TradeRecord:
+        # Обе стороны зарезервировали средства при выставлении, поэтому проверок здесь нет:
+        # списание идёт из резерва, покупатель освобождает резерв по цене, по которой его делал
+        started = clock()
         total_rub = qty * price
+        balances = self.storage.balances
+        reserved = self.storage.reserved
 
-        if buyer_id not in self.storage.balances:
-            self.storage.balances[buyer_id] = {}
-        if seller_id not in self.storage.balances:
-            self.storage.balances[seller_id] = {}
-
-        for user_id in [buyer_id, seller_id]:
-            self.storage.balances[user_id].setdefault("RUB", 0)
-            self.storage.balances[user_id].setdefault(ticker, 0)
-
-        if self.storage.balances[buyer_id]["RUB"] < total_rub:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Buyer {buyer_id} has insufficient RUB: {self.storage.balances[buyer_id]['RUB']} < {total_rub}"
-            )
-
-        if self.storage.balances[seller_id][ticker] < qty:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Seller {seller_id} has insufficient {ticker}: {self.storage.balances[seller_id][ticker]} < {qty}"
-            )
-
-        self.storage.balances[buyer_id]["RUB"] -= total_rub
-        self.storage.balances[buyer_id][ticker] += qty
-        self.storage.balances[seller_id]["RUB"] += total_rub
-        self.storage.balances[seller_id][ticker] -= qty
-
-        transaction = Transaction(
-            ticker=ticker,
-            amount=qty,
-            price=price,
-            timestamp=datetime.now(timezone.utc)
-        )
-        self.storage.transactions.append(transaction)
+        buyer_balances = balances[buyer_id]
+        buyer_balances["RUB"] -= total_rub
+        buyer_balances[ticker] = buyer_balances.get(ticker, 0) + qty
+        reserved[buyer_id]["RUB"] -= qty * buyer_reserve_price
 
-    async def _execute_market_order(self, order: MarketOrder, user_id: UUID):
-        ticker = order.body.ticker
-        remaining_qty = order.body.qty
+        seller_balances = balances[seller_id]
+        seller_balances["RUB"] = seller_balances.get("RUB", 0) + total_rub
+        seller_balances[ticker] -= qty
+        reserved[seller_id][ticker] -= qty
 
-        opposite_direction = Direction.SELL if order.body.direction == Direction.BUY else Direction.BUY
+        # Время сделки - время приёма агрессивной заявки, так повтор журнала детерминирован
+        trade = TradeRecord(taker.ticker, price, qty, taker.ts)
+        self.storage.get_trade_tape(ticker).append(trade)
+        for series in self.storage.get_candles(ticker).values():
+            series.update(price, qty, trade.ts)
 
-        opposite_orders = [
-            o for o in self.storage.order_books.get(ticker, {}).get(opposite_direction, [])
-            if o.status in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]
-        ]
+        SETTLEMENT_TIME.observe(clock() - started)
 
-        if not opposite_orders:
-            raise HTTPException(
-                status_code=400,
-                detail="No matching orders available for market execution"
-            )
+        if self.listeners:
+            for user_id in [buyer_id, seller_id]:
+                self._emit_balance(user_id, "RUB")
+                self._emit_balance(user_id, ticker)
 
-        if order.body.direction == Direction.BUY:
-            opposite_orders.sort(key=lambda x: x.body.price)  # Самые дешевые продажи первыми
-        else:
-            opposite_orders.sort(key=lambda x: x.body.price, reverse=True)  # Самые дорогие покупки первыми
+        return trade
 
-        executed = False
-        for opposite_order in opposite_orders:
-            if remaining_qty <= 0:
+    def _match(
+            self,
+            book: OrderBook,
+            order: OrderRecord,
+            user_id: UUID,
+            qty: int,
+            limit_price: Optional[int] = None,
+            reserve_price: Optional[int] = None
+    ) -> Tuple[int, int]:
+        # Идём по уровням от лучшей цены, внутри уровня - в порядке поступления заявок.
+        # Возвращает исполненный объём и его стоимость
+        started = clock()
+        fills = 0
+        cost = 0
+        is_buy = order.direction == Direction.BUY
+        opposite_side = book.opposite(order.direction)
+        user_ids = self.storage.user_ids
+        executed_qty = 0
+        remaining_qty = qty
+
+        while remaining_qty > 0:
+            level = opposite_side.best()
+            if level is None:
                 break
+            if limit_price is not None:
+                if is_buy and level.price > limit_price:  # Наша цена покупки >= цены продажи
+                    break
+                if not is_buy and level.price < limit_price:  # Наша цена продажи <= цены покупки
+                    break
 
-            available_qty = opposite_order.body.qty - opposite_order.filled
-            if available_qty <= 0:
-                continue
+            opposite_order = level.first()
+            match_qty = min(remaining_qty, opposite_order.qty - opposite_order.filled)
+            match_price = level.price
 
-            match_qty = min(remaining_qty, available_qty)
-            match_price = opposite_order.body.price
-
-            if order.body.direction == Direction.BUY:
+            if is_buy:
                 buyer_id = user_id
-                seller_id = opposite_order.user_id
+                seller_id = user_ids[opposite_order.user]
+                buyer_reserve_price = match_price if reserve_price is None else reserve_price
             else:
-                buyer_id = opposite_order.user_id
+                buyer_id = user_ids[opposite_order.user]
                 seller_id = user_id
+                buyer_reserve_price = match_price
 
-            await self._execute_trade(
+            if executed_qty == 0:
+                # Слушатели должны узнать о заявке раньше, чем о её первой сделке
+                self._emit_order(order)
+
+            trade = self._execute_trade(
                 buyer_id,
                 seller_id,
-                ticker,
+                book.ticker,
                 match_qty,
-                match_price
+                match_price,
+                order,
+                buyer_reserve_price
             )
 
-            opposite_order.filled += match_qty
-            remaining_qty -= match_qty
-            executed = True
-
-            if opposite_order.filled >= opposite_order.body.qty:
+            book.fill(opposite_order, match_qty)
+            if opposite_order.filled >= opposite_order.qty:
                 opposite_order.status = OrderStatus.EXECUTED
-                if opposite_order in self.storage.order_books[ticker][opposite_direction]:
-                    self.storage.order_books[ticker][opposite_direction].remove(opposite_order)
+                self._unindex_open_order(opposite_order)
             else:
                 opposite_order.status = OrderStatus.PARTIALLY_EXECUTED
 
-        if remaining_qty == 0:
+            executed_qty += match_qty
+            remaining_qty -= match_qty
+            cost += match_qty * match_price
+            order.filled += match_qty
+            fills += 1
+
+            for listener in self.listeners:
+                listener.on_trade(trade, order, opposite_order)
+            self._emit_order(opposite_order)
+
+        MATCH_TIME.observe(clock() - started)
+        FILLS_PER_ORDER.observe(fills)
+        return executed_qty, cost
+
+    def _execute_market_order(self, order: OrderRecord, user_id: UUID) -> int:
+        # Возвращает, сколько зарезервированного актива потрачено: RUB для покупки, инструмента для продажи
+        book = self.get_book(self.storage.tickers[order.ticker])
+
+        executed_qty, cost = self._match(book, order, user_id, order.qty)
+
+        if executed_qty == order.qty:
             order.status = OrderStatus.EXECUTED
-        elif executed:
+        elif executed_qty > 0:
             order.status = OrderStatus.PARTIALLY_EXECUTED
         else:
             raise HTTPException(
                 status_code=400,
                 detail="Not enough liquidity for market order"
             )
+        self._emit_order(order)
+        return cost if order.direction == Direction.BUY else executed_qty
 
-    async def _execute_limit_order(self, order: LimitOrder, user_id: UUID):
-        ticker = order.body.ticker
-        remaining_qty = order.body.qty
+    def _execute_limit_order(self, order: OrderRecord, user_id: UUID):
+        book = self.get_book(self.storage.tickers[order.ticker])
 
-        opposite_direction = Direction.SELL if order.body.direction == Direction.BUY else Direction.BUY
-        opposite_orders = [
-            o for o in self.storage.order_books.get(ticker, {}).get(opposite_direction, [])
-            if o.status in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]
-        ]
-
-        matching_orders = []
-        for o in opposite_orders:
-            if order.body.direction == Direction.BUY:
-                if o.body.price <= order.body.price:  # Наша цена покупки >= цены продажи
-                    matching_orders.append(o)
-            else:
-                if o.body.price >= order.body.price:  # Наша цена продажи <= цены покупки
-                    matching_orders.append(o)
+        self._match(book, order, user_id, order.qty - order.filled, limit_price=order.price, reserve_price=order.price)
 
-        if not matching_orders:
-            self.storage.order_books[ticker][order.body.direction].append(order)
-            order.status = OrderStatus.NEW
+        if order.filled >= order.qty:
+            order.status = OrderStatus.EXECUTED
+        elif order.time_in_force != TimeInForce.GTC:
+            # IOC в стакан не встаёт: остаток снимается сразу вместе со своим резервом
+            order.status = OrderStatus.PARTIALLY_EXECUTED if order.filled > 0 else OrderStatus.CANCELLED
+            self._release(user_id, *self._resting_reservation(order))
+        else:
+            order.status = OrderStatus.PARTIALLY_EXECUTED if order.filled > 0 else OrderStatus.NEW
+            book.add(order)
+            self._index_open_order(order)
+        self._emit_order(order)
+
+    def _cancel_order(self, order: OrderRecord):
+        book = self.storage.order_books.get(self.storage.tickers[order.ticker])
+        if book is not None and book.remove(order.id) is not None:
+            self._release(self.storage.user_ids[order.user], *self._resting_reservation(order))
+        self._unindex_open_order(order)
+        order.status = OrderStatus.CANCELLED
+        self._emit_order(order)
+
+    def _cancel_user_orders(self, user_id: UUID):
+        handle = self.storage.user_handles.get(user_id)
+        for order in list(self.storage.open_orders.get(handle, {}).values()):
+            self._cancel_order(order)
+
+    def _close_book(self, ticker: str):
+        book = self.storage.order_books.pop(ticker, None)
+        if book is None:
             return
+        for order in book.orders():
+            self._release(self.storage.user_ids[order.user], *self._resting_reservation(order))
+            self._unindex_open_order(order)
+            order.status = OrderStatus.CANCELLED
+            self._emit_order(order)
+
+    def _append(self, command: Command, payload: tuple) -> Optional[asyncio.Future]:
+        if self.journal is None:
+            return None
+        return self.journal.append(command, payload)
+
+    def _register_user(self, user: User, key_digest: bytes):
+        # user.api_key - уже bcrypt-хэш, ключ целиком до движка не доходит
+        self.storage.users[user.id] = user
+        self.storage.api_keys[key_digest] = user.id
+        self.storage.key_digests[user.id] = key_digest
+        self.storage.balances[user.id] = {"RUB": 0}
+        self.storage.user_handle(user.id)
+        for listener in self.listeners:
+            listener.on_user(user)
+        self._append(Command.REGISTER, (user.id.bytes, user.name, user.role.value, user.api_key, key_digest))
+
+    async def register_user(self, user: User, key_digest: bytes):
+        await self._execute(self._register_user, user, key_digest)
+
+    def _delete_user(self, user_id: UUID) -> User:
+        user = self.storage.users.get(user_id)
+
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        self._cancel_user_orders(user_id)
+
+        del self.storage.users[user_id]
+        del self.storage.api_keys[self.storage.key_digests.pop(user_id)]
+        if user_id in self.storage.balances:
+            del self.storage.balances[user_id]
+        self.storage.reserved.pop(user_id, None)
+
+        self._append(Command.DELETE_USER, (user_id.bytes,))
+        return user
+
+    async def delete_user(self, user_id: UUID) -> User:
+        return await self._execute(self._delete_user, user_id)
+
+    def _add_instrument(self, instrument: Instrument):
+        if instrument.ticker in self.storage.instruments:
+            raise HTTPException(status_code=400, detail="Instrument already exists")
+
+        self.storage.instruments[instrument.ticker] = instrument
+        self.storage.instruments_version += 1
+        self.storage.order_books[instrument.ticker] = OrderBook(instrument.ticker)
+        for user_id, user_balances in self.storage.balances.items():
+            if user_id not in self.storage.users:
+                continue
+            user_balances.setdefault(instrument.ticker, 0)
+        for listener in self.listeners:
+            listener.on_instrument(instrument)
 
-        if order.body.direction == Direction.BUY:
-            matching_orders.sort(key=lambda x: x.body.price)  # Дешевые первыми
-        else:
-            matching_orders.sort(key=lambda x: x.body.price, reverse=True)  # Дорогие первыми
+        self._append(Command.ADD_INSTRUMENT, (instrument.ticker, instrument.name))
 
-        for opposite_order in matching_orders:
-            if remaining_qty <= 0:
-                break
+    async def add_instrument(self, instrument: Instrument):
+        await self._execute(self._add_instrument, instrument)
 
-            available_qty = opposite_order.body.qty - opposite_order.filled
-            match_qty = min(remaining_qty, available_qty)
-            match_price = opposite_order.body.price
+    def _remove_instrument(self, ticker: str):
+        if ticker not in self.storage.instruments:
+            raise HTTPException(status_code=404, detail="Instrument not found")
 
-            if order.body.direction == Direction.BUY:
-                buyer_id = user_id
-                seller_id = opposite_order.user_id
-            else:
-                buyer_id = opposite_order.user_id
-                seller_id = user_id
+        if ticker == "RUB":
+            raise HTTPException(status_code=400, detail="Cannot delete RUB")
 
-            await self._execute_trade(
-                buyer_id,
-                seller_id,
-                ticker,
-                match_qty,
-                match_price
-            )
+        # Cancel all orders for this instrument
+        self._close_book(ticker)
 
-            opposite_order.filled += match_qty
-            order.filled += match_qty
-            remaining_qty -= match_qty
+        del self.storage.instruments[ticker]
+        self.storage.instruments_version += 1
+        self.storage.trade_tapes.pop(ticker, None)
+        self.storage.candles.pop(ticker, None)
 
-            if opposite_order.filled >= opposite_order.body.qty:
-                opposite_order.status = OrderStatus.EXECUTED
-                if opposite_order in self.storage.order_books[ticker][opposite_direction]:
-                    self.storage.order_books[ticker][opposite_direction].remove(opposite_order)
-            else:
-                opposite_order.status = OrderStatus.PARTIALLY_EXECUTED
+        self._append(Command.REMOVE_INSTRUMENT, (ticker,))
 
-        if order.filled >= order.body.qty:
-            order.status = OrderStatus.EXECUTED
-        elif order.filled > 0:
-            order.status = OrderStatus.PARTIALLY_EXECUTED
-            if order not in self.storage.order_books[ticker][order.body.direction]:
-                self.storage.order_books[ticker][order.body.direction].append(order)
-        else:
-            order.status = OrderStatus.NEW
-            if order not in self.storage.order_books[ticker][order.body.direction]:
-                self.storage.order_books[ticker][order.body.direction].append(order)
+    async def remove_instrument(self, ticker: str):
+        await self._execute(self._remove_instrument, ticker)
 
-    async def process_order(self, order: Union[LimitOrder, MarketOrder], user_id: UUID):
-        async with self.lock:
-            ticker = order.body.ticker
+    def _deposit(self, user_id: UUID, ticker: str, amount: int):
+        if user_id not in self.storage.users:
+            raise HTTPException(status_code=404, detail="User not found")
 
-            if ticker not in self.storage.instruments:
-                raise HTTPException(status_code=404, detail="Instrument not found")
+        if ticker not in self.storage.instruments:
+            raise HTTPException(status_code=404, detail="Instrument not found")
 
-            if ticker not in self.storage.order_books:
-                self.storage.order_books[ticker] = {
-                    Direction.BUY: [],
-                    Direction.SELL: []
-                }
+        if user_id not in self.storage.balances:
+            self.storage.balances[user_id] = {}
 
-            if user_id not in self.storage.balances:
-                self.storage.balances[user_id] = {}
-            user_balances = self.storage.balances[user_id]
-            user_balances.setdefault("RUB", 0)
-            user_balances.setdefault(ticker, 0)
+        self.storage.balances[user_id][ticker] = self.storage.balances[user_id].get(ticker, 0) + amount
+        self._emit_balance(user_id, ticker)
 
-            if order.body.direction == Direction.BUY:
-                if isinstance(order, MarketOrder):
-                    try:
-                        best_ask = self._get_best_ask_price(ticker)
-                    except HTTPException:
-                        best_ask = None
+        self._append(Command.DEPOSIT, (user_id.bytes, ticker, amount))
 
-                    if best_ask is None:
-                        raise HTTPException(
-                            status_code=400,
-                            detail="No liquidity for market order"
-                        )
-                    required_rub = order.body.qty * best_ask
-                else:
-                    required_rub = order.body.qty * order.body.price
+    async def deposit(self, user_id: UUID, ticker: str, amount: int):
+        await self._execute(self._deposit, user_id, ticker, amount)
 
-                if user_balances["RUB"] < required_rub:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Insufficient RUB balance: {user_balances['RUB']} < {required_rub}"
-                    )
+    def _withdraw(self, user_id: UUID, ticker: str, amount: int):
+        if user_id not in self.storage.users:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        if ticker not in self.storage.instruments:
+            raise HTTPException(status_code=404, detail="Instrument not found")
+
+        # Средства под открытыми заявками вывести нельзя
+        if self._available(user_id, ticker) < amount:
+            raise HTTPException(status_code=400, detail="Insufficient balance")
+
+        self.storage.balances[user_id][ticker] -= amount
+        self._emit_balance(user_id, ticker)
+
+        self._append(Command.WITHDRAW, (user_id.bytes, ticker, amount))
+
+    async def withdraw(self, user_id: UUID, ticker: str, amount: int):
+        await self._execute(self._withdraw, user_id, ticker, amount)
+
+    def _cancel_orders(self, orders: List[OrderRecord], atomic: bool) -> List[Optional[HTTPException]]:
+        # Пока команда ждала в очереди, заявки могли исполниться - проверяем уже здесь
+        errors: List[Optional[HTTPException]] = [
+            None if order.status == OrderStatus.NEW
+            else HTTPException(status_code=400, detail="Order cannot be cancelled (already executed or cancelled)")
+            for order in orders
+        ]
+        if atomic and any(errors):
+            return errors
+
+        for order, error in zip(orders, errors):
+            if error is None:
+                self._cancel_order(order)
+                self._append(Command.CANCEL_ORDER, (order.id.bytes,))
+        return errors
+
+    async def cancel_orders(self, orders: List[OrderRecord], atomic: bool = False) -> List[Optional[HTTPException]]:
+        return await self._execute(self._cancel_orders, orders, atomic)
+
+    def _cancel_open_orders(
+            self,
+            user_id: UUID,
+            ticker: Optional[str],
+            direction: Optional[Direction]
+    ) -> List[Tuple[OrderRecord, Optional[HTTPException]]]:
+        # Выборка идёт уже в движке, поэтому в неё попадает ровно то, что стоит в стакане сейчас
+        handle = self.storage.user_handles.get(user_id)
+        ticker_handle = self.storage.ticker_handles.get(ticker) if ticker is not None else None
+        orders = [
+            order for order in self.storage.open_orders.get(handle, {}).values()
+            if (ticker is None or order.ticker == ticker_handle) and (direction is None or order.direction == direction)
+        ]
+
+        # Частично исполненные заявки не отменяются - так же, как по одной
+        results = [
+            (order, HTTPException(status_code=400, detail="Partially executed orders cannot be cancelled")
+             if order.status == OrderStatus.PARTIALLY_EXECUTED else None)
+            for order in orders
+        ]
+        self._cancel_orders([order for order, error in results if error is None], atomic=False)
+        return results
+
+    async def cancel_open_orders(
+            self,
+            user_id: UUID,
+            ticker: Optional[str] = None,
+            direction: Optional[Direction] = None
+    ) -> List[Tuple[OrderRecord, Optional[HTTPException]]]:
+        return await self._execute(self._cancel_open_orders, user_id, ticker, direction)
+
+    async def cancel_order(self, order: OrderRecord):
+        error = (await self.cancel_orders([order]))[0]
+        if error is not None:
+            raise error
+
+    def _place_order(self, order: OrderRecord):
+        self.storage.orders[order.id] = order
+        try:
+            self._submit(order)
+        except Exception as e:
+            del self.storage.orders[order.id]
+            raise e
+
+    async def place_order(self, order: OrderRecord):
+        started = clock()
+        try:
+            await self._execute(self._place_order, order)
+        finally:
+            ORDER_LATENCY.observe(clock() - started)
+
+    async def process_order(self, order: OrderRecord):
+        # Заявка уже лежит в storage.orders
+        await self._execute(self._submit, order)
+
+    def _submit(self, order: OrderRecord):
+        ticker = self.storage.tickers[order.ticker]
+        user_id = self.storage.user_ids[order.user]
+
+        if ticker not in self.storage.instruments:
+            raise HTTPException(status_code=404, detail="Instrument not found")
+
+        book = self.get_book(ticker)
+        is_buy = order.direction == Direction.BUY
+        asset = "RUB" if is_buy else ticker
+
+        # Заявка сразу резервирует всё, что может потратить, - проверка одна, за O(1) для лимитной
+        if order.is_market:
+            if not book.opposite(order.direction):
+                raise HTTPException(
+                    status_code=400,
+                    detail="No liquidity for market order" if is_buy else "No matching orders available for market execution"
+                )
+            if is_buy:
+                # Рыночная покупка резервирует ровно стоимость прохода по стакану - бинарный поиск по префиксам
+                _, required, _ = book.asks.cost(order.qty)
             else:
-                if user_balances[ticker] < order.body.qty:
+                required = order.qty
+        else:
+            # FOK решается до любых изменений: хватает ли встречного объёма не хуже цены заявки.
+            # Отказ ничего не трогает, откатывать нечего
+            if order.time_in_force == TimeInForce.FOK and not book.opposite(order.direction).fills(order.qty, order.price):
+                raise HTTPException(status_code=400, detail="Fill-or-kill order cannot be filled")
+            required = order.qty * order.price if is_buy else order.qty
+
+        available = self._available(user_id, asset)
+        if available < required:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Insufficient {asset} balance: {available} < {required}"
+            )
+        self._reserve(user_id, asset, required)
+
+        # Журналируется всё, что прошло проверки: исполнение детерминировано,
+        # и при повторе команда упадёт или исполнится точно так же
+        self._append(Command.SUBMIT_ORDER, self.encode_order(order))
+
+        if not order.is_market:
+            self._execute_limit_order(order, user_id)
+            return
+
+        spent = 0
+        try:
+            spent = self._execute_market_order(order, user_id)
+        finally:
+            # Рыночная заявка в стакане не остаётся - неиспользованный резерв возвращается
+            self._release(user_id, asset, required - spent)
+
+    def _check_batch(self, orders: List[OrderRecord]) -> List[Optional[HTTPException]]:
+        # Проверка пачки до исполнения первой заявки. Считается с запасом: каждая заявка
+        # резервирует всё, что может потратить, и выбирает ликвидность раньше следующих,
+        # поэтому прошедшая проверку пачка не упадёт на проверках движка посередине
+        committed: Dict[Tuple[UUID, str], int] = {}
+        consumed: Dict[Tuple[str, Direction], int] = {}
+        errors: List[Optional[HTTPException]] = []
+
+        for order in orders:
+            ticker = self.storage.tickers[order.ticker]
+            user_id = self.storage.user_ids[order.user]
+            asset = "RUB" if order.direction == Direction.BUY else ticker
+            try:
+                if ticker not in self.storage.instruments:
+                    raise HTTPException(status_code=404, detail="Instrument not found")
+
+                taken = consumed.get((ticker, order.direction), 0)
+                if order.is_market:
+                    side = self.get_book(ticker).opposite(order.direction)
+                    _, taken_cost, _ = side.cost(taken)
+                    available, cost, _ = side.cost(taken + order.qty)
+                    if available <= taken:
+                        raise HTTPException(status_code=400, detail="No liquidity for market order")
+                    # Стоимость уровней, оставшихся после заявок пачки выше, - разность двух префиксов
+                    required = cost - taken_cost if order.direction == Direction.BUY else order.qty
+                else:
+                    # Заявки пачки выше выбирают лучшие уровни первыми - FOK должен уместиться после них
+                    side = self.get_book(ticker).opposite(order.direction)
+                    if order.time_in_force == TimeInForce.FOK and not side.fills(taken + order.qty, order.price):
+                        raise HTTPException(status_code=400, detail="Fill-or-kill order cannot be filled")
+                    required = order.qty * order.price if order.direction == Direction.BUY else order.qty
+
+                balance = self._available(user_id, asset) - committed.get((user_id, asset), 0)
+                if balance < required:
                     raise HTTPException(
                         status_code=400,
-                        detail=f"Insufficient {ticker} balance: {user_balances[ticker]} < {order.body.qty}"
+                        detail=f"Insufficient {asset} balance: {balance} < {required}"
                     )
+            except HTTPException as e:
+                errors.append(e)
+                continue
 
-            if isinstance(order, MarketOrder):
-                await self._execute_market_order(order, user_id)
-            else:
-                await self._execute_limit_order(order, user_id)
+            committed[(user_id, asset)] = committed.get((user_id, asset), 0) + required
+            consumed[(ticker, order.direction)] = taken + order.qty
+            errors.append(None)
+
+        return errors
+
+    def _place_orders(self, orders: List[OrderRecord], atomic: bool) -> List[Optional[HTTPException]]:
+        # Вся пачка - одна команда движка, между её заявками ничего не вклинивается.
+        # atomic - если хоть одна заявка не проходит проверку, не исполняется ни одна
+        if atomic:
+            errors = self._check_batch(orders)
+            if any(errors):
+                return errors
+
+        errors: List[Optional[HTTPException]] = [None] * len(orders)
+        for i, order in enumerate(orders):
+            try:
+                self._place_order(order)
+            except HTTPException as e:
+                errors[i] = e
+        return errors
+
+    async def place_orders(self, orders: List[OrderRecord], atomic: bool = False) -> List[Optional[HTTPException]]:
+        return await self._execute(self._place_orders, orders, atomic)
+
+    def new_order(
+            self,
+            order_id: UUID,
+            user_id: UUID,
+            ticker: str,
+            direction: Direction,
+            price: Optional[int],
+            qty: int,
+            ts: int,
+            time_in_force: TimeInForce = TimeInForce.GTC
+    ) -> OrderRecord:
+        return OrderRecord(
+            order_id,
+            self.storage.user_handle(user_id),
+            self.storage.ticker_handle(ticker),
+            direction,
+            price,
+            qty,
+            ts,
+            time_in_force=time_in_force
+        )
+
+    def encode_order(self, order: OrderRecord) -> tuple:
+        # В журнал и снапшоты идут только стабильные идентификаторы, хэндлы живут в пределах процесса
+        return (order.id.bytes, self.storage.user_ids[order.user].bytes, order.ts, order.direction.value,
+                self.storage.tickers[order.ticker], order.qty, order.price, order.time_in_force.value)
+
+    def decode_order(self, payload: tuple) -> OrderRecord:
+        order_id, user_id, ts, direction, ticker, qty, price, time_in_force = payload
+        return self.new_order(
+            UUID(bytes=order_id), UUID(bytes=user_id), ticker, Direction(direction), price, qty, ts,
+            TimeInForce(time_in_force)
+        )
+
+    def apply(self, command: Command, payload: tuple):
+        # Повтор команды журнала - сразу, минуя очередь
+        if command == Command.SUBMIT_ORDER:
+            self._place_order(self.decode_order(payload))
+        elif command == Command.CANCEL_ORDER:
+            order = self.storage.orders.get(UUID(bytes=payload[0]))
+            if order is not None and not order.is_market:
+                self._cancel_order(order)
+        elif command == Command.REGISTER:
+            user_id, name, role, hashed_key, key_digest = payload
+            self._register_user(User(id=UUID(bytes=user_id), name=name, role=UserRole(role), api_key=hashed_key), key_digest)
+        elif command == Command.DEPOSIT:
+            self._deposit(UUID(bytes=payload[0]), payload[1], payload[2])
+        elif command == Command.WITHDRAW:
+            self._withdraw(UUID(bytes=payload[0]), payload[1], payload[2])
+        elif command == Command.ADD_INSTRUMENT:
+            self._add_instrument(Instrument(ticker=payload[0], name=payload[1]))
+        elif command == Command.REMOVE_INSTRUMENT:
+            self._remove_instrument(payload[0])
+        elif command == Command.DELETE_USER:
+            self._delete_user(UUID(bytes=payload[0]))
+
+    async def replay(self, records: Iterable[Tuple[int, Command, tuple]]) -> int:
+        # Повтор идёт с выключенным журналом, ошибки команд воспроизводятся так же, как при первом исполнении
+        # В журнал команды попадают только после проверок, так что ошибка при повторе значит,
+        # что восстановленное состояние разошлось с исходным, - молча её не глотаем
+        journal, self.journal = self.journal, None
+        count = 0
+        errors = 0
+        try:
+            for seq, command, payload in records:
+                try:
+                    self.apply(command, payload)
+                except HTTPException as e:
+                    errors += 1
+                    if errors <= 10:
+                        logger.error(f"Replayed {command.name} at seq {seq} failed: {e.detail}")
+                count += 1
+        finally:
+            self.journal = journal
+            self.replay_errors += errors
+        if errors:
+            logger.error(f"{errors} of {count} replayed journal records failed")
+        return count
 
 
 matching_engine = MatchingEngine(storage)
 
+
 """import asyncio
 from typing import Union
 from uuid import UUID
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID, uuid4
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from app.config import PERSISTENCE_RETRY_MAX_DELAY, PERSISTENCE_STOP_TIMEOUT
+from app.database import Storage
+from app.models import UserDB, InstrumentDB, OrderDB, BalanceDB, TransactionDB, OrderType
+from app.schemas import User, Instrument
+from app.services import metrics
+from app.services.events import EngineListener
+from app.services.records import OrderRecord, TradeRecord, ns_to_datetime
+
+
+logger = logging.getLogger(__name__)
+
+# Порядок записи таблиц в пачке - сначала те, на которые ссылаются внешние ключи
+TABLES = [UserDB.__table__, InstrumentDB.__table__, OrderDB.__table__, BalanceDB.__table__]
+
+
+def naive_utc(ns: int):
+    return ns_to_datetime(ns).replace(tzinfo=None)
+
+
+class PersistenceWriter(EngineListener):
+    # Пишет события движка в базу в фоне: движок только кладёт их в ограниченную очередь,
+    # а отдельная задача сливает очередь пачками. Источник истины - журнал, база - витрина
+    def __init__(
+            self,
+            url: str,
+            batch_size: int = 1000,
+            queue_size: int = 100_000,
+            retry_delay: float = 1.0,
+            max_retry_delay: float = PERSISTENCE_RETRY_MAX_DELAY,
+            stop_timeout: float = PERSISTENCE_STOP_TIMEOUT
+    ):
+        self.url = url
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.stop_timeout = stop_timeout
+        self.dropped = 0
+        self.failures = 0
+        # Пачка, которая сейчас пишется (или ждёт повтора), - из очереди она уже вынута
+        self.in_flight = 0
+        self.db: Optional[AsyncEngine] = None
+        self.storage: Optional[Storage] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _put(self, table, row: dict):
+        try:
+            self.queue.put_nowait((table, row))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 10_000 == 0:
+                logger.error(f"Persistence queue is full, dropped {self.dropped} events")
+
+    def on_user(self, user: User):
+        self._put(UserDB.__table__, self._user_row(user))
+
+    def on_instrument(self, instrument: Instrument):
+        self._put(InstrumentDB.__table__, {"ticker": instrument.ticker, "name": instrument.name})
+
+    def on_order(self, order: OrderRecord):
+        self._put(OrderDB.__table__, self._order_row(order))
+
+    def on_trade(self, trade: TradeRecord, taker: OrderRecord, maker: OrderRecord):
+        self._put(TransactionDB.__table__, {
+            "id": uuid4(),
+            "ticker": self.storage.tickers[trade.ticker],
+            "amount": trade.qty,
+            "price": trade.price,
+            "timestamp": naive_utc(trade.ts),
+            "order_id": taker.id
+        })
+
+    def on_balance(self, user_id: UUID, ticker: str, amount: int):
+        self._put(BalanceDB.__table__, {"user_id": user_id, "ticker": ticker, "amount": amount})
+
+    @staticmethod
+    def _user_row(user: User) -> dict:
+        return {"id": user.id, "name": user.name, "api_key": user.api_key, "role": user.role}
+
+    def _order_row(self, order: OrderRecord) -> dict:
+        return {
+            "id": order.id,
+            "user_id": self.storage.user_ids[order.user],
+            "ticker": self.storage.tickers[order.ticker],
+            "type": OrderType.MARKET if order.is_market else OrderType.LIMIT,
+            "direction": order.direction,
+            "price": order.price,
+            "qty": order.qty,
+            "filled": order.filled,
+            "status": order.status,
+            "created_at": naive_utc(order.ts)
+        }
+
+    async def start(self, storage: Storage):
+        self.storage = storage
+        self.db = create_async_engine(self.url)
+
+        # Состояние, восстановленное из журнала, досылается напрямую, минуя ограниченную очередь
+        rows: List[Tuple] = []
+        rows += [(UserDB.__table__, self._user_row(user)) for user in storage.users.values()]
+        rows += [(InstrumentDB.__table__, {"ticker": i.ticker, "name": i.name}) for i in storage.instruments.values()]
+        for book in storage.order_books.values():
+            rows += [(OrderDB.__table__, self._order_row(order)) for order in book.orders()]
+        for user_id, user_balances in storage.balances.items():
+            if user_id not in storage.users:
+                continue
+            rows += [
+                (BalanceDB.__table__, {"user_id": user_id, "ticker": ticker, "amount": amount})
+                for ticker, amount in user_balances.items() if ticker in storage.instruments
+            ]
+        for i in range(0, len(rows), self.batch_size):
+            await self._write(rows[i:i + self.batch_size])
+
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            # База так и не ответила - остановку движка это не держит, журнал всё равно полный
+            logger.error(
+                f"Persistence did not drain in {self.stop_timeout}s, "
+                f"abandoned {self.queue.qsize() + self.in_flight} events"
+            )
+        self._task.cancel()
+        self._task = None
+        await self.db.dispose()
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            self.in_flight = len(batch)
+            # Пачка не выбрасывается: заявки и балансы ссылаются на пользователей и инструменты,
+            # и одна потерянная пачка развела бы базу с журналом навсегда. Пока база лежит,
+            # пачка повторяется, а очередь ограничена - её переполнение считается в dropped
+            attempt = 0
+            while True:
+                try:
+                    await self._write(batch)
+                    break
+                except Exception:
+                    self.failures += 1
+                    attempt += 1
+                    logger.exception(f"Persistence batch of {len(batch)} events failed (attempt {attempt})")
+                    await asyncio.sleep(min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay))
+            self.in_flight = 0
+
+            for _ in batch:
+                self.queue.task_done()
+
+    def metrics(self) -> Iterable[str]:
+        yield from metrics.gauge(
+            "exchange_persistence_queue_depth", "Events waiting to be written to the database",
+            [({}, self.queue.qsize() + self.in_flight)]
+        )
+        yield from metrics.gauge(
+            "exchange_persistence_dropped_total", "Events dropped because the persistence queue was full",
+            [({}, self.dropped)], kind="counter"
+        )
+        yield from metrics.gauge(
+            "exchange_persistence_failures_total", "Failed database writes of an event batch, retried",
+            [({}, self.failures)], kind="counter"
+        )
+
+    def _insert(self, table):
+        if self.db.dialect.name == "postgresql":
+            return postgresql.insert(table)
+        return sqlite.insert(table)
+
+    async def _write(self, batch: List[Tuple]):
+        # Внутри пачки строки с одним ключом схлопываются - в базу уходит только последнее состояние
+        upserts: Dict = {table: {} for table in TABLES}
+        transactions = []
+        for table, row in batch:
+            if table is TransactionDB.__table__:
+                transactions.append(row)
+            else:
+                upserts[table][tuple(row[c.name] for c in table.primary_key)] = row
+
+        async with self.db.begin() as conn:
+            for table in TABLES:
+                rows = list(upserts[table].values())
+                if not rows:
+                    continue
+                stmt = self._insert(table)
+                keys = [c.name for c in table.primary_key]
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=keys,
+                    set_={name: stmt.excluded[name] for name in rows[0] if name not in keys}
+                )
+                await conn.execute(stmt, rows)
+            if transactions:
+                await conn.execute(TransactionDB.__table__.insert(), transactions)
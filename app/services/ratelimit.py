@@ -0,0 +1,194 @@
+import json
+import math
+import time
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+from uuid import UUID
+from app.config import RATE_LIMITS, RATE_LIMITS_GLOBAL, RATE_LIMIT_CLIENTS
+from app.services import metrics
+from app.services.keys import key_digest
+
+ANONYMOUS = "ANONYMOUS"
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        # 0 - токен взят, иначе сколько секунд ждать следующего
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class RateLimiter:
+    # Все операции O(1): словарь корзин с вытеснением давно не приходивших клиентов.
+    # Забытая корзина равна полной, так что вытеснение простаивающих ничего не меняет
+    def __init__(
+            self,
+            limits: Dict[str, Dict[str, Tuple[float, float]]] = RATE_LIMITS,
+            global_limits: Dict[str, Tuple[float, float]] = RATE_LIMITS_GLOBAL,
+            max_clients: int = RATE_LIMIT_CLIENTS,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self.limits = limits
+        self.global_limits = global_limits
+        self.max_clients = max_clients
+        self.clock = clock
+        now = clock()
+        self._global = {kind: TokenBucket(burst, now) for kind, (_, burst) in global_limits.items()}
+        self._buckets: OrderedDict[Tuple[str, str], TokenBucket] = OrderedDict()
+        # Отказы по виду запроса, роли и сработавшему лимиту, и по клиентам - кого именно душим
+        self.throttled: Counter = Counter()
+        self.throttled_clients: Counter = Counter()
+
+    def check(self, client: str, role: str, kind: str) -> float:
+        now = self.clock()
+        rate, burst = self.limits[kind].get(role, (0, 0))
+        bucket = None
+        if rate > 0:
+            bucket = self._buckets.get((client, kind))
+            if bucket is None:
+                bucket = TokenBucket(burst, now)
+                self._buckets[(client, kind)] = bucket
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end((client, kind))
+            retry_after = bucket.take(rate, burst, now)
+            if retry_after:
+                self._throttle(client, role, kind, "client")
+                return retry_after
+
+        global_rate, global_burst = self.global_limits[kind]
+        if global_rate > 0:
+            retry_after = self._global[kind].take(global_rate, global_burst, now)
+            if retry_after:
+                # Запрос не прошёл - его токен клиенту возвращается
+                if bucket is not None:
+                    bucket.tokens += 1
+                self._throttle(client, role, kind, "global")
+                return retry_after
+        return 0.0
+
+    def refund(self, client: str, role: str, kind: str):
+        # Вернуть токены, взятые прошедшим check: запрос всё-таки будет посчитан по другой корзине
+        rate, burst = self.limits[kind].get(role, (0, 0))
+        bucket = self._buckets.get((client, kind))
+        if rate > 0 and bucket is not None:
+            bucket.tokens = min(burst, bucket.tokens + 1)
+        global_rate, global_burst = self.global_limits[kind]
+        if global_rate > 0:
+            self._global[kind].tokens = min(global_burst, self._global[kind].tokens + 1)
+
+    def _throttle(self, client: str, role: str, kind: str, limit: str):
+        self.throttled[(kind, role, limit)] += 1
+        if client in self.throttled_clients or len(self.throttled_clients) < self.max_clients:
+            self.throttled_clients[client] += 1
+
+    def metrics(self, top: int = 10) -> Iterable[str]:
+        yield from metrics.gauge(
+            "exchange_throttled_total", "Requests rejected by rate limits",
+            (({"kind": kind, "role": role, "limit": limit}, count)
+             for (kind, role, limit), count in sorted(self.throttled.items())), kind="counter"
+        )
+        yield from metrics.gauge(
+            "exchange_throttled_client_total", "Rejected requests of the most throttled clients",
+            (({"client": client}, count) for client, count in self.throttled_clients.most_common(top)), kind="counter"
+        )
+
+
+def request_kind(method: str, path: str) -> Optional[str]:
+    if path.startswith("/api/v1/public/"):
+        return "public"
+    if method == "POST":
+        if path == "/api/v1/order" or path == "/api/v1/orders/batch":
+            return "order"
+        if path == "/api/v1/orders/batch/cancel":
+            return "cancel"
+    elif method == "DELETE" and (path == "/api/v1/order" or path.startswith("/api/v1/order/")):
+        return "cancel"
+    return None
+
+
+class RateLimitMiddleware:
+    # Проверка до чтения тела и до движка: заваливший запросами клиент получает 429
+    # прямо в воркере. Владелец ключа узнаётся у движка один раз и запоминается.
+    # Неизвестные ключи не запоминаются: поток случайных ключей вытеснил бы настоящих владельцев
+    def __init__(self, app, limiter: RateLimiter,
+                 key_owner: Callable[[bytes], Awaitable[Optional[Tuple[UUID, str]]]]):
+        self.app = app
+        self.limiter = limiter
+        self.key_owner = key_owner
+        self._owners: OrderedDict[bytes, Tuple[UUID, str]] = OrderedDict()
+
+    @staticmethod
+    def _address(scope) -> str:
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def _check(self, scope, kind: str) -> float:
+        digest = None
+        for name, value in scope["headers"]:
+            if name == b"authorization" and value.startswith(b"TOKEN "):
+                digest = key_digest(value[6:].decode("latin-1"))
+                break
+
+        owner = self._owners.get(digest) if digest is not None else None
+        if owner is not None:
+            self._owners.move_to_end(digest)
+            return self.limiter.check(str(owner[0]), owner[1], kind)
+
+        # Без известного ключа клиент - его адрес. Незнакомый ключ платит из корзины адреса
+        # до похода в движок, так что перебор ключей упирается в анонимный лимит, а не в движок
+        address = self._address(scope)
+        retry_after = self.limiter.check(address, ANONYMOUS, kind)
+        if retry_after or digest is None:
+            return retry_after
+        owner = await self.key_owner(digest)
+        if owner is None:
+            return 0.0
+
+        self._owners[digest] = owner
+        if len(self._owners) > self.limiter.max_clients:
+            self._owners.popitem(last=False)
+        # Ключ настоящий - запрос считается по корзине владельца, токен адреса возвращается
+        self.limiter.refund(address, ANONYMOUS, kind)
+        return self.limiter.check(str(owner[0]), owner[1], kind)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        kind = request_kind(scope["method"], scope["path"])
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = await self._check(scope, kind)
+        if not retry_after:
+            await self.app(scope, receive, send)
+            return
+
+        body = json.dumps({"detail": "Too many requests", "retry_after": round(retry_after, 3)}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,154 @@
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Union
+from uuid import UUID
+from app.schemas import (Direction, OrderStatus, TimeInForce, LimitOrder, LimitOrderBody, MarketOrder,
+                         MarketOrderBody, Transaction, Candle)
+
+
+# Монотонные часы, сдвинутые к эпохе: внутри процесса время не идёт назад,
+# а снаружи его можно показать как обычное UTC
+_EPOCH_OFFSET_NS = time.time_ns() - time.monotonic_ns()
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def now_ns() -> int:
+    return time.monotonic_ns() + _EPOCH_OFFSET_NS
+
+
+def ns_to_datetime(ns: int) -> datetime:
+    return datetime.fromtimestamp(ns / 1_000_000_000, tz=timezone.utc)
+
+
+def datetime_to_ns(value: datetime) -> int:
+    # Время без зоны считается UTC, как и везде в API
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - _EPOCH) // timedelta(microseconds=1) * 1000
+
+
+class OrderRecord:
+    # Внутреннее представление заявки в движке: без Pydantic, цены в целых тиках,
+    # пользователь и тикер - целочисленные хэндлы из Storage. price is None - рыночная заявка
+    __slots__ = ("id", "user", "ticker", "direction", "price", "qty", "filled", "status", "ts", "time_in_force")
+
+    def __init__(
+            self,
+            order_id: UUID,
+            user: int,
+            ticker: int,
+            direction: Direction,
+            price: Optional[int],
+            qty: int,
+            ts: int,
+            filled: int = 0,
+            status: OrderStatus = OrderStatus.NEW,
+            time_in_force: TimeInForce = TimeInForce.GTC
+    ):
+        self.id = order_id
+        self.user = user
+        self.ticker = ticker
+        self.direction = direction
+        self.price = price
+        self.qty = qty
+        self.filled = filled
+        self.status = status
+        self.ts = ts
+        self.time_in_force = time_in_force
+
+    @property
+    def is_market(self) -> bool:
+        return self.price is None
+
+    @property
+    def remaining(self) -> int:
+        return self.qty - self.filled
+
+
+class TradeRecord:
+    __slots__ = ("ticker", "price", "qty", "ts")
+
+    def __init__(self, ticker: int, price: int, qty: int, ts: int):
+        self.ticker = ticker
+        self.price = price
+        self.qty = qty
+        self.ts = ts
+
+
+class CandleRecord:
+    # start - начало интервала в нс той же шкалы, что и время сделок
+    __slots__ = ("start", "open", "high", "low", "close", "volume")
+
+    def __init__(self, start: int, open: int, high: int, low: int, close: int, volume: int):
+        self.start = start
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+
+def order_to_schema(order: OrderRecord, user_id: UUID, ticker: str) -> Union[LimitOrder, MarketOrder]:
+    if order.is_market:
+        return MarketOrder(
+            id=order.id,
+            status=order.status,
+            user_id=user_id,
+            timestamp=ns_to_datetime(order.ts),
+            body=MarketOrderBody(direction=order.direction, ticker=ticker, qty=order.qty)
+        )
+    return LimitOrder(
+        id=order.id,
+        status=order.status,
+        user_id=user_id,
+        timestamp=ns_to_datetime(order.ts),
+        body=LimitOrderBody(
+            direction=order.direction, ticker=ticker, qty=order.qty, price=order.price, time_in_force=order.time_in_force
+        ),
+        filled=order.filled
+    )
+
+
+def order_to_dict(order: OrderRecord, user_id: UUID, ticker: str) -> dict:
+    # То же, что order_to_schema(...).model_dump(), но без построения и проверки моделей
+    if order.is_market:
+        return {
+            "id": order.id,
+            "status": order.status,
+            "user_id": user_id,
+            "timestamp": ns_to_datetime(order.ts),
+            "body": {"direction": order.direction, "ticker": ticker, "qty": order.qty}
+        }
+    return {
+        "id": order.id,
+        "status": order.status,
+        "user_id": user_id,
+        "timestamp": ns_to_datetime(order.ts),
+        "body": {
+            "direction": order.direction,
+            "ticker": ticker,
+            "qty": order.qty,
+            "price": order.price,
+            "time_in_force": order.time_in_force
+        },
+        "filled": order.filled
+    }
+
+
+def trade_to_dict(trade: TradeRecord, ticker: str) -> dict:
+    return {"ticker": ticker, "amount": trade.qty, "price": trade.price, "timestamp": ns_to_datetime(trade.ts)}
+
+
+def trade_to_schema(trade: TradeRecord, ticker: str) -> Transaction:
+    return Transaction(ticker=ticker, amount=trade.qty, price=trade.price, timestamp=ns_to_datetime(trade.ts))
+
+
+def candle_to_schema(candle: CandleRecord) -> Candle:
+    return Candle(
+        timestamp=ns_to_datetime(candle.start),
+        open=candle.open,
+        high=candle.high,
+        low=candle.low,
+        close=candle.close,
+        volume=candle.volume
+    )
@@ -0,0 +1,186 @@
+import asyncio
+import gc
+import logging
+import os
+import pickle
+from typing import Optional
+from uuid import UUID
+from app.schemas import User, UserRole, Instrument, Direction, OrderStatus, CandleInterval
+from app.services.book import OrderBook
+from app.services.orderbook import MatchingEngine
+from app.services.records import OrderRecord, TradeRecord, CandleRecord
+from app.services.tape import TradeTape
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 5
+
+DIRECTIONS = {direction.value: direction for direction in Direction}
+STATUSES = {status.value: status for status in OrderStatus}
+
+
+def capture(engine: MatchingEngine, seq: int) -> tuple:
+    storage = engine.storage
+    # Админ в журнал не попадает (создаётся при старте с постоянным id), поэтому и в снапшот тоже.
+    # Его балансы - попадают: он может пополнять счёт и торговать, как все
+    users = [
+        (user.id.bytes, user.name, user.role.value, user.api_key, storage.key_digests[user.id])
+        for user in storage.users.values() if user.role != UserRole.ADMIN
+    ]
+    balances = [
+        (user_id.bytes, dict(user_balances))
+        for user_id, user_balances in storage.balances.items() if user_id in storage.users
+    ]
+    instruments = [(instrument.ticker, instrument.name) for instrument in storage.instruments.values()]
+    # Заявки идут в порядке стакана: уровень за уровнем, внутри уровня по времени
+    books = [
+        (ticker, [engine.encode_order(order) + (order.status.value, order.filled) for order in book.orders()])
+        for ticker, book in storage.order_books.items()
+    ]
+    tapes = [
+        (ticker, [(trade.price, trade.qty, trade.ts) for trade in tape])
+        for ticker, tape in storage.trade_tapes.items()
+    ]
+    candles = [
+        (ticker, [
+            (interval.value, [(c.start, c.open, c.high, c.low, c.close, c.volume) for c in series.bars])
+            for interval, series in ticker_candles.items()
+        ])
+        for ticker, ticker_candles in storage.candles.items()
+    ]
+    return SNAPSHOT_FORMAT, seq, users, instruments, balances, books, tapes, candles
+
+
+def dump(data: tuple, path: str):
+    with open(path, "wb") as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_snapshot(engine: MatchingEngine, seq: int, path: str):
+    dump(capture(engine, seq), path)
+
+
+def load_snapshot(engine: MatchingEngine, path: str) -> int:
+    # Загрузка создаёт миллионы долгоживущих объектов, сборщик мусора на это время только мешает
+    gc.disable()
+    try:
+        return _load_snapshot(engine, path)
+    finally:
+        gc.enable()
+
+
+def _load_snapshot(engine: MatchingEngine, path: str) -> int:
+    with open(path, "rb") as f:
+        data = pickle.load(f)
+    if data[0] != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {data[0]}")
+    _, seq, users, instruments, balances, books, tapes, candles = data
+
+    storage = engine.storage
+    for user_id, name, role, hashed_key, key_digest in users:
+        user = User(id=UUID(bytes=user_id), name=name, role=UserRole(role), api_key=hashed_key)
+        storage.users[user.id] = user
+        storage.api_keys[key_digest] = user.id
+        storage.key_digests[user.id] = key_digest
+        storage.user_handle(user.id)
+    for ticker, name in instruments:
+        storage.instruments[ticker] = Instrument(ticker=ticker, name=name)
+    storage.instruments_version += 1
+    for user_id, user_balances in balances:
+        storage.balances[UUID(bytes=user_id)] = user_balances
+
+    for ticker, orders in books:
+        book = OrderBook(ticker)
+        storage.order_books[ticker] = book
+        ticker_handle = storage.ticker_handle(ticker)
+        # В стакане стоят только GTC-заявки, срок действия из кортежа не нужен
+        for order_id, user_id, ts, direction, _, qty, price, _, status, filled in orders:
+            order = OrderRecord(
+                UUID(bytes=order_id),
+                storage.user_handle(UUID(bytes=user_id)),
+                ticker_handle,
+                DIRECTIONS[direction],
+                price,
+                qty,
+                ts,
+                filled,
+                STATUSES[status]
+            )
+            storage.orders[order.id] = order
+            book.add(order)
+            engine._index_open_order(order)
+            engine.reserve_resting(order)
+
+    for ticker, trades in tapes:
+        ticker_handle = storage.ticker_handle(ticker)
+        storage.trade_tapes[ticker] = TradeTape(
+            ticker, (TradeRecord(ticker_handle, price, qty, ts) for price, qty, ts in trades)
+        )
+
+    for ticker, series_list in candles:
+        ticker_candles = storage.get_candles(ticker)
+        for interval, bars in series_list:
+            ticker_candles[CandleInterval(interval)].bars.extend(CandleRecord(*bar) for bar in bars)
+
+    return seq
+
+
+class Snapshotter:
+    def __init__(self, engine: MatchingEngine, path: str, interval: float):
+        self.engine = engine
+        self.path = path
+        self.interval = interval
+        self.last_seq = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.take()
+            except Exception:
+                logger.exception("Snapshot failed")
+
+    async def take(self) -> bool:
+        journal = self.engine.journal
+        # После отказа журнала состояние в памяти опережает диск - снимать его нельзя
+        if journal is None or journal.failed is not None or journal.seq == self.last_seq:
+            return False
+
+        # Снимок делается синхронно между командами, так что состояние точно соответствует seq
+        seq = journal.seq
+        tmp_path = f"{self.path}.tmp"
+        if hasattr(os, "fork"):
+            # Дочерний процесс пишет свою copy-on-write копию памяти, матчинг стоит только на время fork
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    write_snapshot(self.engine, seq, tmp_path)
+                    code = 0
+                finally:
+                    os._exit(code)
+            _, status = await asyncio.to_thread(os.waitpid, pid, 0)
+            if os.waitstatus_to_exitcode(status) != 0:
+                raise RuntimeError(f"Snapshot process exited with status {status}")
+        else:
+            data = capture(self.engine, seq)
+            await asyncio.to_thread(dump, data, tmp_path)
+
+        # Снапшот не должен опережать журнал на диске, иначе после падения в журнале будет дыра
+        await journal.sync()
+        os.replace(tmp_path, self.path)
+        self.last_seq = seq
+        logger.info(f"Snapshot at seq {seq} written to {self.path}")
+        return True
@@ -0,0 +1,91 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+from fastapi import WebSocket, WebSocketDisconnect
+from app.services.events import EngineListener
+
+
+class Subscription:
+    # Одно соединение: своя ограниченная очередь готовых к отправке сообщений
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.resync = False
+        self.closed = asyncio.Event()
+
+
+class StreamFeed(EngineListener):
+    # Общая часть потоковых рассылок: движок синхронно кладёт закодированные сообщения
+    # в очереди соединений, отправкой занимается задача соединения. Отставший клиент
+    # получает свежее состояние вместо очереди, не успевший и его - отключается
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.resyncs = 0
+        self.disconnects = 0
+
+    def disconnect(self, subscription: Subscription):
+        pass
+
+    def _resync(self, subscription: Subscription) -> List[str]:
+        return []
+
+    def _message(self, subscription: Subscription, item) -> Optional[str]:
+        return item
+
+    def _deliver(self, subscription: Subscription, item):
+        try:
+            subscription.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._overflow(subscription)
+
+    def _overflow(self, subscription: Subscription):
+        if subscription.resync:
+            # Не успел разобрать очередь даже после сброса - клиент не читает, отключаем
+            self.disconnects += 1
+            self.disconnect(subscription)
+            subscription.closed.set()
+            return
+
+        # Отстал: старые сообщения выбрасываются, вместо них клиент получит свежее состояние
+        self.resyncs += 1
+        subscription.resync = True
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    async def pump(self, subscription: Subscription, send: Callable[[str], Awaitable]):
+        while True:
+            item = await subscription.queue.get()
+            if item is None:
+                subscription.resync = False
+                for message in self._resync(subscription):
+                    await send(message)
+                continue
+
+            message = self._message(subscription, item)
+            if message is not None:
+                await send(message)
+
+
+async def serve(websocket: WebSocket, stream, receive: Awaitable):
+    # stream - подписка на рассылку (LocalStream или RemoteStream из процесса движка).
+    # Соединение живёт, пока клиент не отключился, не упала отправка и рассылка его не выкинула
+    tasks = [
+        asyncio.ensure_future(receive),
+        asyncio.create_task(stream.pump(websocket.send_text)),
+        asyncio.create_task(stream.closed.wait())
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await stream.close()
+
+    # Обрыв соединения - штатное завершение, его исключение просто забираем
+    for task in done:
+        error = task.exception()
+        if error is not None and not isinstance(error, WebSocketDisconnect):
+            raise error
+
+    if stream.closed.is_set():
+        # Клиент не успевает читать даже после пересинхронизации
+        await websocket.close(code=1013)
@@ -0,0 +1,29 @@
+from collections import deque
+from itertools import islice
+from typing import Dict, Iterable, Tuple
+from app.config import TRADE_TAPE_SIZE
+from app.services.encoding import dumps
+from app.services.records import TradeRecord, trade_to_dict
+
+
+class TradeTape(deque):
+    # Последние сделки тикера в порядке исполнения. version растёт с каждой сделкой,
+    # по нему кэшируются закодированные выборки ленты
+    def __init__(self, ticker: str, trades: Iterable[TradeRecord] = (), maxlen: int = TRADE_TAPE_SIZE):
+        super().__init__(trades, maxlen)
+        self.ticker = ticker
+        self.version = 0
+        self._encoded: Dict[int, Tuple[int, bytes]] = {}
+
+    def append(self, trade: TradeRecord):
+        super().append(trade)
+        self.version += 1
+
+    def recent_json(self, limit: int) -> bytes:
+        cached = self._encoded.get(limit)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+
+        encoded = dumps([trade_to_dict(trade, self.ticker) for trade in islice(reversed(self), limit)])
+        self._encoded[limit] = (self.version, encoded)
+        return encoded
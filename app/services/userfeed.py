@@ -0,0 +1,83 @@
+import json
+from typing import Dict, List, Set
+from uuid import UUID
+from app.config import USERFEED_QUEUE_SIZE
+from app.database import storage, Storage
+from app.services.records import OrderRecord, TradeRecord, ns_to_datetime
+from app.services.streams import StreamFeed, Subscription
+
+
+class UserSubscription(Subscription):
+    def __init__(self, queue_size: int, user_id: UUID):
+        super().__init__(queue_size)
+        self.user_id = user_id
+
+
+class UserFeed(StreamFeed):
+    # Личный поток пользователя: переходы статусов его заявок, исполнения и изменения балансов.
+    # Пока у пользователя нет открытых соединений, обработчики сразу выходят
+    def __init__(self, storage: Storage, queue_size: int = 1000):
+        super().__init__(queue_size)
+        self.storage = storage
+        self.subscribers: Dict[UUID, Set[UserSubscription]] = {}
+
+    def connect(self, user_id: UUID) -> UserSubscription:
+        subscription = UserSubscription(self.queue_size, user_id)
+        self.subscribers.setdefault(user_id, set()).add(subscription)
+        self._deliver(subscription, self._snapshot(user_id))
+        return subscription
+
+    def disconnect(self, subscription: UserSubscription):
+        subscribers = self.subscribers.get(subscription.user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self.subscribers[subscription.user_id]
+
+    def _snapshot(self, user_id: UUID) -> str:
+        handle = self.storage.user_handles.get(user_id)
+        orders = self.storage.open_orders.get(handle, {}).values()
+        return json.dumps({
+            "type": "snapshot",
+            "orders": [self.storage.order_schema(order).model_dump(mode="json") for order in orders],
+            "balances": self.storage.balances.get(user_id, {})
+        })
+
+    def _resync(self, subscription: UserSubscription) -> List[str]:
+        return [self._snapshot(subscription.user_id)]
+
+    def _publish(self, user_id: UUID, message: dict):
+        encoded = json.dumps(message)
+        for subscription in list(self.subscribers[user_id]):
+            self._deliver(subscription, encoded)
+
+    def on_order(self, order: OrderRecord):
+        user_id = self.storage.user_ids[order.user]
+        if user_id not in self.subscribers:
+            return
+        self._publish(user_id, {"type": "order", "order": self.storage.order_schema(order).model_dump(mode="json")})
+
+    def on_trade(self, trade: TradeRecord, taker: OrderRecord, maker: OrderRecord):
+        for order in (taker, maker):
+            user_id = self.storage.user_ids[order.user]
+            if user_id not in self.subscribers:
+                continue
+            self._publish(user_id, {
+                "type": "fill",
+                "order_id": str(order.id),
+                "ticker": self.storage.tickers[trade.ticker],
+                "direction": order.direction.value,
+                "price": trade.price,
+                "qty": trade.qty,
+                "filled": order.filled,
+                "timestamp": ns_to_datetime(trade.ts).isoformat()
+            })
+
+    def on_balance(self, user_id: UUID, ticker: str, amount: int):
+        if user_id not in self.subscribers:
+            return
+        self._publish(user_id, {"type": "balance", "ticker": ticker, "amount": amount})
+
+
+user_feed = UserFeed(storage, USERFEED_QUEUE_SIZE)
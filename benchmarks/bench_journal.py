@@ -0,0 +1,95 @@
+# Пропускная способность журнала (group commit) и скорость восстановления повтором.
+# Запуск: python -m benchmarks.bench_journal [events] [clients]
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from uuid import uuid4
+from app.database import Storage
+from app.schemas import Direction
+from app.services.journal import Journal, Command, encode_record
+from app.services.keys import hash_key, key_digest
+from app.services.orderbook import MatchingEngine
+from app.services.records import now_ns
+
+
+async def bench_append(path: str, events: int, clients: int):
+    journal = Journal(path)
+    list(journal.read())
+    journal.open()
+    payload = (uuid4().bytes, uuid4().bytes, 0, "BUY", "MEMCOIN", 1, 100)
+
+    async def client(count: int):
+        for _ in range(count):
+            await journal.append(Command.SUBMIT_ORDER, payload)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(events // clients) for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    await journal.close()
+    print(f"append: {journal.seq} records from {clients} clients, {journal.seq / elapsed:,.0f} records/sec")
+
+
+def write_synthetic_journal(path: str, events: int, seed: int = 1):
+    rnd = random.Random(seed)
+    users = [uuid4() for _ in range(1000)]
+    # Движок нужен только для кодирования заявок в формат журнала
+    engine = MatchingEngine(Storage())
+    seq = 0
+    with open(path, "wb") as f:
+        seq += 1
+        f.write(encode_record(seq, Command.ADD_INSTRUMENT, ("MEMCOIN", "Memcoin")))
+        for user_id in users:
+            seq += 1
+            # Ключ хэшируется с минимальной стоимостью bcrypt: замеряется повтор, а не регистрация
+            api_key = f"key-{user_id}"
+            payload = (user_id.bytes, f"user{seq}", "USER", hash_key(api_key, rounds=4), key_digest(api_key))
+            f.write(encode_record(seq, Command.REGISTER, payload))
+            seq += 1
+            f.write(encode_record(seq, Command.DEPOSIT, (user_id.bytes, "RUB", 10 ** 12)))
+            seq += 1
+            f.write(encode_record(seq, Command.DEPOSIT, (user_id.bytes, "MEMCOIN", 10 ** 9)))
+
+        chunk = []
+        while seq < events:
+            seq += 1
+            order = engine.new_order(
+                uuid4(),
+                rnd.choice(users),
+                "MEMCOIN",
+                Direction.BUY if rnd.random() < 0.5 else Direction.SELL,
+                rnd.randint(95, 105),
+                rnd.randint(1, 10),
+                now_ns()
+            )
+            chunk.append(encode_record(seq, Command.SUBMIT_ORDER, engine.encode_order(order)))
+            if len(chunk) >= 10_000:
+                f.write(b"".join(chunk))
+                chunk.clear()
+        f.write(b"".join(chunk))
+
+
+async def bench_replay(path: str):
+    engine = MatchingEngine(Storage())
+    started = time.perf_counter()
+    replayed = await engine.replay(Journal(path).read())
+    elapsed = time.perf_counter() - started
+    size_mb = os.path.getsize(path) / 2 ** 20
+    print(f"replay: {replayed:,} records ({size_mb:,.0f} MB) in {elapsed:.1f}s, {replayed / elapsed:,.0f} records/sec")
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(bench_append(os.path.join(directory, "append.bin"), min(events, 1_000_000), clients))
+
+        path = os.path.join(directory, "replay.bin")
+        write_synthetic_journal(path, events)
+        asyncio.run(bench_replay(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Память на одну стоящую заявку и стоимость одного исполнения при глубоком стакане.
+# Запуск: python -m benchmarks.bench_records [resting_orders]
+import asyncio
+import gc
+import sys
+import time
+import tracemalloc
+from uuid import uuid4
+from app.database import Storage
+from app.schemas import Direction, Instrument
+from app.services.orderbook import MatchingEngine
+from app.services.records import now_ns
+
+
+async def bench(resting: int):
+    engine = MatchingEngine(Storage())
+    engine.storage.instruments["MEMCOIN"] = Instrument(name="Memcoin", ticker="MEMCOIN")
+    users = [uuid4() for _ in range(100)]
+    for user_id in users:
+        engine.storage.balances[user_id] = {"RUB": 10 ** 12, "MEMCOIN": 10 ** 12}
+
+    # Учитывается всё, что живёт, пока заявка стоит в стакане: сама заявка, её место в уровне и индексах
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(resting):
+        order = engine.new_order(uuid4(), users[i % 100], "MEMCOIN", Direction.SELL, 1000 + i % 500, 1, now_ns())
+        await engine.place_order(order)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"memory: {(after - before) / resting:,.0f} bytes per resting order")
+
+    # Одна рыночная заявка выметает весь стакан - по исполнению на каждую стоящую заявку
+    sweep = engine.new_order(uuid4(), users[0], "MEMCOIN", Direction.BUY, None, resting, now_ns())
+    started = time.perf_counter()
+    await engine.place_order(sweep)
+    elapsed = time.perf_counter() - started
+    print(f"sweep: {resting:,} fills in {elapsed:.2f}s, {elapsed / resting * 10 ** 6:.1f} us per fill")
+
+
+def main():
+    resting = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    asyncio.run(bench(resting))
+
+
+if __name__ == "__main__":
+    main()
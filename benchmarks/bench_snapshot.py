@@ -0,0 +1,93 @@
+# Запись и восстановление снапшота со стаканом из N стоящих заявок.
+# Запуск: python -m benchmarks.bench_snapshot [resting_orders]
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from uuid import uuid4
+from app.database import Storage
+from app.schemas import Direction, Instrument, User, UserRole
+from app.services.journal import Journal
+from app.services.keys import key_digest
+from app.services.orderbook import MatchingEngine
+from app.services.records import now_ns
+from app.services.snapshot import Snapshotter, load_snapshot
+
+
+def build_engine(resting: int, seed: int = 1) -> MatchingEngine:
+    rnd = random.Random(seed)
+    engine = MatchingEngine(Storage())
+    storage = engine.storage
+    storage.instruments["MEMCOIN"] = Instrument(name="Memcoin", ticker="MEMCOIN")
+    users = [uuid4() for _ in range(10_000)]
+    for user_id in users:
+        storage.users[user_id] = User(id=user_id, name="user", role=UserRole.USER, api_key=f"key-{user_id}")
+        storage.key_digests[user_id] = key_digest(f"key-{user_id}")
+        storage.balances[user_id] = {"RUB": 10 ** 9, "MEMCOIN": 10 ** 6}
+
+    book = engine.get_book("MEMCOIN")
+    now = now_ns()
+    for _ in range(resting):
+        # Биды ниже 1000, аски выше - стакан не пересекается
+        is_buy = rnd.random() < 0.5
+        order = engine.new_order(
+            uuid4(),
+            rnd.choice(users),
+            "MEMCOIN",
+            Direction.BUY if is_buy else Direction.SELL,
+            rnd.randint(500, 999) if is_buy else rnd.randint(1001, 1500),
+            rnd.randint(1, 100),
+            now
+        )
+        storage.orders[order.id] = order
+        book.add(order)
+        engine._index_open_order(order)
+    return engine
+
+
+async def bench(resting: int, directory: str):
+    engine = build_engine(resting)
+    journal = Journal(os.path.join(directory, "journal.bin"))
+    journal.open()
+    engine.journal = journal
+    journal.seq = 1
+
+    snapshot_path = os.path.join(directory, "snapshot.bin")
+    snapshotter = Snapshotter(engine, snapshot_path, interval=60)
+
+    # Насколько долго держится event loop, пока снапшот пишется в фоне
+    stalls = []
+
+    async def probe():
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - started)
+
+    probe_task = asyncio.create_task(probe())
+    started = time.perf_counter()
+    await snapshotter.take()
+    elapsed = time.perf_counter() - started
+    probe_task.cancel()
+    await journal.close()
+
+    size_mb = os.path.getsize(snapshot_path) / 2 ** 20
+    print(f"snapshot: {resting:,} resting orders, {size_mb:,.0f} MB in {elapsed:.1f}s, "
+          f"max event loop stall {max(stalls) * 1000:.0f} ms")
+
+    restored = MatchingEngine(Storage())
+    started = time.perf_counter()
+    load_snapshot(restored, snapshot_path)
+    print(f"restore: {len(restored.storage.order_books['MEMCOIN']):,} resting orders in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    resting = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(bench(resting, directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Суммарная пропускная способность матчинга при 1, 4 и 16 активных тикерах.
+# Запуск: python -m benchmarks.bench_tickers [orders_per_ticker]
+import asyncio
+import random
+import sys
+import time
+from uuid import uuid4
+from app.database import Storage
+from app.schemas import Direction, Instrument
+from app.services.orderbook import MatchingEngine
+from app.services.records import now_ns
+
+
+def make_tickers(count: int):
+    return [f"T{chr(65 + i // 26)}{chr(65 + i % 26)}" for i in range(count)]
+
+
+async def ticker_flow(engine: MatchingEngine, ticker: str, users, orders: int, seed: int):
+    rnd = random.Random(seed)
+    for _ in range(orders):
+        user_id = rnd.choice(users)
+        direction = Direction.BUY if rnd.random() < 0.5 else Direction.SELL
+        order = engine.new_order(uuid4(), user_id, ticker, direction, rnd.randint(95, 105), rnd.randint(1, 10), now_ns())
+        engine.storage.orders[order.id] = order
+        await engine.process_order(order)
+
+
+async def run(ticker_count: int, orders_per_ticker: int) -> float:
+    storage = Storage()
+    engine = MatchingEngine(storage)
+    tickers = make_tickers(ticker_count)
+    users = [uuid4() for _ in range(100)]
+    for ticker in tickers:
+        storage.instruments[ticker] = Instrument(name=ticker, ticker=ticker)
+    for user_id in users:
+        storage.balances[user_id] = {"RUB": 10 ** 12, **{ticker: 10 ** 9 for ticker in tickers}}
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        ticker_flow(engine, ticker, users, orders_per_ticker, seed)
+        for seed, ticker in enumerate(tickers)
+    ))
+    elapsed = time.perf_counter() - started
+    return ticker_count * orders_per_ticker / elapsed
+
+
+def main():
+    orders_per_ticker = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for ticker_count in (1, 4, 16):
+        rate = asyncio.run(run(ticker_count, orders_per_ticker))
+        print(f"{ticker_count:>2} tickers: {rate:>10.0f} orders/sec")
+
+
+if __name__ == "__main__":
+    main()
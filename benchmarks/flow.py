@@ -0,0 +1,70 @@
+# Детерминированный генератор синтетического потока заявок для бенчмарков движка.
+# Поток - список Op, заявки из него создаются на конкретном движке перед замером
+import random
+from collections import namedtuple
+from typing import List, Optional
+from uuid import UUID
+from app.schemas import Direction
+
+SUBMIT = "submit"
+CANCEL = "cancel"
+
+# price is None - рыночная заявка; target - индекс отменяемой заявки в этом же потоке
+Op = namedtuple("Op", "kind user ticker direction price qty target")
+
+
+class OrderFlow:
+    def __init__(self, seed: int, tickers: List[str], users: List[UUID], mid: int = 10_000):
+        self.rnd = random.Random(seed)
+        self.tickers = tickers
+        self.users = users
+        self.mid = mid
+        self.ops: List[Op] = []
+        # Индексы выставленных лимитных заявок - кандидаты на отмену
+        self._limits: List[int] = []
+
+    def _side(self) -> Direction:
+        return Direction.BUY if self.rnd.random() < 0.5 else Direction.SELL
+
+    def _submit(self, direction: Direction, price: Optional[int], qty: int):
+        if price is not None:
+            self._limits.append(len(self.ops))
+        self.ops.append(Op(SUBMIT, self.rnd.choice(self.users), self.rnd.choice(self.tickers), direction, price, qty, None))
+
+    def passive(self, depth: int = 50):
+        # Не пересекает спред: биды ниже середины, аски выше
+        direction = self._side()
+        offset = self.rnd.randint(1, depth)
+        price = self.mid - offset if direction == Direction.BUY else self.mid + offset
+        self._submit(direction, price, self.rnd.randint(1, 20))
+
+    def crossing(self, reach: int = 5):
+        # Лимитная заявка, заходящая на reach тиков за середину - исполняется сразу, остаток встаёт
+        direction = self._side()
+        offset = self.rnd.randint(1, reach)
+        price = self.mid + offset if direction == Direction.BUY else self.mid - offset
+        self._submit(direction, price, self.rnd.randint(1, 40))
+
+    def sweep(self, qty: int = 200):
+        self._submit(self._side(), None, self.rnd.randint(qty // 4, qty))
+
+    def cancel(self):
+        if not self._limits:
+            return self.passive()
+        # Отменяется случайная из ранее выставленных; если она уже исполнена, отмена пропускается
+        target = self._limits.pop(self.rnd.randrange(len(self._limits)))
+        self.ops.append(Op(CANCEL, None, None, None, None, None, target))
+
+    def mix(self, count: int, crossing: float = 0.0, sweep: float = 0.0, cancel: float = 0.0, depth: int = 50):
+        # Доли видов операций; всё, что не попало в перечисленные, - пассивные заявки
+        for _ in range(count):
+            roll = self.rnd.random()
+            if roll < crossing:
+                self.crossing()
+            elif roll < crossing + sweep:
+                self.sweep()
+            elif roll < crossing + sweep + cancel:
+                self.cancel()
+            else:
+                self.passive(depth)
+        return self
@@ -0,0 +1,199 @@
+# Набор сценариев нагрузки на движок без HTTP: пропускная способность, задержки одной операции
+# и память на стоящую заявку. Результаты пишутся в JSON, чтобы сравнивать между коммитами.
+# Запуск: python -m benchmarks.suite [--scale 1.0] [--seed 1] [--only passive,sweeps] [--output file.json]
+#         python -m benchmarks.suite --compare old.json new.json
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import List, Optional
+from uuid import UUID
+from fastapi import HTTPException
+from app.database import Storage
+from app.schemas import Instrument, OrderStatus
+from app.services.orderbook import MatchingEngine
+from app.services.records import now_ns
+from benchmarks.flow import CANCEL, Op, OrderFlow
+
+BASE_OPS = 50_000
+
+# prefill - сколько операций выполняется до замера (в долях BASE_OPS), mix - состав потока
+SCENARIOS = {
+    "passive": dict(tickers=1, users=100, prefill=0, mix=dict()),
+    "sweeps": dict(tickers=1, users=100, prefill=1, mix=dict(sweep=0.1)),
+    "deep_book": dict(tickers=1, users=1000, prefill=4, mix=dict(crossing=0.2, sweep=0.02, cancel=0.1, depth=1000)),
+    "cancel_heavy": dict(tickers=1, users=100, prefill=0.5, mix=dict(crossing=0.05, cancel=0.6)),
+    "many_tickers": dict(tickers=64, users=1000, prefill=1, mix=dict(crossing=0.2, sweep=0.02, cancel=0.1)),
+    "many_users": dict(tickers=1, users=100_000, prefill=1, mix=dict(crossing=0.2, sweep=0.02, cancel=0.1)),
+}
+
+# Движок, как и API, отменяет только ещё не тронутые заявки
+OPEN = (OrderStatus.NEW,)
+
+
+def make_engine(tickers: List[str], users) -> MatchingEngine:
+    engine = MatchingEngine(Storage())
+    storage = engine.storage
+    for ticker in tickers:
+        storage.instruments[ticker] = Instrument(name=ticker, ticker=ticker)
+    balances = {"RUB": 10 ** 15, **{ticker: 10 ** 12 for ticker in tickers}}
+    for user_id in users:
+        storage.balances[user_id] = dict(balances)
+    return engine
+
+
+def materialize(engine: MatchingEngine, ops: List[Op]) -> list:
+    # Заявки создаются до замера: в измерение попадает только работа движка
+    records = []
+    for i, op in enumerate(ops):
+        if op.kind == CANCEL:
+            records.append(records[op.target])
+        else:
+            records.append(engine.new_order(UUID(int=i + 1), op.user, op.ticker, op.direction, op.price, op.qty, now_ns()))
+    return records
+
+
+async def apply(engine: MatchingEngine, op: Op, order) -> bool:
+    if op.kind == CANCEL:
+        if order.status not in OPEN:
+            return False
+        await engine.cancel_order(order)
+        return True
+    try:
+        await engine.place_order(order)
+    except HTTPException:
+        pass
+    return True
+
+
+async def execute(engine: MatchingEngine, ops: List[Op], records: list, latencies: Optional[list] = None):
+    clock = time.perf_counter_ns
+    for op, order in zip(ops, records):
+        started = clock()
+        if await apply(engine, op, order) and latencies is not None:
+            latencies.append(clock() - started)
+
+
+def percentile(values: List[int], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))] / 1000
+
+
+def build_flow(spec: dict, seed: int, scale: float):
+    tickers = [f"T{chr(65 + i // 26)}{chr(65 + i % 26)}" for i in range(spec["tickers"])]
+    users = [UUID(int=i + 1) for i in range(spec["users"])]
+    flow = OrderFlow(seed, tickers, users)
+    prefill = int(spec["prefill"] * BASE_OPS * scale)
+    depth = spec["mix"].get("depth", 50)
+    flow.mix(prefill, depth=depth).mix(int(BASE_OPS * scale), **spec["mix"])
+    return tickers, users, flow.ops, prefill
+
+
+async def run_scenario(spec: dict, seed: int, scale: float) -> dict:
+    tickers, users, ops, prefill = build_flow(spec, seed, scale)
+
+    engine = make_engine(tickers, users)
+    records = materialize(engine, ops)
+    await execute(engine, ops[:prefill], records[:prefill])
+    gc.collect()
+
+    latencies: List[int] = []
+    started = time.perf_counter()
+    await execute(engine, ops[prefill:], records[prefill:], latencies)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    await engine.close()
+
+    # Память считается отдельным прогоном того же потока: tracemalloc сильно замедляет замер скорости
+    engine = make_engine(tickers, users)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = materialize(engine, ops)
+    await execute(engine, ops, records)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    await engine.close()
+    resting = sum(len(book) for book in engine.storage.order_books.values())
+
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / elapsed),
+        "p50_us": percentile(latencies, 0.5),
+        "p99_us": percentile(latencies, 0.99),
+        "p999_us": percentile(latencies, 0.999),
+        "resting_orders": resting,
+        "bytes_per_resting_order": round((after - before) / resting) if resting else None,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for name, result in new["scenarios"].items():
+        base = old["scenarios"].get(name)
+        if base is None:
+            continue
+        changes = []
+        for key in ("ops_per_sec", "p50_us", "p99_us", "p999_us", "bytes_per_resting_order"):
+            if base.get(key) and result.get(key) is not None:
+                changes.append(f"{key} {result[key] / base[key] - 1:+.1%}")
+        print(f"{name:>14}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--only", default="")
+    parser.add_argument("--output", default="")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    names = [name for name in args.only.split(",") if name] or list(SCENARIOS)
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "scale": args.scale,
+        "scenarios": {},
+    }
+    for name in names:
+        result = asyncio.run(run_scenario(SCENARIOS[name], args.seed, args.scale))
+        results["scenarios"][name] = result
+        print(f"{name:>14}: {result['ops_per_sec']:>8,} ops/sec  p50 {result['p50_us']:>7.1f} us  "
+              f"p99 {result['p99_us']:>7.1f} us  p999 {result['p999_us']:>8.1f} us  "
+              f"{result['resting_orders']:>8,} resting, {result['bytes_per_resting_order']} B/order")
+
+    output = args.output or os.path.join("benchmarks", "results", f"{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
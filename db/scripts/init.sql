@@ -3,6 +3,7 @@ CREATE EXTENSION IF NOT EXISTS "pgcrypto";
 CREATE TYPE user_role AS ENUM ('USER', 'ADMIN');
 CREATE TYPE order_type AS ENUM ('LIMIT', 'MARKET');
 CREATE TYPE order_status AS ENUM ('NEW', 'EXECUTED', 'PARTIALLY_EXECUTED', 'CANCELLED');
+CREATE TYPE order_direction AS ENUM ('BUY', 'SELL');
 
 CREATE TABLE users (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -21,8 +22,10 @@ CREATE TABLE orders (
     user_id UUID REFERENCES users(id),
     ticker VARCHAR(10) REFERENCES instruments(ticker) NOT NULL,
     type order_type NOT NULL,
+    direction order_direction NOT NULL,
     price DECIMAL(20, 2),
     qty INTEGER NOT NULL CHECK (qty > 0),
+    filled INTEGER NOT NULL DEFAULT 0,
     status order_status DEFAULT 'NEW',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -0,0 +1,4 @@
+import os
+
+# bcrypt с боевой стоимостью замедлил бы каждую регистрацию в тестах
+os.environ.setdefault("API_KEY_HASH_ROUNDS", "4")
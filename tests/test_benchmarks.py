@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Бенчмарки собирают журналы и снапшоты сами, в обход API, - при смене формата записи
+# они ломаются первыми. Прогон каждой точки входа на крошечном объёме это ловит
+@pytest.mark.parametrize("args", [
+    ["benchmarks.bench_journal", "3000", "4"],
+    ["benchmarks.bench_records", "500"],
+    ["benchmarks.bench_snapshot", "500"],
+    ["benchmarks.bench_tickers", "50"],
+    ["benchmarks.suite", "--scale", "0.002", "--output", "{tmp}/suite.json"],
+])
+def test_benchmark_entry_point_runs(args, tmp_path):
+    args = [arg.format(tmp=tmp_path) for arg in args]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, "-m", *args], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
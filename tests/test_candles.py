@@ -0,0 +1,36 @@
+from app.schemas import CandleInterval, Direction
+from app.services.candles import CandleSeries, INTERVAL_NS
+from tests.test_matching import make_engine, make_user, limit, market, submit
+
+SECOND = INTERVAL_NS[CandleInterval.SECOND]
+
+
+def bars(series):
+    return [(c.start // SECOND, c.open, c.high, c.low, c.close, c.volume) for c in series.bars]
+
+
+def test_series_aggregates_and_is_bounded():
+    series = CandleSeries(CandleInterval.SECOND, retention=3)
+    for second, price, qty in [(10, 100, 1), (10, 105, 2), (10, 98, 1), (11, 99, 5), (13, 101, 1), (14, 102, 1)]:
+        series.update(price, qty, second * SECOND + 123)
+
+    assert bars(series) == [(11, 99, 99, 99, 99, 5), (13, 101, 101, 101, 101, 1), (14, 102, 102, 102, 102, 1)]
+    # Опоздавшая сделка попадает в свой интервал и не трогает закрытие
+    series.update(90, 2, 13 * SECOND)
+    assert bars(series)[1] == (13, 101, 101, 90, 101, 3)
+
+    assert [c.start // SECOND for c in series.range(12 * SECOND, 20 * SECOND, 10)] == [13, 14]
+    assert [c.start // SECOND for c in series.range(11 * SECOND + 500, 20 * SECOND, 2)] == [13, 14]
+    assert series.range(15 * SECOND, 20 * SECOND, 10) == []
+
+
+def test_engine_updates_candles_on_each_trade():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=100)
+    buyer = make_user(engine, rub=10_000)
+    submit(engine, limit(engine, seller, Direction.SELL, 2, 100))
+    submit(engine, limit(engine, seller, Direction.SELL, 3, 103))
+    submit(engine, market(engine, buyer, Direction.BUY, 4))
+
+    for series in engine.storage.candles["MEMCOIN"].values():
+        assert [(c.open, c.high, c.low, c.close, c.volume) for c in series.bars] == [(100, 103, 100, 103, 4)]
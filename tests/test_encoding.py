@@ -0,0 +1,84 @@
+import asyncio
+import json
+from fastapi.encoders import jsonable_encoder
+from app.schemas import Direction, LimitOrderBody, MarketOrderBody, NewUser
+from app.services.encoding import conditional_response
+from app.services.exchange import Exchange
+from app.services.marketdata import MarketDataFeed
+from app.services.userfeed import UserFeed
+from tests.test_matching import make_engine
+
+
+def make_exchange():
+    engine = make_engine()
+    return Exchange(engine.storage, engine, MarketDataFeed(engine.storage), UserFeed(engine.storage))
+
+
+def test_encoded_responses_match_the_models():
+    async def scenario():
+        exchange = make_exchange()
+        seller = await exchange.register(NewUser(name="seller"))
+        buyer = await exchange.register(NewUser(name="buyer"))
+        await exchange.deposit(seller.id, "MEMCOIN", 10)
+        await exchange.deposit(buyer.id, "RUB", 10_000)
+        await exchange.create_order(seller.id, LimitOrderBody(direction=Direction.SELL, ticker="MEMCOIN", qty=5, price=100))
+        await exchange.create_order(buyer.id, MarketOrderBody(direction=Direction.BUY, ticker="MEMCOIN", qty=2))
+        await exchange.create_order(buyer.id, LimitOrderBody(direction=Direction.BUY, ticker="MEMCOIN", qty=1, price=90))
+
+        pairs = [
+            (await exchange.list_instruments(), (await exchange.instruments_json())[1]),
+            (await exchange.get_orderbook("MEMCOIN", 10), (await exchange.orderbook_json("MEMCOIN", 10))[1]),
+            (await exchange.get_transactions("MEMCOIN", 10), (await exchange.transactions_json("MEMCOIN", 10))[1]),
+            (await exchange.list_orders(seller.id), await exchange.orders_json(seller.id)),
+            (await exchange.list_orders(buyer.id), await exchange.orders_json(buyer.id)),
+        ]
+        for model, encoded in pairs:
+            assert json.loads(encoded) == jsonable_encoder(model)
+        await exchange.engine.close()
+
+    asyncio.run(scenario())
+
+
+def test_public_bytes_are_reused_until_the_version_changes():
+    async def scenario():
+        exchange = make_exchange()
+        seller = await exchange.register(NewUser(name="seller"))
+        await exchange.deposit(seller.id, "MEMCOIN", 10)
+
+        _, book = await exchange.orderbook_json("MEMCOIN", 10)
+        _, instruments = await exchange.instruments_json()
+        assert (await exchange.orderbook_json("MEMCOIN", 10))[1] is book
+        assert (await exchange.instruments_json())[1] is instruments
+
+        await exchange.create_order(seller.id, LimitOrderBody(direction=Direction.SELL, ticker="MEMCOIN", qty=5, price=100))
+        _, book = await exchange.orderbook_json("MEMCOIN", 10)
+        assert json.loads(book)["ask_levels"] == [{"price": 100, "qty": 5}]
+        await exchange.remove_instrument("MEMCOIN")
+        assert (await exchange.instruments_json())[1] == b'[{"name":"Russian Ruble","ticker":"RUB"}]'
+        await exchange.engine.close()
+
+    asyncio.run(scenario())
+
+
+def test_matching_etag_skips_the_body():
+    async def scenario():
+        exchange = make_exchange()
+        seller = await exchange.register(NewUser(name="seller"))
+        await exchange.deposit(seller.id, "MEMCOIN", 10)
+
+        etag, body = await exchange.orderbook_json("MEMCOIN", 10)
+        assert body is not None
+        assert await exchange.orderbook_json("MEMCOIN", 10, f'"other", W/{etag}') == (etag, None)
+        tape_etag, _ = await exchange.transactions_json("MEMCOIN", 10)
+
+        await exchange.create_order(seller.id, LimitOrderBody(direction=Direction.SELL, ticker="MEMCOIN", qty=5, price=100))
+        changed, body = await exchange.orderbook_json("MEMCOIN", 10, etag)
+        assert changed != etag and body is not None
+        # Без сделок лента не изменилась
+        assert await exchange.transactions_json("MEMCOIN", 10, tape_etag) == (tape_etag, None)
+
+        response = conditional_response(*await exchange.orderbook_json("MEMCOIN", 10, changed))
+        assert response.status_code == 304 and response.headers["etag"] == changed and not response.body
+        await exchange.engine.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import pytest
+from fastapi import HTTPException
+from app.schemas import Direction, Instrument, LimitOrderBody, MarketOrderBody, NewUser
+from app.services.exchange import Exchange
+from app.services.ipc import EngineClient, EngineConnection, EngineServer
+from app.services.marketdata import MarketDataFeed
+from app.services.userfeed import UserFeed
+from tests.test_matching import make_engine
+
+
+async def start(tmp_path):
+    engine = make_engine()
+    market_data = MarketDataFeed(engine.storage)
+    user_feed = UserFeed(engine.storage)
+    engine.listeners.extend([market_data, user_feed])
+    exchange = Exchange(engine.storage, engine, market_data, user_feed)
+    server = EngineServer(exchange, str(tmp_path / "engine.sock"))
+    await server.start()
+    client = EngineClient(server.path)
+    await client.connect(timeout=1)
+    return engine, server, client
+
+
+def test_calls_and_errors_cross_the_socket(tmp_path):
+    async def scenario():
+        engine, server, client = await start(tmp_path)
+        admin_key = engine.storage.admin_api_key
+        seller = await client.register(NewUser(name="seller"))
+        buyer = await client.register(NewUser(name="buyer"))
+        assert await client.authenticate(seller.api_key) == seller.id
+        assert await client.authenticate(admin_key, True) in engine.storage.users
+
+        await client.deposit(seller.id, "MEMCOIN", 10)
+        await client.deposit(buyer.id, "RUB", 1_000)
+        placed = await client.create_order(seller.id, LimitOrderBody(direction=Direction.SELL, ticker="MEMCOIN", qty=5, price=100))
+        # Запросы одного воркера идут конкурентно по одному соединению
+        await asyncio.gather(
+            client.create_order(buyer.id, MarketOrderBody(direction=Direction.BUY, ticker="MEMCOIN", qty=2)),
+            client.list_orders(seller.id),
+            client.get_balances(seller.id)
+        )
+        book = await client.get_orderbook("MEMCOIN", 10)
+        assert [(level.price, level.qty) for level in book.ask_levels] == [(100, 3)]
+        assert (await client.get_order(seller.id, placed.order_id)).filled == 2
+        assert (await client.get_balances(buyer.id)) == {"RUB": 800, "MEMCOIN": 2}
+
+        with pytest.raises(HTTPException) as error:
+            await client.get_orderbook("NOPE", 10)
+        assert error.value.status_code == 404 and error.value.detail == "Instrument not found"
+        with pytest.raises(HTTPException) as error:
+            await client.authenticate(seller.api_key, True)
+        assert error.value.status_code == 403
+
+        await client.close()
+        await server.stop()
+        with pytest.raises(HTTPException) as error:
+            await client.list_instruments()
+        assert error.value.status_code == 503
+
+    asyncio.run(scenario())
+
+
+def test_market_data_stream_is_forwarded(tmp_path):
+    async def scenario():
+        engine, server, client = await start(tmp_path)
+        await client.add_instrument(Instrument(name="Dodge", ticker="DODGE"))
+        seller = await client.register(NewUser(name="seller"))
+        await client.deposit(seller.id, "DODGE", 10)
+
+        stream = await client.market_stream()
+        assert await stream.subscribe("NOPE") == "Instrument not found"
+        assert await stream.subscribe("DODGE") is None
+        await client.create_order(seller.id, LimitOrderBody(direction=Direction.SELL, ticker="DODGE", qty=3, price=50))
+
+        snapshot = json.loads(await asyncio.wait_for(stream.queue.get(), 1))
+        level = json.loads(await asyncio.wait_for(stream.queue.get(), 1))
+        assert snapshot["type"] == "snapshot" and snapshot["ask_levels"] == []
+        assert (level["type"], level["price"], level["qty"], level["seq"]) == ("level", 50, 3, 1)
+
+        await stream.close()
+        await asyncio.sleep(0.05)
+        assert not engine.listeners[0].subscribers
+
+        await client.close()
+        await server.stop()
+
+    asyncio.run(scenario())
+
+
+class ClosedWriter:
+    # Воркер уже отключился: запись ещё принимается, drain падает
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        raise ConnectionResetError("Connection lost")
+
+
+def test_reply_to_a_disconnected_worker_is_dropped():
+    async def scenario():
+        engine = make_engine()
+        exchange = Exchange(engine.storage, engine, MarketDataFeed(engine.storage), UserFeed(engine.storage))
+        connection = EngineConnection(exchange, None, ClosedWriter())
+        # Ни ответ на вызов, ни сообщение потока не роняют задачу соединения
+        await connection._call(1, "list_instruments", (), {})
+        await connection._push(2, "message")
+        await engine.close()
+
+    asyncio.run(scenario())
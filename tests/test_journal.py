@@ -0,0 +1,197 @@
+import asyncio
+from uuid import uuid4
+import pytest
+from fastapi import HTTPException
+from app.database import Storage
+from app.schemas import Direction, Instrument, User, UserRole
+from app.services.journal import Journal, Command, encode_record
+from app.services.keys import key_digest
+from app.services.orderbook import MatchingEngine
+from app.services.records import now_ns
+
+
+def order(engine, user_id, direction, qty, price=None):
+    return engine.new_order(uuid4(), user_id, "MEMCOIN", direction, price, qty, now_ns())
+
+
+def state(storage):
+    books = {
+        ticker: [(o.id, storage.user_ids[o.user], o.price, o.qty, o.filled, o.status, o.ts) for o in book.orders()]
+        for ticker, book in storage.order_books.items()
+    }
+    tapes = {ticker: [(t.price, t.qty, t.ts) for t in tape] for ticker, tape in storage.trade_tapes.items()}
+    candles = {
+        ticker: {interval: [(c.start, c.open, c.high, c.low, c.close, c.volume) for c in series.bars]
+                 for interval, series in ticker_candles.items()}
+        for ticker, ticker_candles in storage.candles.items()
+    }
+    users = {user_id: user for user_id, user in storage.users.items() if user.role == UserRole.USER}
+    # Нулевые резервы после исполнения заявок не отличаются от отсутствующих
+    reserved = {user_id: {asset: amount for asset, amount in assets.items() if amount}
+                for user_id, assets in storage.reserved.items()}
+    reserved = {user_id: assets for user_id, assets in reserved.items() if assets}
+    return users, storage.instruments, storage.balances, reserved, books, tapes, candles
+
+
+async def run_session(path):
+    engine = MatchingEngine(Storage())
+    journal = Journal(path)
+    await engine.replay(journal.read())
+    journal.open()
+    engine.journal = journal
+
+    alice = User(id=uuid4(), name="alice", role=UserRole.USER, api_key=f"key-{uuid4()}")
+    bob = User(id=uuid4(), name="bobby", role=UserRole.USER, api_key=f"key-{uuid4()}")
+    await engine.register_user(alice, key_digest(alice.api_key))
+    await engine.register_user(bob, key_digest(bob.api_key))
+    await engine.add_instrument(Instrument(name="Memcoin", ticker="MEMCOIN"))
+    await engine.deposit(alice.id, "RUB", 10_000)
+    await engine.deposit(bob.id, "MEMCOIN", 50)
+    await engine.withdraw(alice.id, "RUB", 100)
+
+    resting = order(engine, bob.id, Direction.SELL, 10, 100)
+    await asyncio.gather(
+        engine.place_order(resting),
+        engine.place_order(order(engine, bob.id, Direction.SELL, 5, 105)),
+        engine.place_order(order(engine, alice.id, Direction.BUY, 3, 99)),
+    )
+    await engine.place_order(order(engine, alice.id, Direction.BUY, 12))
+    with pytest.raises(HTTPException):
+        await engine.place_order(order(engine, alice.id, Direction.BUY, 1_000, 100))
+    cancelled = order(engine, alice.id, Direction.BUY, 1, 90)
+    await engine.place_order(cancelled)
+    await engine.cancel_order(cancelled)
+
+    await journal.close()
+    return engine
+
+
+def test_replay_rebuilds_storage(tmp_path):
+    path = str(tmp_path / "journal.bin")
+    engine = asyncio.run(run_session(path))
+
+    restored = MatchingEngine(Storage())
+    replayed = asyncio.run(restored.replay(Journal(path).read()))
+
+    assert replayed == 12
+    assert state(restored.storage) == state(engine.storage)
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    path = str(tmp_path / "journal.bin")
+    asyncio.run(run_session(path))
+    with open(path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00garbage")
+
+    journal = Journal(path)
+    records = list(journal.read())
+    assert len(records) == 12
+    assert journal.seq == 12
+
+
+def test_admin_trades_survive_restart(tmp_path):
+    path = str(tmp_path / "journal.bin")
+
+    async def session():
+        engine = MatchingEngine(Storage())
+        journal = Journal(path)
+        journal.open()
+        engine.journal = journal
+        admin_id = next(iter(engine.storage.users))
+        seller = User(id=uuid4(), name="seller", role=UserRole.USER, api_key=f"key-{uuid4()}")
+        await engine.register_user(seller, key_digest(seller.api_key))
+        await engine.add_instrument(Instrument(name="Memcoin", ticker="MEMCOIN"))
+        await engine.deposit(seller.id, "MEMCOIN", 10)
+        await engine.deposit(admin_id, "RUB", 1_000)
+        await engine.place_order(order(engine, seller.id, Direction.SELL, 5, 100))
+        await engine.place_order(order(engine, admin_id, Direction.BUY, 3))
+        await journal.close()
+        return engine
+
+    engine = asyncio.run(session())
+    # Новый процесс - новый Storage, но админ тот же, и его команды из журнала повторяются
+    restored = MatchingEngine(Storage())
+    asyncio.run(restored.replay(Journal(path).read()))
+
+    assert restored.replay_errors == 0
+    assert state(restored.storage) == state(engine.storage)
+
+
+def test_replay_counts_failed_commands(tmp_path):
+    path = str(tmp_path / "journal.bin")
+
+    async def session():
+        journal = Journal(path)
+        journal.open()
+        # Пользователя нет - такая запись могла появиться только из разошедшегося состояния
+        await journal.append(Command.DEPOSIT, (uuid4().bytes, "RUB", 100))
+        await journal.close()
+
+    asyncio.run(session())
+    restored = MatchingEngine(Storage())
+    assert asyncio.run(restored.replay(Journal(path).read())) == 1
+    assert restored.replay_errors == 1
+
+
+def test_open_without_full_read_keeps_records(tmp_path):
+    path = str(tmp_path / "journal.bin")
+    asyncio.run(run_session(path))
+    with open(path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00garbage")
+
+    async def reopen():
+        journal = Journal(path)
+        # Повтор оборвался на первой записи - open() всё равно должен найти настоящий конец
+        next(journal.read())
+        journal.open()
+        await journal.append(Command.DEPOSIT, (uuid4().bytes, "RUB", 100))
+        await journal.close()
+        return journal
+
+    assert asyncio.run(reopen()).seq == 13
+    records = list(Journal(path).read())
+    assert [seq for seq, _, _ in records] == list(range(1, 14))
+
+
+def test_failed_write_stops_the_engine(tmp_path):
+    path = str(tmp_path / "journal.bin")
+
+    async def session():
+        engine = MatchingEngine(Storage())
+        journal = Journal(path)
+        journal.open()
+        engine.journal = journal
+        alice = User(id=uuid4(), name="alice", role=UserRole.USER, api_key=f"key-{uuid4()}")
+        await engine.register_user(alice, key_digest(alice.api_key))
+
+        def broken(data):
+            raise OSError("No space left on device")
+
+        journal._write = broken
+        with pytest.raises(HTTPException) as error:
+            await engine.deposit(alice.id, "RUB", 100)
+        assert error.value.status_code == 503
+        # Дальше ничего не принимается, даже когда диск снова пишет
+        del journal._write
+        with pytest.raises(HTTPException) as error:
+            await engine.deposit(alice.id, "RUB", 200)
+        assert error.value.status_code == 503
+        await journal.close()
+        await engine.close()
+        return alice
+
+    alice = asyncio.run(session())
+    restored = MatchingEngine(Storage())
+    assert asyncio.run(restored.replay(Journal(path).read())) == 1
+    assert restored.storage.balances[alice.id]["RUB"] == 0
+
+
+def test_read_stops_at_a_seq_gap(tmp_path):
+    path = str(tmp_path / "journal.bin")
+    with open(path, "wb") as f:
+        for seq in (1, 2, 4):
+            f.write(encode_record(seq, Command.ADD_INSTRUMENT, (f"T{seq}", "Ticker")))
+
+    journal = Journal(path)
+    assert [seq for seq, _, _ in journal.read()] == [1, 2]
+    assert journal.seq == 2
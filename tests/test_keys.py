@@ -0,0 +1,79 @@
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from app.schemas import NewUser
+from app.services import exchange as exchange_module
+from app.services.journal import Journal
+from app.services.keys import VerifiedKeys, key_digest
+from app.services.snapshot import capture
+from tests.test_encoding import make_exchange
+
+
+def test_keys_are_stored_only_as_hashes(tmp_path):
+    async def scenario():
+        exchange = make_exchange()
+        journal = Journal(str(tmp_path / "journal.bin"))
+        journal.open()
+        exchange.engine.journal = journal
+
+        user = await exchange.register(NewUser(name="alice"))
+        assert await exchange.authenticate(user.api_key) == user.id
+
+        stored = exchange.storage.users[user.id]
+        assert stored.api_key.startswith("$2b$") and stored.api_key != user.api_key
+        assert user.api_key not in exchange.storage.api_keys
+        assert user.api_key not in repr(capture(exchange.engine, journal.seq))
+
+        await journal.close()
+        assert user.api_key.encode() not in (tmp_path / "journal.bin").read_bytes()
+        await exchange.engine.close()
+
+    asyncio.run(scenario())
+
+
+def test_verified_keys_skip_bcrypt_until_the_user_is_deleted(monkeypatch):
+    checks = []
+
+    def check_key(api_key, hashed):
+        checks.append(api_key)
+        return True
+
+    monkeypatch.setattr(exchange_module, "check_key", check_key)
+
+    async def scenario():
+        exchange = make_exchange()
+        user = await exchange.register(NewUser(name="alice"))
+
+        # Одновременные запросы с непроверенным ключом ждут одну проверку
+        await asyncio.gather(*(exchange.authenticate(user.api_key) for _ in range(5)))
+        await exchange.authenticate(user.api_key)
+        assert checks == [user.api_key]
+
+        with pytest.raises(HTTPException) as error:
+            await exchange.authenticate("key-unknown")
+        assert error.value.status_code == 401 and len(checks) == 1
+
+        hashed = exchange.storage.users[user.id].api_key
+        deleted = await exchange.delete_user(user.id)
+        # Ответ админского DELETE не раскрывает хэш ключа
+        assert deleted.id == user.id and deleted.api_key == "" and hashed not in deleted.model_dump_json()
+        assert key_digest(user.api_key) not in exchange.verified_keys
+        with pytest.raises(HTTPException) as error:
+            await exchange.authenticate(user.api_key)
+        assert error.value.status_code == 401
+        await exchange.engine.close()
+
+    asyncio.run(scenario())
+
+
+def test_verified_keys_are_bounded_and_expire():
+    keys = VerifiedKeys(size=2, ttl=60)
+    for digest in (b"a", b"b", b"c"):
+        keys.add(digest)
+    assert b"a" not in keys and b"b" in keys and b"c" in keys
+
+    expiring = VerifiedKeys(size=10, ttl=0.01)
+    expiring.add(b"a")
+    time.sleep(0.02)
+    assert b"a" not in expiring and len(expiring) == 0
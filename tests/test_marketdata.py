@@ -0,0 +1,70 @@
+import asyncio
+import json
+from app.schemas import Direction
+from app.services.marketdata import MarketDataFeed
+from tests.test_matching import make_engine, make_user, limit, market, submit
+
+
+def drain(subscription):
+    messages = []
+    while not subscription.queue.empty():
+        item = subscription.queue.get_nowait()
+        messages.append(item if item is None else json.loads(item[2]))
+    return messages
+
+
+def test_snapshot_then_sequenced_deltas_and_trades():
+    engine = make_engine()
+    feed = MarketDataFeed(engine.storage)
+    engine.listeners.append(feed)
+    seller = make_user(engine, memcoin=100)
+    buyer = make_user(engine, rub=10_000)
+    submit(engine, limit(engine, seller, Direction.SELL, 5, 101))
+
+    subscription = feed.connect()
+    feed.subscribe(subscription, "MEMCOIN")
+    submit(engine, limit(engine, seller, Direction.SELL, 2, 102))
+    submit(engine, market(engine, buyer, Direction.BUY, 3))
+
+    snapshot, *updates = drain(subscription)
+    assert snapshot["type"] == "snapshot" and snapshot["seq"] == 0
+    assert snapshot["ask_levels"] == [{"price": 101, "qty": 5}]
+    assert [m["seq"] for m in updates] == [1, 2, 3]
+    assert [(m["type"], m["price"]) for m in updates] == [("level", 102), ("trade", 101), ("level", 101)]
+    assert updates[2]["qty"] == 2 and updates[1]["amount"] == 3
+
+
+def test_slow_consumer_is_resynced_then_disconnected():
+    engine = make_engine()
+    feed = MarketDataFeed(engine.storage, queue_size=3)
+    engine.listeners.append(feed)
+    buyer = make_user(engine, rub=10_000)
+    subscription = feed.connect()
+    feed.subscribe(subscription, "MEMCOIN")
+
+    def place(*prices):
+        for price in prices:
+            submit(engine, limit(engine, buyer, Direction.BUY, 1, price))
+
+    sent = []
+
+    async def send(message):
+        sent.append(json.loads(message))
+
+    async def pump_once():
+        task = asyncio.create_task(feed.pump(subscription, send))
+        await asyncio.sleep(0)
+        task.cancel()
+
+    # Снапшот и две дельты заполняют очередь, третья дельта вызывает пересинхронизацию
+    place(1, 2, 3)
+    assert feed.resyncs == 1 and subscription.queue.qsize() == 1
+    asyncio.run(pump_once())
+    assert [m["type"] for m in sent] == ["snapshot"] and sent[0]["seq"] == 3 and len(sent[0]["bid_levels"]) == 3
+
+    # Клиент снова не читает: сначала ещё одна пересинхронизация, потом отключение
+    place(4, 5, 6, 7)
+    assert feed.resyncs == 2 and not subscription.closed.is_set()
+    place(8, 9, 10)
+    assert subscription.closed.is_set() and feed.disconnects == 1
+    assert "MEMCOIN" not in feed.subscribers
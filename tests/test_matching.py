@@ -0,0 +1,408 @@
+import asyncio
+from uuid import uuid4
+import pytest
+from fastapi import HTTPException
+from app.database import Storage
+from app.schemas import Direction, OrderStatus, TimeInForce, Instrument, User, UserRole
+from app.services.metrics import ENGINE_BATCH
+from app.services.orderbook import MatchingEngine
+from app.services.records import now_ns
+
+
+def make_engine():
+    storage = Storage()
+    storage.instruments["MEMCOIN"] = Instrument(name="Memcoin", ticker="MEMCOIN")
+    return MatchingEngine(storage)
+
+
+def make_user(engine, rub=0, memcoin=0):
+    user_id = uuid4()
+    engine.storage.balances[user_id] = {"RUB": rub, "MEMCOIN": memcoin}
+    return user_id
+
+
+def limit(engine, user_id, direction, qty, price, ticker="MEMCOIN", time_in_force=TimeInForce.GTC):
+    return engine.new_order(uuid4(), user_id, ticker, direction, price, qty, now_ns(), time_in_force)
+
+
+def market(engine, user_id, direction, qty):
+    return engine.new_order(uuid4(), user_id, "MEMCOIN", direction, None, qty, now_ns())
+
+
+def submit(engine, order):
+    engine.storage.orders[order.id] = order
+    asyncio.run(engine.process_order(order))
+    return order
+
+
+def test_price_time_priority():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=100)
+    buyer = make_user(engine, rub=10_000)
+
+    first = submit(engine, limit(engine, seller, Direction.SELL, 5, 101))
+    second = submit(engine, limit(engine, seller, Direction.SELL, 5, 101))
+    best = submit(engine, limit(engine, seller, Direction.SELL, 5, 100))
+
+    book = engine.storage.order_books["MEMCOIN"]
+    assert book.asks.best().price == 100
+
+    taker = submit(engine, limit(engine, buyer, Direction.BUY, 8, 101))
+
+    assert taker.status == OrderStatus.EXECUTED
+    assert best.status == OrderStatus.EXECUTED
+    assert first.status == OrderStatus.PARTIALLY_EXECUTED and first.filled == 3
+    assert second.status == OrderStatus.NEW and second.filled == 0
+    assert [(level.price, level.qty) for level in book.asks.levels()] == [(101, 7)]
+    assert engine.storage.balances[buyer] == {"RUB": 10_000 - 5 * 100 - 3 * 101, "MEMCOIN": 8}
+
+
+def test_limit_remainder_rests_and_market_sweeps():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=10)
+    buyer = make_user(engine, rub=10_000)
+
+    resting = submit(engine, limit(engine, buyer, Direction.BUY, 4, 50))
+    submit(engine, limit(engine, buyer, Direction.BUY, 4, 49))
+    sweep = submit(engine, market(engine, seller, Direction.SELL, 6))
+
+    book = engine.storage.order_books["MEMCOIN"]
+    assert sweep.status == OrderStatus.EXECUTED
+    assert resting.status == OrderStatus.EXECUTED
+    assert resting.id not in book
+    assert [(level.price, level.qty) for level in book.bids.levels()] == [(49, 2)]
+    assert engine.storage.balances[seller]["RUB"] == 4 * 50 + 2 * 49
+
+
+def test_cancel_removes_order_from_level():
+    engine = make_engine()
+    buyer = make_user(engine, rub=10_000)
+
+    keep = submit(engine, limit(engine, buyer, Direction.BUY, 1, 10))
+    cancelled = submit(engine, limit(engine, buyer, Direction.BUY, 2, 10))
+    asyncio.run(engine.cancel_order(cancelled))
+
+    book = engine.storage.order_books["MEMCOIN"]
+    assert cancelled.status == OrderStatus.CANCELLED
+    assert len(book) == 1 and keep.id in book
+    assert book.bids.best().qty == 1
+
+    asyncio.run(engine.cancel_order(keep))
+    assert book.bids.best() is None
+
+
+def test_market_order_without_liquidity_is_rejected():
+    engine = make_engine()
+    buyer = make_user(engine, rub=1_000)
+
+    with pytest.raises(HTTPException):
+        submit(engine, market(engine, buyer, Direction.BUY, 1))
+
+
+def test_full_command_queue_rejects_with_503():
+    engine = make_engine()
+    engine.queue_size = 1
+    buyer = make_user(engine, rub=1_000)
+    orders = [limit(engine, buyer, Direction.BUY, 1, 10) for _ in range(2)]
+
+    async def scenario():
+        # Обе команды попадают в очередь раньше, чем потребитель успевает её разобрать
+        return await asyncio.gather(*(engine.place_order(order) for order in orders), return_exceptions=True)
+
+    first, second = asyncio.run(scenario())
+    assert first is None
+    assert isinstance(second, HTTPException) and second.status_code == 503
+    assert engine.rejected == 1
+    assert orders[0].id in engine.storage.orders and orders[1].id not in engine.storage.orders
+
+
+def test_concurrent_commands_are_processed_in_one_batch():
+    engine = make_engine()
+    engine.storage.instruments["DODGE"] = Instrument(name="Dodge", ticker="DODGE")
+    buyer = make_user(engine, rub=1_000)
+    orders = [limit(engine, buyer, Direction.BUY, 1, 10, ticker=ticker) for ticker in ["MEMCOIN", "DODGE"] * 4]
+
+    async def scenario():
+        await asyncio.gather(*(engine.place_order(order) for order in orders))
+
+    before = list(ENGINE_BATCH.default.counts)
+    asyncio.run(scenario())
+    after = ENGINE_BATCH.default.counts
+    # Восемь команд - одна пачка, корзина le=10
+    assert [b - a for a, b in zip(before, after)] == [0, 0, 0, 0, 1] + [0] * (len(after) - 5)
+    assert all(order.id in engine.storage.open_orders[order.user] for order in orders)
+
+
+def test_l2_snapshot_is_cached_until_book_changes():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=100)
+    buyer = make_user(engine, rub=10_000)
+
+    submit(engine, limit(engine, seller, Direction.SELL, 5, 101))
+    submit(engine, limit(engine, seller, Direction.SELL, 2, 101))
+    submit(engine, limit(engine, buyer, Direction.BUY, 3, 99))
+
+    book = engine.storage.order_books["MEMCOIN"]
+    snapshot = book.l2_snapshot(10)
+    assert [(level.price, level.qty) for level in snapshot.ask_levels] == [(101, 7)]
+    assert [(level.price, level.qty) for level in snapshot.bid_levels] == [(99, 3)]
+    assert book.l2_snapshot(10) is snapshot
+
+    submit(engine, limit(engine, buyer, Direction.BUY, 4, 101))
+    updated = book.l2_snapshot(10)
+    assert updated is not snapshot
+    assert [(level.price, level.qty) for level in updated.ask_levels] == [(101, 3)]
+
+
+def test_trade_tape_keeps_execution_order_and_is_bounded():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=10_000)
+    buyer = make_user(engine, rub=10 ** 9)
+    tape = engine.storage.get_trade_tape("MEMCOIN")
+
+    for price in range(1, tape.maxlen + 6):
+        submit(engine, limit(engine, seller, Direction.SELL, 1, price))
+        submit(engine, market(engine, buyer, Direction.BUY, 1))
+
+    assert len(tape) == tape.maxlen
+    assert [t.price for t in tape][-3:] == [tape.maxlen + 3, tape.maxlen + 4, tape.maxlen + 5]
+    assert tape[0].price == 6
+
+
+def test_resting_orders_reserve_funds_until_cancel():
+    engine = make_engine()
+    buyer = make_user(engine, rub=1_000)
+    resting = submit(engine, limit(engine, buyer, Direction.BUY, 5, 100))
+    assert engine.storage.reserved[buyer]["RUB"] == 500
+
+    # Те же рубли второй раз под заявку не идут и не выводятся
+    with pytest.raises(HTTPException) as error:
+        submit(engine, limit(engine, buyer, Direction.BUY, 6, 100))
+    assert error.value.detail == "Insufficient RUB balance: 500 < 600"
+    engine.storage.users[buyer] = User(id=buyer, name="buyer", role=UserRole.USER, api_key="key-buyer")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(engine.withdraw(buyer, "RUB", 600))
+    assert error.value.detail == "Insufficient balance"
+
+    asyncio.run(engine.cancel_order(resting))
+    assert engine.storage.reserved[buyer]["RUB"] == 0
+    asyncio.run(engine.withdraw(buyer, "RUB", 600))
+    assert engine.storage.balances[buyer]["RUB"] == 400
+
+
+def test_market_sweep_is_rejected_up_front_when_funds_do_not_cover_it():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=10)
+    poor = make_user(engine, rub=250)
+    rich = make_user(engine, rub=450)
+    submit(engine, limit(engine, seller, Direction.SELL, 1, 100))
+    submit(engine, limit(engine, seller, Direction.SELL, 1, 200))
+
+    # Две единицы стоят 100 + 200, на это денег нет - ни одной сделки
+    with pytest.raises(HTTPException):
+        submit(engine, market(engine, poor, Direction.BUY, 2))
+    assert len(engine.storage.order_books["MEMCOIN"]) == 2
+
+    submit(engine, market(engine, rich, Direction.BUY, 2))
+    assert engine.storage.balances[rich] == {"RUB": 150, "MEMCOIN": 2}
+    assert engine.storage.reserved[rich]["RUB"] == 0
+    assert engine.storage.reserved[seller]["MEMCOIN"] == 0
+
+
+def test_cumulative_depth_prices_quantity_and_budget():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=100)
+    buyer = make_user(engine, rub=10_000)
+    for qty, price in [(3, 100), (2, 110), (5, 120)]:
+        submit(engine, limit(engine, seller, Direction.SELL, qty, price))
+    asks = engine.storage.order_books["MEMCOIN"].asks
+
+    assert asks.cost(4) == (4, 3 * 100 + 110, 110)
+    assert asks.cost(50) == (10, 3 * 100 + 2 * 110 + 5 * 120, 120)
+    assert asks.qty_for(99) == (0, 0, None)
+    assert asks.qty_for(500) == (4, 410, 110)
+    assert asks.qty_for(10_000) == (10, 1_120, 120)
+
+    # Сделка меняет сторону - префиксы строятся заново
+    submit(engine, market(engine, buyer, Direction.BUY, 4))
+    assert asks.cost(2) == (2, 110 + 120, 120)
+    assert engine.storage.reserved[buyer]["RUB"] == 0
+
+
+def test_market_buy_reserves_the_exact_sweep_cost():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=10)
+    buyer = make_user(engine, rub=300)
+    submit(engine, limit(engine, seller, Direction.SELL, 1, 100))
+    submit(engine, limit(engine, seller, Direction.SELL, 1, 200))
+
+    # Денег ровно на 100 + 200, а не на 2 * 200
+    order = submit(engine, market(engine, buyer, Direction.BUY, 2))
+    assert order.status == OrderStatus.EXECUTED
+    assert engine.storage.balances[buyer] == {"RUB": 0, "MEMCOIN": 2}
+
+
+def test_price_improvement_releases_the_rest_of_the_reserve():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=10)
+    buyer = make_user(engine, rub=1_000)
+    submit(engine, limit(engine, seller, Direction.SELL, 2, 100))
+
+    submit(engine, limit(engine, buyer, Direction.BUY, 3, 120))
+    # Две исполнились по 100, остаток в 1 встал в стакан по 120 и держит резерв 120
+    assert engine.storage.balances[buyer] == {"RUB": 800, "MEMCOIN": 2}
+    assert engine.storage.reserved[buyer]["RUB"] == 120
+
+
+def test_ioc_remainder_is_dropped_with_its_reserve():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=10)
+    buyer = make_user(engine, rub=10_000)
+    submit(engine, limit(engine, seller, Direction.SELL, 5, 100))
+    submit(engine, limit(engine, seller, Direction.SELL, 5, 102))
+
+    partial = submit(engine, limit(engine, buyer, Direction.BUY, 8, 101, time_in_force=TimeInForce.IOC))
+    assert partial.status == OrderStatus.PARTIALLY_EXECUTED and partial.filled == 5
+    book = engine.storage.order_books["MEMCOIN"]
+    assert not book.bids and buyer not in engine.storage.open_orders
+    assert engine.storage.balances[buyer] == {"RUB": 10_000 - 5 * 100, "MEMCOIN": 5}
+    assert engine.storage.reserved[buyer]["RUB"] == 0
+
+    missed = submit(engine, limit(engine, buyer, Direction.BUY, 3, 101, time_in_force=TimeInForce.IOC))
+    assert missed.status == OrderStatus.CANCELLED and missed.filled == 0
+    assert not book.bids and engine.storage.reserved[buyer]["RUB"] == 0
+
+
+def test_fok_is_rejected_without_touching_the_book():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=10)
+    buyer = make_user(engine, rub=10_000)
+    submit(engine, limit(engine, seller, Direction.SELL, 5, 100))
+    submit(engine, limit(engine, seller, Direction.SELL, 5, 102))
+    book = engine.storage.order_books["MEMCOIN"]
+    version = book.asks.version
+
+    # 8 не набирается по цене не хуже 101 - отказ до резерва, журнала и исполнения
+    rejected = limit(engine, buyer, Direction.BUY, 8, 101, time_in_force=TimeInForce.FOK)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(engine.place_order(rejected))
+    assert error.value.status_code == 400 and error.value.detail == "Fill-or-kill order cannot be filled"
+    assert rejected.id not in engine.storage.orders
+    assert book.asks.version == version and buyer not in engine.storage.reserved
+
+    filled = limit(engine, buyer, Direction.BUY, 8, 102, time_in_force=TimeInForce.FOK)
+    asyncio.run(engine.place_order(filled))
+    assert filled.status == OrderStatus.EXECUTED
+    assert engine.storage.balances[buyer] == {"RUB": 10_000 - 5 * 100 - 3 * 102, "MEMCOIN": 8}
+    assert engine.storage.reserved[buyer]["RUB"] == 0
+
+    # В пачке FOK считается после ликвидности, выбранной заявками выше
+    errors = asyncio.run(engine.place_orders([
+        limit(engine, buyer, Direction.BUY, 1, 102),
+        limit(engine, buyer, Direction.BUY, 2, 102, time_in_force=TimeInForce.FOK)
+    ], atomic=True))
+    assert errors[0] is None and errors[1].detail == "Fill-or-kill order cannot be filled"
+    assert [(level.price, level.qty) for level in book.asks.levels()] == [(102, 2)]
+
+
+def test_open_order_index_follows_fills_and_cancels():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=100)
+    buyer = make_user(engine, rub=10_000)
+
+    filled = submit(engine, limit(engine, seller, Direction.SELL, 2, 100))
+    partial = submit(engine, limit(engine, seller, Direction.SELL, 5, 101))
+    cancelled = submit(engine, limit(engine, seller, Direction.SELL, 1, 102))
+    seller_handle = engine.storage.user_handle(seller)
+    assert list(engine.storage.open_orders[seller_handle]) == [filled.id, partial.id, cancelled.id]
+
+    submit(engine, limit(engine, buyer, Direction.BUY, 3, 101))
+    asyncio.run(engine.cancel_order(cancelled))
+    assert list(engine.storage.open_orders[seller_handle]) == [partial.id]
+    assert engine.storage.user_handle(buyer) not in engine.storage.open_orders
+
+    engine._cancel_user_orders(seller)
+    assert seller_handle not in engine.storage.open_orders
+    assert partial.status == OrderStatus.CANCELLED
+    assert len(engine.storage.order_books["MEMCOIN"]) == 0
+
+
+def test_cancel_open_orders_filters_by_ticker_and_side():
+    engine = make_engine()
+    engine.storage.instruments["DODGE"] = Instrument(name="Dodge", ticker="DODGE")
+    maker = make_user(engine, rub=10_000, memcoin=100)
+    engine.storage.balances[maker]["DODGE"] = 100
+    taker = make_user(engine, rub=10_000)
+
+    bid = submit(engine, limit(engine, maker, Direction.BUY, 5, 90))
+    ask = submit(engine, limit(engine, maker, Direction.SELL, 5, 110))
+    partial = submit(engine, limit(engine, maker, Direction.SELL, 5, 111))
+    other = submit(engine, limit(engine, maker, Direction.SELL, 5, 50, ticker="DODGE"))
+    submit(engine, limit(engine, taker, Direction.BUY, 7, 111))
+
+    results = asyncio.run(engine.cancel_open_orders(maker, "MEMCOIN", Direction.SELL))
+    assert [order for order, _ in results] == [partial]
+    assert results[0][1].detail == "Partially executed orders cannot be cancelled"
+
+    submit(engine, limit(engine, maker, Direction.SELL, 5, 120))
+    results = asyncio.run(engine.cancel_open_orders(maker))
+    cancelled = [order for order, error in results if error is None]
+    assert bid in cancelled and other in cancelled and len(cancelled) == 3
+    assert ask.status == OrderStatus.EXECUTED and partial.status == OrderStatus.PARTIALLY_EXECUTED
+    assert [order.id for order in engine.storage.open_orders[engine.storage.user_handle(maker)].values()] == [partial.id]
+    assert engine.storage.reserved[maker] == {"RUB": 0, "MEMCOIN": 3, "DODGE": 0}
+
+
+def test_batch_best_effort_keeps_valid_orders():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=10)
+    buyer = make_user(engine, rub=1_000)
+
+    ask = limit(engine, seller, Direction.SELL, 5, 100)
+    too_big = limit(engine, seller, Direction.SELL, 50, 101)
+    bid = limit(engine, buyer, Direction.BUY, 2, 100)
+    errors = asyncio.run(engine.place_orders([ask, too_big, bid]))
+
+    assert [error is None for error in errors] == [True, False, True]
+    assert too_big.id not in engine.storage.orders
+    assert ask.status == OrderStatus.PARTIALLY_EXECUTED and bid.status == OrderStatus.EXECUTED
+
+
+def test_batch_all_or_nothing_checks_cumulative_needs():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=10)
+    buyer = make_user(engine, rub=700)
+    submit(engine, limit(engine, seller, Direction.SELL, 3, 100))
+    submit(engine, limit(engine, seller, Direction.SELL, 3, 150))
+
+    # По отдельности каждая заявка проходит, но вместе им не хватает рублей:
+    # вторая достаётся уже уровнем 150 и стоит 450, всего 750
+    first = market(engine, buyer, Direction.BUY, 3)
+    second = market(engine, buyer, Direction.BUY, 4)
+    errors = asyncio.run(engine.place_orders([first, second], atomic=True))
+
+    assert errors[0] is None and errors[1].status_code == 400
+    assert first.status == OrderStatus.NEW and first.id not in engine.storage.orders
+    assert engine.storage.balances[buyer]["RUB"] == 700
+    assert len(engine.storage.order_books["MEMCOIN"]) == 2
+
+    errors = asyncio.run(engine.place_orders([first, market(engine, buyer, Direction.BUY, 2)], atomic=True))
+    assert errors == [None, None]
+    assert engine.storage.balances[buyer] == {"RUB": 700 - 3 * 100 - 2 * 150, "MEMCOIN": 5}
+
+
+def test_batch_cancel_all_or_nothing():
+    engine = make_engine()
+    buyer = make_user(engine, rub=1_000)
+    seller = make_user(engine, memcoin=10)
+    open_order = submit(engine, limit(engine, buyer, Direction.BUY, 1, 10))
+    filled = submit(engine, limit(engine, buyer, Direction.BUY, 1, 20))
+    submit(engine, market(engine, seller, Direction.SELL, 1))
+
+    errors = asyncio.run(engine.cancel_orders([open_order, filled], atomic=True))
+    assert errors[0] is None and errors[1] is not None
+    assert open_order.status == OrderStatus.NEW
+
+    errors = asyncio.run(engine.cancel_orders([open_order, filled]))
+    assert open_order.status == OrderStatus.CANCELLED and filled.status == OrderStatus.EXECUTED
+    assert len(engine.storage.order_books["MEMCOIN"]) == 0
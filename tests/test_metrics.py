@@ -0,0 +1,29 @@
+from app.schemas import Direction
+from app.services.metrics import Histogram, FILLS_PER_ORDER
+from tests.test_matching import make_engine, make_user, limit, market, submit
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_latency_seconds", "Test", [1_000, 10_000], labels=("route",), unit=1_000_000_000)
+    for value in (500, 1_000, 5_000, 50_000):
+        histogram.labels("/a").observe(value)
+
+    lines = list(histogram.render())
+    assert 'test_latency_seconds_bucket{route="/a",le="1e-06"} 2' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="1e-05"} 3' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_count{route="/a"} 4' in lines
+
+
+def test_engine_records_fills_per_order():
+    engine = make_engine()
+    seller = make_user(engine, memcoin=100)
+    buyer = make_user(engine, rub=10_000)
+    for price in (100, 101, 102):
+        submit(engine, limit(engine, seller, Direction.SELL, 1, price))
+
+    before = list(FILLS_PER_ORDER.default.counts)
+    submit(engine, market(engine, buyer, Direction.BUY, 3))
+    after = FILLS_PER_ORDER.default.counts
+    # Три сделки попадают в корзину le=5
+    assert [b - a for a, b in zip(before, after)] == [0, 0, 0, 1] + [0] * (len(after) - 4)
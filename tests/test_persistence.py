@@ -0,0 +1,111 @@
+import asyncio
+from uuid import uuid4
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.database import Storage
+from app.models import Base, UserDB, OrderDB, BalanceDB, TransactionDB
+from app.schemas import Direction, Instrument, OrderStatus, User, UserRole
+from app.services.keys import key_digest
+from app.services.orderbook import MatchingEngine
+from app.services.persistence import PersistenceWriter
+from tests.test_journal import order
+
+
+async def create_schema(url):
+    db = create_async_engine(url)
+    async with db.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await db.dispose()
+
+
+async def run_session(url):
+    await create_schema(url)
+
+    engine = MatchingEngine(Storage())
+    writer = PersistenceWriter(url, batch_size=3)
+    await writer.start(engine.storage)
+    engine.listeners.append(writer)
+
+    alice = User(id=uuid4(), name="alice", role=UserRole.USER, api_key=f"key-{uuid4()}")
+    bob = User(id=uuid4(), name="bobby", role=UserRole.USER, api_key=f"key-{uuid4()}")
+    await engine.register_user(alice, key_digest(alice.api_key))
+    await engine.register_user(bob, key_digest(bob.api_key))
+    await engine.add_instrument(Instrument(name="Memcoin", ticker="MEMCOIN"))
+    await engine.deposit(alice.id, "RUB", 10_000)
+    await engine.deposit(bob.id, "MEMCOIN", 50)
+
+    maker = order(engine, bob.id, Direction.SELL, 10, 100)
+    await engine.place_order(maker)
+    taker = order(engine, alice.id, Direction.BUY, 4)
+    await engine.place_order(taker)
+
+    await writer.stop()
+    return engine, writer, maker, taker
+
+
+def test_events_are_written_in_batches(tmp_path):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'exchange.db'}"
+    engine, writer, maker, taker = asyncio.run(run_session(url))
+
+    async def read():
+        db = create_async_engine(url)
+        async with db.connect() as conn:
+            users = (await conn.execute(select(UserDB.name))).scalars().all()
+            orders = {row.id: row for row in await conn.execute(select(OrderDB))}
+            balances = {(row.user_id, row.ticker): row.amount for row in await conn.execute(select(BalanceDB))}
+            trades = (await conn.execute(select(TransactionDB))).all()
+        await db.dispose()
+        return users, orders, balances, trades
+
+    users, orders, balances, trades = asyncio.run(read())
+    assert {"alice", "bobby"} <= set(users)
+    assert orders[maker.id].status == OrderStatus.PARTIALLY_EXECUTED and orders[maker.id].filled == 4
+    assert orders[taker.id].status == OrderStatus.EXECUTED and orders[taker.id].filled == 4
+    assert [(t.amount, t.order_id) for t in trades] == [(4, taker.id)]
+    for (user_id, ticker), amount in balances.items():
+        assert engine.storage.balances[user_id][ticker] == amount
+    assert writer.dropped == 0
+
+
+def test_failed_batch_is_retried_not_dropped(tmp_path):
+    async def scenario():
+        url = f"sqlite+aiosqlite:///{tmp_path / 'exchange.db'}"
+        await create_schema(url)
+        writer = PersistenceWriter(url, retry_delay=0.001)
+        await writer.start(Storage())
+        written = []
+
+        async def flaky_write(batch):
+            # База лежит первые две попытки
+            if writer.failures < 2:
+                raise ConnectionError("database is down")
+            written.extend(batch)
+
+        writer._write = flaky_write
+        writer.on_instrument(Instrument(name="Memcoin", ticker="MEMCOIN"))
+        await writer.stop()
+        return writer, written
+
+    writer, written = asyncio.run(scenario())
+    assert writer.failures == 2 and writer.dropped == 0
+    assert [row["ticker"] for _, row in written] == ["MEMCOIN"]
+    assert "exchange_persistence_failures_total 2" in list(writer.metrics())
+
+
+def test_stop_gives_up_when_database_stays_down(tmp_path):
+    async def scenario():
+        url = f"sqlite+aiosqlite:///{tmp_path / 'exchange.db'}"
+        await create_schema(url)
+        writer = PersistenceWriter(url, retry_delay=0.01, stop_timeout=0.05)
+        await writer.start(Storage())
+
+        async def down(batch):
+            raise ConnectionError("database is down")
+
+        writer._write = down
+        writer.on_instrument(Instrument(name="Memcoin", ticker="MEMCOIN"))
+        await writer.stop()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert writer.failures >= 1 and writer.in_flight == 1
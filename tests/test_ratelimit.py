@@ -0,0 +1,119 @@
+from uuid import uuid4
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.services.keys import key_digest
+from app.services.ratelimit import RateLimiter, RateLimitMiddleware, request_kind
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_limiter(clock, user=(1, 2), global_limit=(0, 0)):
+    limits = {"order": {"ANONYMOUS": (1, 1), "USER": user, "ADMIN": (0, 0)}}
+    return RateLimiter(limits, {"order": global_limit}, max_clients=100, clock=clock)
+
+
+def test_bucket_allows_a_burst_then_refills_at_the_rate():
+    clock = Clock()
+    limiter = make_limiter(clock)
+
+    assert limiter.check("alice", "USER", "order") == 0
+    assert limiter.check("alice", "USER", "order") == 0
+    assert limiter.check("alice", "USER", "order") == 1.0
+    # Чужая корзина и безлимитная роль не затронуты
+    assert limiter.check("bob", "USER", "order") == 0
+    assert all(limiter.check("admin", "ADMIN", "order") == 0 for _ in range(10))
+
+    clock.now = 0.5
+    assert limiter.check("alice", "USER", "order") == 0.5
+    clock.now = 1.0
+    assert limiter.check("alice", "USER", "order") == 0
+    assert limiter.throttled == {("order", "USER", "client"): 2}
+    assert limiter.throttled_clients == {"alice": 2}
+
+
+def test_global_limit_is_shared_and_refunds_the_client():
+    clock = Clock()
+    limiter = make_limiter(clock, user=(1, 1), global_limit=(1, 1))
+
+    assert limiter.check("alice", "USER", "order") == 0
+    assert limiter.check("bob", "USER", "order") == 1.0
+    assert limiter.throttled == {("order", "USER", "global"): 1}
+
+    # Отказ по общему лимиту не съел токен bob
+    clock.now = 1.0
+    assert limiter.check("bob", "USER", "order") == 0
+
+
+def test_middleware_answers_429_before_the_handler():
+    calls = []
+    app = FastAPI()
+
+    @app.post("/api/v1/order")
+    async def create_order():
+        calls.append(1)
+        return {"success": True}
+
+    @app.get("/api/v1/balance")
+    async def balance():
+        return {}
+
+    user_id = uuid4()
+
+    async def key_owner(digest):
+        return (user_id, "USER") if digest == key_digest("key-alice") else None
+
+    app.add_middleware(RateLimitMiddleware, limiter=make_limiter(Clock()), key_owner=key_owner)
+    client = TestClient(app)
+    headers = {"Authorization": "TOKEN key-alice"}
+
+    assert [client.post("/api/v1/order", headers=headers).status_code for _ in range(3)] == [200, 200, 429]
+    response = client.post("/api/v1/order", headers=headers)
+    assert response.headers["retry-after"] == "1" and response.json()["detail"] == "Too many requests"
+    assert len(calls) == 2
+    # Неизвестный ключ считается по адресу клиента с анонимным лимитом
+    assert [client.post("/api/v1/order", headers={"Authorization": "TOKEN nope"}).status_code
+            for _ in range(2)] == [200, 429]
+    assert all(client.get("/api/v1/balance").status_code == 200 for _ in range(5))
+
+
+def test_unknown_keys_pay_from_the_address_bucket_before_the_lookup():
+    app = FastAPI()
+
+    @app.post("/api/v1/order")
+    async def create_order():
+        return {"success": True}
+
+    user_id = uuid4()
+    lookups = []
+
+    async def key_owner(digest):
+        lookups.append(digest)
+        return (user_id, "USER") if digest == key_digest("key-alice") else None
+
+    middleware = RateLimitMiddleware(app, limiter=make_limiter(Clock()), key_owner=key_owner)
+    client = TestClient(middleware)
+    assert client.post("/api/v1/order", headers={"Authorization": "TOKEN key-alice"}).status_code == 200
+    # Случайные ключи: в движок уходит только то, что пропустил анонимный лимит адреса
+    statuses = [client.post("/api/v1/order", headers={"Authorization": f"TOKEN key-{uuid4()}"}).status_code
+                for _ in range(5)]
+    assert statuses == [200, 429, 429, 429, 429]
+    assert len(lookups) == 2
+    # Промахи не кэшируются и не вытесняют владельцев; первый запрос alice не съел токен адреса
+    assert list(middleware._owners) == [key_digest("key-alice")]
+    assert client.post("/api/v1/order", headers={"Authorization": "TOKEN key-alice"}).status_code == 200
+    assert len(lookups) == 2
+
+
+def test_request_kinds():
+    assert request_kind("POST", "/api/v1/order") == "order"
+    assert request_kind("POST", "/api/v1/orders/batch") == "order"
+    assert request_kind("DELETE", f"/api/v1/order/{uuid4()}") == "cancel"
+    assert request_kind("POST", "/api/v1/orders/batch/cancel") == "cancel"
+    assert request_kind("GET", "/api/v1/public/orderbook/MEMCOIN") == "public"
+    assert request_kind("GET", "/api/v1/order") is None
@@ -0,0 +1,56 @@
+import asyncio
+from uuid import uuid4
+from app.database import Storage
+from app.schemas import Direction, Instrument, User, UserRole
+from app.services.journal import Journal
+from app.services.keys import key_digest
+from app.services.orderbook import MatchingEngine
+from app.services.snapshot import Snapshotter, load_snapshot
+from tests.test_journal import order, state
+
+
+async def run_session(journal_path, snapshot_path):
+    engine = MatchingEngine(Storage())
+    journal = Journal(journal_path)
+    journal.open()
+    engine.journal = journal
+    snapshotter = Snapshotter(engine, snapshot_path, interval=60)
+
+    alice = User(id=uuid4(), name="alice", role=UserRole.USER, api_key=f"key-{uuid4()}")
+    bob = User(id=uuid4(), name="bobby", role=UserRole.USER, api_key=f"key-{uuid4()}")
+    await engine.register_user(alice, key_digest(alice.api_key))
+    await engine.register_user(bob, key_digest(bob.api_key))
+    await engine.add_instrument(Instrument(name="Memcoin", ticker="MEMCOIN"))
+    await engine.deposit(alice.id, "RUB", 10_000)
+    await engine.deposit(bob.id, "MEMCOIN", 50)
+    for price in (101, 102, 102, 103):
+        await engine.place_order(order(engine, bob.id, Direction.SELL, 2, price))
+    await engine.place_order(order(engine, alice.id, Direction.BUY, 3))
+
+    assert await snapshotter.take()
+    assert not await snapshotter.take()
+
+    await engine.place_order(order(engine, alice.id, Direction.BUY, 2, 102))
+    resting = order(engine, alice.id, Direction.BUY, 4, 100)
+    await engine.place_order(resting)
+    await engine.cancel_order(resting)
+    await engine.deposit(alice.id, "RUB", 500)
+
+    await journal.close()
+    return engine, snapshotter.last_seq
+
+
+def test_restore_from_snapshot_and_journal_tail(tmp_path):
+    journal_path = str(tmp_path / "journal.bin")
+    snapshot_path = str(tmp_path / "journal.bin.snapshot")
+    engine, snapshot_seq = asyncio.run(run_session(journal_path, snapshot_path))
+    assert snapshot_seq == 10
+
+    restored = MatchingEngine(Storage())
+    assert load_snapshot(restored, snapshot_path) == snapshot_seq
+    replayed = asyncio.run(restored.replay(Journal(journal_path).read(after_seq=snapshot_seq)))
+
+    assert replayed == 4
+    assert state(restored.storage) == state(engine.storage)
+    open_users = {engine.storage.user_ids[handle] for handle in engine.storage.open_orders}
+    assert {restored.storage.user_ids[handle] for handle in restored.storage.open_orders} == open_users
@@ -0,0 +1,34 @@
+import json
+from app.schemas import Direction
+from app.services.userfeed import UserFeed
+from tests.test_matching import make_engine, make_user, limit, market, submit
+
+
+def drain(subscription):
+    messages = []
+    while not subscription.queue.empty():
+        messages.append(json.loads(subscription.queue.get_nowait()))
+    return messages
+
+
+def test_user_receives_own_orders_fills_and_balances():
+    engine = make_engine()
+    feed = UserFeed(engine.storage)
+    engine.listeners.append(feed)
+    seller = make_user(engine, memcoin=10)
+    buyer = make_user(engine, rub=1_000)
+    resting = submit(engine, limit(engine, seller, Direction.SELL, 5, 100))
+
+    subscription = feed.connect(seller)
+    submit(engine, market(engine, buyer, Direction.BUY, 2))
+
+    snapshot, *events = drain(subscription)
+    assert snapshot["type"] == "snapshot" and [o["id"] for o in snapshot["orders"]] == [str(resting.id)]
+    assert snapshot["balances"] == {"RUB": 0, "MEMCOIN": 10}
+    assert [e["type"] for e in events] == ["balance", "balance", "fill", "order"]
+    assert {(e["ticker"], e["amount"]) for e in events[:2]} == {("RUB", 200), ("MEMCOIN", 8)}
+    assert events[2]["order_id"] == str(resting.id) and events[2]["qty"] == 2 and events[2]["filled"] == 2
+    assert events[3]["order"]["status"] == "PARTIALLY_EXECUTED"
+
+    feed.disconnect(subscription)
+    assert not feed.subscribers